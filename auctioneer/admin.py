@@ -1,7 +1,12 @@
 from django.conf import settings
 from django.contrib import admin
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
 
-from auctioneer.models import KeywordBidRule
+from auctioneer.controllers import what_if
+from auctioneer.models import KeywordBidRule, KeywordBidChange
 from common.task_runner.admin import ExtendedResultDataKw, KeywordbidTaskInline
 
 
@@ -10,7 +15,62 @@ class KeyworBidAdmin(admin.ModelAdmin):
     actions = None
     inlines = [KeywordbidTaskInline, ExtendedResultDataKw]
     list_display = ('title', 'account', 'target_bid_diff', 'bid_increase_percentage', 'max_bid')
+    readonly_fields = ('what_if_link',)
+
+    def get_urls(self):
+        urls = [path('<int:rule_id>/what-if/', self.admin_site.admin_view(self.what_if),
+                     name='auctioneer_keywordbidrule_what_if')]
+        return urls + super().get_urls()
+
+    def what_if(self, request, rule_id: int):
+        """
+        Simulate rule over auction snapshot of its targets. Comma separated parameter values are taken from query,
+        e.g. ``?target_bid_diff=5,10&bid_increase_percentage=10,20&max_bid=50``
+        """
+        kw_bid_rule = get_object_or_404(KeywordBidRule.objects.select_related('account'), id=rule_id)
+        try:
+            grid = {f'{param}s': [int(value) for value in request.GET[param].split(',') if value.strip()]
+                    for param in what_if.GRID_PARAMS if request.GET.get(param)}
+            variants = what_if.rule_variants(kw_bid_rule, **grid)
+        except ValueError as e:
+            return HttpResponseBadRequest(f'Invalid parameters: {e}')
+        results = what_if.simulate_rule(kw_bid_rule, variants)
+        if results is None:
+            return HttpResponse(f'No auction snapshot of rule "{kw_bid_rule}" targets. Run the rule first')
+        header = ('Target bid diff (%)', 'Bid increase (%)', 'Max bid (RUB)', 'Keywords', 'Changed', 'Min bid',
+                  'P25 bid', 'Median bid', 'P75 bid', 'Max bid', 'Mean bid', 'Spend delta')
+        rows = format_html_join('', '<tr>{}</tr>', (
+            (format_html_join('', '<td>{}</td>', (
+                (value,) for value in (result['target_bid_diff'], result['bid_increase_percentage'],
+                                       result['max_bid'], result['keywords'], result['changed'],
+                                       *result['bids'].values(), result['spend_delta']))),)
+            for result in results))
+        return HttpResponse(format_html(
+            '<h1>What-if: {}</h1><table border="1"><tr>{}</tr>{}</table>', kw_bid_rule,
+            format_html_join('', '<th>{}</th>', ((name,) for name in header)), rows))
+
+    def what_if_link(self, obj):
+        if not obj.id:
+            return '-'
+        url = reverse('admin:auctioneer_keywordbidrule_what_if', args=[obj.id])
+        return format_html('<a href="{}">what-if simulation</a>', url)
+
+
+class KeywordBidChangeAdmin(admin.ModelAdmin):
+    """"""
+    actions = None
+    list_display = ('keyword_id', 'old_bid', 'new_bid', 'first_auction_bid', 'second_auction_bid', 'run_id',
+                    'created_at')
+    search_fields = ('=keyword_id', '=run_id')
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(KeywordBidRule, KeyworBidAdmin)
+admin.site.register(KeywordBidChange, KeywordBidChangeAdmin)
 admin.site.site_header = f"Auctioneer. The Direct Marketing Tool v.{settings.VERSION}"
@@ -0,0 +1,248 @@
+"""
+Performance benchmarks of the get-calculate-set cycle.
+
+Every benchmark case times one stage of the cycle on a synthetic data set of a given number of keywords.
+Data is generated by :py:mod:`common.http.simulator`. Full cycle case runs :py:func:`auctioneer.main.run`
+against a mocked gateway: the first run is recorded from in-process simulator, timed runs replay recorded traffic,
+so network and simulator data generation are not measured. Auction snapshot is disabled, so timed runs read
+keyword bids from replayed API too, and run files are written to a temporary directory::
+
+    results = run_benchmarks(sizes=[10_000, 100_000], repeat=3)
+    regressions = [c for c in compare(results, baseline) if c['regression']]
+
+Run it with ``python manage.py benchmark``.
+"""
+import gc
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from logging import getLogger
+from math import ceil
+from unittest import mock
+
+import requests
+from django.test import override_settings
+
+from auctioneer import controllers, entities, main, models
+from common import http
+from common.account.models import Account
+from common.http import simulator
+from common.http.client import HttpResponseResult
+from common.http.utils import formatter, Chunker
+
+_logger = getLogger(__name__)
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_THRESHOLD = 0.1
+MIN_DELTA = 0.005       #: absolute slowdown in seconds below which a case is not considered a regression
+SAMPLE_SIZE = 10_000    #: number of distinct keywords in data set. Larger data sets repeat them
+PAGE_SIZE = 10_000      #: YD API page size
+
+BENCHMARK_RULE = entities.KeywordBidRule(account=0, target_type='CampaignIds', target_values=[],
+                                         target_bid_diff=0.1, bid_increase_percentage=0.1, max_bid=100_000_000)
+
+
+def _consume(iterator):
+    deque(iterator, maxlen=0)
+
+
+def _sample(size: int) -> list:
+    """Keyword bids data of ``size`` keywords in YD API format"""
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=ceil(SAMPLE_SIZE / 100), keywords=100)
+    keyword_ids = account.select_keyword_ids({'CampaignIds': list(account.campaign_ids())})
+    sample = [account.keyword_bid(i) for i in islice(keyword_ids, min(size, SAMPLE_SIZE))]
+    return [sample[i % len(sample)] for i in range(size)]
+
+
+@contextmanager
+def map_keyword_bids(size: int):
+    data = _sample(size)
+    yield lambda: _consume(controllers.keyword_bids.map_keyword_bids(iter(data)))
+
+
+@contextmanager
+def apply_bid_rule(size: int):
+    kw_bids = list(controllers.keyword_bids.map_keyword_bids(_sample(size)))
+    yield lambda: _consume(controllers.bid_calculator.apply_bid_rule(BENCHMARK_RULE, iter(kw_bids), memo=None))
+
+
+@contextmanager
+def apply_bid_rule_memo(size: int):
+    kw_bids = list(controllers.keyword_bids.map_keyword_bids(_sample(size)))
+    yield lambda: _consume(controllers.bid_calculator.apply_bid_rule(BENCHMARK_RULE, iter(kw_bids),
+                                                                     memo=controllers.bid_calculator.BidMemo()))
+
+
+@contextmanager
+def formatter_pages(size: int):
+    data = _sample(size)
+    pages = [{'KeywordBids': data[i:i + PAGE_SIZE]} for i in range(0, size, PAGE_SIZE)]
+    yield lambda: _consume(formatter((page for page in pages), key='KeywordBids'))
+
+
+@contextmanager
+def chunker(size: int):
+    data = [{'KeywordId': kw['KeywordId'], 'SearchBid': kw['Search']['Bid']} for kw in _sample(size)]
+    yield lambda: _consume(Chunker(data, limit=PAGE_SIZE))
+
+
+@contextmanager
+def http_response_result(size: int):
+    data = _sample(size)
+    responses = []
+    for i in range(0, size, PAGE_SIZE):
+        response = requests.Response()
+        response.status_code = 200
+        response.encoding = 'utf-8'
+        response._content = json.dumps({'result': {'KeywordBids': data[i:i + PAGE_SIZE]}}).encode()
+        responses.append(response)
+    yield lambda: _consume(HttpResponseResult(response).result() for response in responses)
+
+
+@contextmanager
+def main_run(size: int):
+    campaigns = 10
+    keywords = max(min(size // campaigns, 100), 1)
+    account = simulator.SimulatedAccount(campaigns=campaigns, ad_groups=max(size // (campaigns * keywords), 1),
+                                         keywords=keywords)
+    api = simulator.YdApiSimulator(account, units_limit=2 ** 62)
+    rule = models.KeywordBidRule(id=0, title='benchmark', account=Account(id=0), target_type=1,
+                                 target_values=list(account.campaign_ids()), target_bid_diff=10,
+                                 bid_increase_percentage=10, max_bid=100)
+    gateway = http.YandexDirectGateway(token='benchmark')
+    with tempfile.TemporaryDirectory() as tmpdir, \
+            override_settings(KEYWORD_BID_HISTORY_ENABLED=False, KEYWORD_BID_FINGERPRINTS_ENABLED=False,
+                              KEYWORD_BID_CHUNK_PLANNER_ENABLED=False, KEYWORD_BID_SNAPSHOT_ENABLED=False,
+                              KEYWORD_BID_SNAPSHOT_DIR=tmpdir, KEYWORD_BID_CHECKPOINT_DIR=tmpdir,
+                              YD_RESPONSE_CACHE_DIR=tmpdir, YD_TRAFFIC_RECORD_DIR=None), \
+            mock.patch.object(main.controllers.keyword_bid_rule, 'get_keywordbid_rule', return_value=rule), \
+            mock.patch.object(main.account, 'make_yd_gateway', return_value=gateway):
+        path = os.path.join(tmpdir, 'traffic.jsonl.gz')
+        recorder = http.HttpRecorder(path)
+        gateway.client.configure(transport=simulator.SimulatorAdapter(api), recorder=recorder)
+        try:
+            main.run(rule.id)
+        finally:
+            gateway.client.configure(recorder=None)
+            recorder.close()
+        gateway.client.configure(transport=http.ReplayAdapter(path, latency=0))
+
+        def run():
+            controllers.bid_calculator.bid_memo.clear()
+            main.run(rule.id)
+        try:
+            yield run
+        finally:
+            gateway.client.configure(transport=None)
+
+
+BENCHMARKS = OrderedDict([
+    ('map_keyword_bids', map_keyword_bids),
+    ('apply_bid_rule', apply_bid_rule),
+    ('apply_bid_rule_memo', apply_bid_rule_memo),
+    ('formatter', formatter_pages),
+    ('chunker', chunker),
+    ('http_response_result', http_response_result),
+    ('main_run', main_run),
+])
+"""Benchmark cases. A case is a context manager that prepares data set of a given size and yields a callable to time"""
+
+
+def run_case(name: str, size: int, repeat: int = 3) -> dict:
+    """
+    Time benchmark case
+
+    :param name:        case name from :py:data:`BENCHMARKS`
+    :param size:        number of keywords in data set
+    :param repeat:      number of timed runs
+    :type name:         str
+    :type size:         int
+    :type repeat:       int
+    :rtype:             dict
+    :return:            case timings in seconds
+    """
+    with BENCHMARKS[name](size) as target:
+        times = []
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            target()
+            times.append(time.perf_counter() - start)
+    best = min(times)
+    return {
+        'case': name,
+        'size': size,
+        'repeat': repeat,
+        'times': times,
+        'min': best,
+        'median': statistics.median(times),
+        'items_per_second': size / best if best else None,
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, cases=None, repeat: int = 3) -> dict:
+    """
+    Run benchmark cases for every data set size
+
+    :param sizes:       data set sizes
+    :param cases:       case names to run. All cases are run if None
+    :param repeat:      number of timed runs of every case
+    :type sizes:        Iterable[int]
+    :type cases:        Iterable[str]
+    :type repeat:       int
+    :rtype:             dict
+    :return:            machine-readable benchmark results
+    """
+    results = []
+    for size in sizes:
+        for name in cases or BENCHMARKS:
+            _logger.info(f'Benchmark {name} with {size} keywords')
+            results.append(run_case(name, size, repeat))
+    return {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> [dict]:
+    """
+    Compare benchmark results to a baseline. Best run time of every case is compared.
+    Cases missing in baseline are skipped, slowdowns under :py:data:`MIN_DELTA` are considered timer noise.
+
+    :param results:     results of :py:func:`run_benchmarks`
+    :param baseline:    baseline results of :py:func:`run_benchmarks`
+    :param threshold:   relative slowdown considered a regression, e.g. 0.1 is 10% slower than baseline
+    :type results:      dict
+    :type baseline:     dict
+    :type threshold:    float
+    :rtype:             [dict]
+    :return:            comparison of every case present in both results
+    """
+    baseline_times = {(r['case'], r['size']): r['min'] for r in baseline['results']}
+    comparison = []
+    for result in results['results']:
+        base = baseline_times.get((result['case'], result['size']))
+        if not base:
+            continue
+        change = result['min'] / base - 1
+        comparison.append({
+            'case': result['case'],
+            'size': result['size'],
+            'baseline': base,
+            'current': result['min'],
+            'change': change,
+            'regression': change > threshold and result['min'] - base > MIN_DELTA,
+        })
+    return comparison
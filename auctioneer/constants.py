@@ -3,3 +3,8 @@ KEYWORD_BID_TARGET_TYPES = (
     (2, "AdGroupIds"),
     (3, "KeywordIds")
 )
+
+KEYWORD_SERVING_STATUSES = (
+    ('ELIGIBLE', 'Eligible'),
+    ('RARELY_SERVED', 'Rarely served')
+)
@@ -1 +1,2 @@
-from . import keyword_bid_rule, keyword_bids, bid_calculator
+from . import keyword_bid_rule, keyword_bids, bid_calculator, bid_history, fingerprints, reference_data, \
+    chunk_planner, checkpoint, resubmit, auction_snapshot, columnar, what_if
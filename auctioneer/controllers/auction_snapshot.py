@@ -0,0 +1,279 @@
+"""
+Controllers for auction snapshots shared between rules and runs.
+
+Several rules of an account often target the same keywords, and every rule fetches their auction bids again even
+if another rule fetched them seconds earlier. Snapshot store keeps keyword bids received from Yandex Direct per
+account, so that targets fetched within max age are read from it instead of API::
+
+    store = AuctionSnapshotStore.for_account(account_id)
+    chunks, cached = store.split(chunks, params)            # targets older than max age are requested
+    data = chain(store.read(cached, params), store.record(gateway.keyword_bids_gen(chunks=chunks, ...), params))
+    results = store.record_results(set_keyword_bids(gateway, store.record_bids(kw_bids)))   # keep bids up to date
+    store.export(cached, params, '/tmp/batch.kwb')          # columnar batch of stored keyword bids
+
+Store is a SQLite database per account in WAL mode, so it's shared between worker processes. Every fetched
+target (campaign, ad group or keyword of selection criteria) is listed with time it was fetched at, fields and
+serving statuses. Keyword bids of a target are read only if they were fetched no earlier than the target itself,
+so keywords removed from Yandex Direct are not read from older snapshots.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Iterator
+
+from django.conf import settings
+
+from common.http import constants
+from . import columnar
+from .. import entities
+
+_logger = logging.getLogger(__name__)
+
+TARGET_COLUMNS = {'KeywordIds': 'keyword_id', 'AdGroupIds': 'ad_group_id', 'CampaignIds': 'campaign_id'}
+BATCH_SIZE = 1000       # keyword bids written with one transaction
+MAX_VARIABLES = 500     # ids of one sql query
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keyword_bids (
+    keyword_id INTEGER PRIMARY KEY,
+    campaign_id INTEGER,
+    ad_group_id INTEGER,
+    serving_status TEXT,
+    bid INTEGER,
+    data TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS keyword_bids_campaign ON keyword_bids (campaign_id);
+CREATE INDEX IF NOT EXISTS keyword_bids_ad_group ON keyword_bids (ad_group_id);
+CREATE TABLE IF NOT EXISTS targets (
+    target TEXT NOT NULL,
+    target_id INTEGER NOT NULL,
+    fields TEXT NOT NULL,
+    statuses TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (target, target_id)
+);
+"""
+
+
+def _batches(items: list, size: int):
+    return (items[i:i + size] for i in range(0, len(items), size))
+
+
+def _fields(params: dict) -> dict:
+    """Requested fields of keyword bids request params"""
+    return {'field_names': sorted(params.get('field_names') or constants.YD_KEYWORD_BIDS_FIELDNAMES),
+            'search_field_names': sorted(params.get('search_field_names') or ()),
+            'network_field_names': sorted(params.get('network_field_names') or ())}
+
+
+def _statuses(params: dict) -> list:
+    """Requested serving statuses, empty if keywords of any status are requested"""
+    return sorted(params['selection_criteria'].get('ServingStatuses') or ())
+
+
+def _covers(fields: dict, statuses: list, stored_fields: dict, stored_statuses: list) -> bool:
+    """Keyword bids stored for a target have every requested field and serving status"""
+    return all(set(names) <= set(stored_fields.get(param, ())) for param, names in fields.items()) and \
+        (not stored_statuses or bool(statuses) and set(statuses) <= set(stored_statuses))
+
+
+def _project(item: dict, fields: dict) -> dict:
+    """Keep requested fields of stored keyword bid"""
+    result = {k: v for k, v in item.items() if k in fields['field_names']}
+    for key, param in (('Search', 'search_field_names'), ('Network', 'network_field_names')):
+        if fields[param] and type(item.get(key)) is dict:
+            result[key] = {k: v for k, v in item[key].items() if k in fields[param]}
+    return result
+
+
+class AuctionSnapshotStore:
+    """
+    Keyword bids of one account received from Yandex Direct
+    """
+    #: YD API keyword bid fields keyword bids are read from store by
+    field_names = ('KeywordId', 'AdGroupId', 'CampaignId', 'ServingStatus')
+
+    def __init__(self, path: str, max_age: float, retention: float = 24 * 3600):
+        """
+        :param path:        database file path
+        :param max_age:     seconds keyword bids of a target are read from store after they were fetched
+        :param retention:   seconds keyword bids are kept after they were fetched
+        :type path:         str
+        :type max_age:      float
+        :type retention:    float
+        """
+        self.path = path
+        self.max_age = max_age
+        self.retention = retention
+        self.hits = self.misses = 0     # targets read from store and requested from API
+        self._sent = {}                 # keyword id: bid which was sent to be set
+        self._connection = None
+
+    @classmethod
+    def for_account(cls, account_id: int) -> 'AuctionSnapshotStore':
+        """Get store of an account from ``KEYWORD_BID_SNAPSHOT_DIR``"""
+        return cls(os.path.join(settings.KEYWORD_BID_SNAPSHOT_DIR, f'account_{account_id}.sqlite3'),
+                   max_age=settings.KEYWORD_BID_SNAPSHOT_MAX_AGE, retention=settings.KEYWORD_BID_SNAPSHOT_RETENTION)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # writers of other processes are waited for
+            self._connection = sqlite3.connect(self.path, timeout=30)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            # snapshot is a cache, it's fine to lose the last transactions on power loss
+            self._connection.execute('PRAGMA synchronous=OFF')
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def split(self, chunks: list, params: dict) -> (list, dict):
+        """
+        Split request chunks to targets which should be requested from API and ones which are read from store
+
+        :param chunks:  selection criteria of every request, e.g. ``[{'CampaignIds': [1, 2]}]``
+        :param params:  keyword bids request params: selection criteria and fields
+        :type chunks:   list
+        :type params:   dict
+        :rtype:         (list, dict)
+        :return:        chunks of targets to request and ids of targets to read: ``{'CampaignIds': [1]}``
+        """
+        fields, statuses = _fields(params), _statuses(params)
+        fetched_after = time.time() - self.max_age
+        requested, cached = [], {}
+        for chunk in chunks:
+            for target, ids in chunk.items():
+                fresh = set()
+                for batch in _batches(ids, MAX_VARIABLES):
+                    rows = self.connection.execute(
+                        f'SELECT target_id, fields, statuses FROM targets WHERE target = ? AND fetched_at >= ? '
+                        f'AND target_id IN ({",".join("?" * len(batch))})', (target, fetched_after, *batch))
+                    fresh.update(target_id for target_id, stored_fields, stored_statuses in rows
+                                 if _covers(fields, statuses, json.loads(stored_fields), json.loads(stored_statuses)))
+                stale = [target_id for target_id in ids if target_id not in fresh]
+                if stale:
+                    requested.append({target: stale})
+                if fresh:
+                    cached.setdefault(target, []).extend(target_id for target_id in ids if target_id in fresh)
+                self.hits += len(ids) - len(stale)
+                self.misses += len(stale)
+        return requested, cached
+
+    def read(self, cached: dict, params: dict) -> Iterator[dict]:
+        """
+        Keyword bids data of targets from store, in format of YD API keyword bids
+
+        :param cached:  ids of targets: ``{'CampaignIds': [1, 2]}``
+        :param params:  keyword bids request params: selection criteria and fields
+        :type cached:   dict
+        :type params:   dict
+        :rtype:         Iterator[dict]
+        """
+        fields, statuses = _fields(params), _statuses(params)
+        for target, ids in cached.items():
+            column = TARGET_COLUMNS[target]
+            for batch in _batches(ids, MAX_VARIABLES):
+                query = f'SELECT k.data, k.bid FROM keyword_bids k JOIN targets t ON t.target = ? ' \
+                        f'AND t.target_id = k.{column} WHERE k.{column} IN ({",".join("?" * len(batch))}) ' \
+                        f'AND k.fetched_at >= t.fetched_at'
+                args = (target, *batch)
+                if statuses:
+                    query += f' AND k.serving_status IN ({",".join("?" * len(statuses))})'
+                    args += tuple(statuses)
+                for data, bid in self.connection.execute(query, args).fetchall():
+                    item = json.loads(data)
+                    if type(item.get('Search')) is dict and 'Bid' in item['Search']:
+                        item['Search']['Bid'] = bid
+                    yield _project(item, fields)
+
+    def export(self, cached: dict, params: dict, path: str) -> int:
+        """
+        Write keyword bids of targets from store to a columnar batch file.
+        See :py:class:`auctioneer.controllers.columnar.KeywordBidBatch`
+
+        :param cached:  ids of targets: ``{'CampaignIds': [1, 2]}``
+        :param params:  keyword bids request params: selection criteria and fields
+        :param path:    batch file path
+        :type cached:   dict
+        :type params:   dict
+        :type path:     str
+        :rtype:         int
+        :return:        number of keyword bids written
+        """
+        return columnar.write_batch(path, self.read(cached, params))
+
+    def record(self, kw_bid_data: Iterator[dict], params: dict) -> Iterator[dict]:
+        """
+        Save keyword bids data received from API while it's passed through. Targets of request chunks are listed
+        as fetched only if all data was received without errors
+
+        :param kw_bid_data:     keyword bids data of ``params['chunks']`` requests
+        :param params:          keyword bids request params: selection criteria, chunks and fields
+        :type kw_bid_data:      Iterator[dict]
+        :type params:           dict
+        :rtype:                 Iterator[dict]
+        """
+        fetched_at = time.time()
+        batch, complete = [], True
+        for item in kw_bid_data:
+            if type(item) is dict and 'KeywordId' in item:
+                batch.append(item)
+                if len(batch) >= BATCH_SIZE:
+                    self._write(batch, fetched_at)
+                    batch = []
+            else:
+                complete = False
+            yield item
+        self._write(batch, fetched_at)
+        if complete:
+            self._fetched(params, fetched_at)
+
+    def _write(self, items: [dict], fetched_at: float):
+        if not items:
+            return
+        rows = ((item['KeywordId'], item.get('CampaignId'), item.get('AdGroupId'), item.get('ServingStatus'),
+                 (item.get('Search') or {}).get('Bid'), json.dumps(item), fetched_at) for item in items)
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO keyword_bids VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def _fetched(self, params: dict, fetched_at: float):
+        fields, statuses = json.dumps(_fields(params)), json.dumps(_statuses(params))
+        rows = [(target, target_id, fields, statuses, fetched_at)
+                for chunk in params.get('chunks') or () for target, ids in chunk.items() for target_id in ids]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?)', rows)
+            # keyword bids and targets which can't be read anymore
+            self.connection.execute('DELETE FROM keyword_bids WHERE fetched_at < ?', (fetched_at - self.retention,))
+            self.connection.execute('DELETE FROM targets WHERE fetched_at < ?', (fetched_at - self.retention,))
+
+    def record_bids(self, kw_bids: Iterator[entities.KeywordBid]) -> Iterator[entities.KeywordBid]:
+        """Remember bids which are sent to be set"""
+        for kw_bid in kw_bids:
+            self._sent[kw_bid.keyword_id] = (kw_bid.search or {}).get('Bid')
+            yield kw_bid
+
+    def record_results(self, results: Iterator[dict]) -> Iterator[dict]:
+        """Update stored bids of keywords which were set while set results are passed through"""
+        batch = []
+        for result in results:
+            keyword_id = result.get('KeywordId') if type(result) is dict and not result.get('Errors') else None
+            if keyword_id in self._sent:
+                batch.append((self._sent.pop(keyword_id), keyword_id))
+                if len(batch) >= BATCH_SIZE:
+                    self._update_bids(batch)
+                    batch = []
+            yield result
+        self._update_bids(batch)
+
+    def _update_bids(self, rows: [tuple]):
+        if rows:
+            with self.connection:
+                self.connection.executemany('UPDATE keyword_bids SET bid = ? WHERE keyword_id = ?', rows)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
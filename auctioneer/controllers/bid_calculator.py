@@ -16,9 +16,13 @@ multiple formulas with target keyword bid.
 
 """
 
+from collections import OrderedDict
 from functools import reduce, partial
+from threading import Lock
 from types import GeneratorType
 from typing import Iterator
+
+from common import timing, tracing
 from .. import formulas, entities
 
 # formulas will be applied in order
@@ -26,9 +30,91 @@ BID_CALCULATION_FORMULAS = (
     formulas.SearchBidFormula,
 )
 
+BID_MEMO_SIZE = 100_000
+
+# keyword bid fields which are always requested: set requests are made by keyword id
+REQUIRED_FIELD_NAMES = ('KeywordId',)
+
+
+def request_fields(consumers: tuple = BID_CALCULATION_FORMULAS) -> dict:
+    """
+    Yandex Direct API keyword bid fields used by formulas and other keyword bids consumers.
+    Result can be passed to :py:meth:`common.http.YandexDirectGateway.keyword_bids_gen`::
+
+        gateway.keyword_bids_gen(selection_criteria={...}, **request_fields())
+
+    :param consumers:       formulas or other objects declaring ``field_names``, ``search_field_names`` and \
+    ``network_field_names`` they read
+    :type consumers:        tuple
+    :rtype:                 dict
+    :return:                union of fields of all consumers
+    """
+    fields = {'field_names': list(REQUIRED_FIELD_NAMES), 'search_field_names': [], 'network_field_names': []}
+    for consumer in consumers:
+        for param, names in fields.items():
+            names.extend(name for name in getattr(consumer, param, ()) if name not in names)
+    return fields
+
+
+class BidMemo:
+    """
+    Bounded LRU memo of calculated search bids.
 
+    Keywords of the same campaign often have the same auction and the same current bid. Calculation result
+    of such keywords is the same, so formulas are run only once for them. Memo is keyed on formulas chain,
+    rule parameters, current search bid and bids of the first two auction items::
+
+        memo = BidMemo(maxsize=1000)
+        calculated = apply_bid_rule(kw_bid_rule, kw_bids, memo=memo)
+        memo.info()     # {'hits': 10, 'misses': 2, 'size': 2, 'maxsize': 1000}
+
+    Memo assumes that formulas change nothing but keyword search bid and use nothing but the first two auction items.
+    """
+    def __init__(self, maxsize: int = BID_MEMO_SIZE):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self) -> dict:
+        """Memo hit/miss counters"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+
+bid_memo = BidMemo()
+"""Default memo shared between calculations"""
+
+
+@tracing.traced('calculate')
+@timing.timed('calculate')
 def apply_bid_rule(kw_bid_rule: entities.KeywordBidRule, kw_bids: Iterator[entities.KeywordBid],
-                   formulas_collection: tuple=BID_CALCULATION_FORMULAS) -> iter:
+                   formulas_collection: tuple=BID_CALCULATION_FORMULAS, memo: BidMemo = bid_memo) -> iter:
     """
     Apply calculation formulas to multiple keyword bids
 
@@ -57,13 +143,19 @@ def apply_bid_rule(kw_bid_rule: entities.KeywordBidRule, kw_bids: Iterator[entit
     :param kw_bid_rule:             a rule parameters to use in formulas
     :param kw_bids:                 keyword bids entities
     :param formulas_collection:     formulas to apply to each keyword bid. Will be applied in order
+    :param memo:                    memo of calculated bids. Pass None to run formulas on every keyword bid
     :type kw_bid_rule:              entities.KeywordBidRule
     :type kw_bids:                  GeneratorType
     :type formulas_collection:      tuple
+    :type memo:                     BidMemo
     :rtype:                         iter
     :return:                        processed keyword bids
     """
-    calculate = partial(_chain_apply, rule=kw_bid_rule, formulas_collection=formulas_collection)
+    if memo is None:
+        calculate = partial(_chain_apply, rule=kw_bid_rule, formulas_collection=formulas_collection)
+    else:
+        calculate = partial(_memo_chain_apply, rule=kw_bid_rule, formulas_collection=formulas_collection, memo=memo,
+                            memo_prefix=(formulas_collection, rule_params(kw_bid_rule)))
     kw_bids_calculated = map(calculate, kw_bids)
     return kw_bids_calculated
 
@@ -77,3 +169,31 @@ def _chain_apply(keyword_bid: entities.KeywordBid,
     """
     result = reduce(lambda kw, formula: formula(kw, rule).apply(), formulas_collection, keyword_bid)
     return result
+
+
+def _memo_chain_apply(keyword_bid: entities.KeywordBid,
+                      rule: entities.KeywordBidRule,
+                      formulas_collection: [formulas.KeywordBidFormula],
+                      memo: BidMemo,
+                      memo_prefix: tuple) -> entities.KeywordBid:
+    """
+    Same as :py:func:`_chain_apply` but looks up calculated search bid in memo first
+    """
+    search = keyword_bid.search
+    if not search:
+        return _chain_apply(keyword_bid, rule, formulas_collection)
+    auction_items = (search.get('AuctionBids') or {}).get('AuctionBidItems') or ()
+    key = (*memo_prefix, search.get('Bid'), *(item.get('Bid') for item in auction_items[:2]))
+    bid = memo.get(key)
+    if bid is not None:
+        search['Bid'] = bid
+        return keyword_bid
+    result = _chain_apply(keyword_bid, rule, formulas_collection)
+    memo.set(key, result.search.get('Bid'))
+    return result
+
+
+def rule_params(rule: entities.KeywordBidRule) -> tuple:
+    """Rule calculation parameters. Rule targets are not hashable and don't affect calculation"""
+    return tuple(v for k, v in rule._asdict().items()
+                 if k not in ('target_type', 'target_values', 'serving_statuses'))
@@ -0,0 +1,164 @@
+"""
+Controllers for keyword bids history.
+
+Every keyword bid changed by a rule run is stored as :py:class:`auctioneer.models.KeywordBidChange`.
+History is written out of the get-calculate-set cycle: changes are collected into batches and handed over
+to a background flusher thread that streams them into Postgres with ``COPY``::
+
+    with KeywordBidHistoryWriter(run_id) as history:
+        kw_bids = history.watch(get_keyword_bids(gateway, **params))   # remember bids before calculation
+        kw_bids = history.record(bid_calculator.apply_bid_rule(rule, kw_bids))   # collect changed bids
+        set_keyword_bids(gateway, kw_bids)
+
+"""
+import io
+import logging
+import queue
+import threading
+from datetime import timedelta
+from typing import Iterator
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .. import models, entities
+
+_logger = logging.getLogger(__name__)
+
+_COPY_COLUMNS = ('run_id', 'keyword_id', 'old_bid', 'new_bid', 'first_auction_bid', 'second_auction_bid',
+                 'created_at')
+
+
+class KeywordBidHistoryWriter:
+    """
+    Collects keyword bids changes and writes them to DB in background.
+
+    Buffer is bounded by ``KEYWORD_BID_HISTORY_BUFFER_SIZE`` rows. If flusher can't keep up with the run,
+    new batches are dropped rather than blocking bids calculation. Number of dropped rows is logged on close.
+    """
+    search_field_names = ('Bid', 'AuctionBids')     #: YD API keyword bid search fields recorded in history
+
+    def __init__(self, run_id: str, batch_size: int = None, buffer_size: int = None):
+        """
+        :param run_id:          id of the run which changes are recorded
+        :param batch_size:      how many rows are written with one COPY statement
+        :param buffer_size:     max number of rows waiting to be written
+        :type run_id:           str
+        :type batch_size:       int
+        :type buffer_size:      int
+        """
+        self.run_id = run_id
+        self.batch_size = batch_size or settings.KEYWORD_BID_HISTORY_BATCH_SIZE
+        buffer_size = buffer_size or settings.KEYWORD_BID_HISTORY_BUFFER_SIZE
+        self.written = self.dropped = 0
+        self._queue = queue.Queue(maxsize=max(buffer_size // self.batch_size, 1))
+        self._batch = []
+        self._before = {}
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """Start background flusher"""
+        self._thread = threading.Thread(target=self._flush_loop, name=f'bid-history-{self.run_id}', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Hand over collected changes to flusher and wait until everything is written"""
+        self._put_batch()
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self.dropped:
+            _logger.warning(f'Keyword bids history buffer overflow. Dropped {self.dropped} rows of run {self.run_id}')
+
+    def watch(self, kw_bids: Iterator[entities.KeywordBid]) -> Iterator[entities.KeywordBid]:
+        """
+        Remember keyword bids state before calculation.
+        Calculation formulas alter keyword bids in place, so this should wrap keyword bids *before* formulas applied.
+        """
+        for kw_bid in kw_bids:
+            self._before[kw_bid.keyword_id] = (kw_bid.search or {}).get('Bid')
+            yield kw_bid
+
+    def record(self, kw_bids: Iterator[entities.KeywordBid]) -> Iterator[entities.KeywordBid]:
+        """
+        Collect changes of calculated keyword bids. Keyword bids which bid was not changed are not recorded.
+        """
+        for kw_bid in kw_bids:
+            old_bid = self._before.pop(kw_bid.keyword_id, None)
+            search = kw_bid.search or {}
+            new_bid = search.get('Bid')
+            if new_bid != old_bid:
+                self._add(kw_bid.keyword_id, old_bid, new_bid, *self._auction_top(search))
+            yield kw_bid
+
+    @staticmethod
+    def _auction_top(search: dict) -> tuple:
+        items = (search.get('AuctionBids') or {}).get('AuctionBidItems') or []
+        first, second = (list(map(lambda bid_item: bid_item.get('Bid'), items[:2])) + [None, None])[:2]
+        return first, second
+
+    def _add(self, *row):
+        self._batch.append((self.run_id, *row))
+        if len(self._batch) >= self.batch_size:
+            self._put_batch()
+
+    def _put_batch(self):
+        if not self._batch:
+            return
+        try:
+            self._queue.put_nowait(self._batch)
+        except queue.Full:
+            self.dropped += len(self._batch)
+        self._batch = []
+
+    def _flush_loop(self):
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    break
+                try:
+                    self._copy(batch)
+                except Exception as e:
+                    _logger.error(f'Unable to write keyword bids history: {e}', exc_info=True)
+                else:
+                    self.written += len(batch)
+        finally:
+            # Django opens a separate connection for every thread. It won't be closed by request/task cycle
+            connection.close()
+
+    @staticmethod
+    def _copy(batch: list):
+        created_at = timezone.now().isoformat()
+        buffer = io.StringIO()
+        for row in batch:
+            buffer.write('\t'.join('\\N' if v is None else str(v) for v in row))
+            buffer.write(f'\t{created_at}\n')
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_from(buffer, models.KeywordBidChange._meta.db_table, columns=_COPY_COLUMNS)
+
+
+def purge_keyword_bid_history(retention_days: int = None) -> int:
+    """
+    Delete keyword bids history older than retention period.
+
+    :param retention_days:      how many days history is kept. ``KEYWORD_BID_HISTORY_RETENTION_DAYS`` by default
+    :type retention_days:       int
+    :rtype:                     int
+    :return:                    number of deleted rows
+    """
+    retention_days = retention_days or settings.KEYWORD_BID_HISTORY_RETENTION_DAYS
+    threshold = timezone.now() - timedelta(days=retention_days)
+    deleted, _ = models.KeywordBidChange.objects.filter(created_at__lt=threshold).delete()
+    _logger.debug(f'Purged {deleted} keyword bid changes older than {threshold}')
+    return deleted
@@ -0,0 +1,265 @@
+"""
+Controllers for resumable keyword bids runs.
+
+A run which fails halfway (e.g. worker is lost or API connection is broken) is retried by celery with the same
+task id. Without a checkpoint the retry fetches every keyword bid again and sends chunks which were already set.
+Checkpoint of a run keeps progress of the get-calculate-set cycle while it goes::
+
+    checkpoint = RunCheckpoint.for_run(rule_id, run_id)
+    chunks, cached = checkpoint.plan(chunks, cached)        # same chunks as in the failed attempt
+    data = chain(checkpoint.snapshot(), gateway.keyword_bids_gen(chunks=chunks, checkpoint=checkpoint, ...))
+    kw_bids = checkpoint.pending(calculate(data))           # skip keyword bids set by the failed attempt
+    response = checkpoint.results + list(checkpoint.record(set_keyword_bids(gateway, kw_bids)))
+    checkpoint.clear()                                      # run is done
+
+Checkpoint is a directory of append-only files:
+
+* ``plan.json`` - selection criteria of request chunks and targets read from auction snapshot
+* ``snapshot.jsonl`` - keyword bids of every received page, one page per line
+* ``pages.jsonl`` - received pages: chunk, page offset and offset of the next page
+* ``set.jsonl`` - batches of set results
+
+Every line is flushed as soon as it's written, so checkpoint survives loss of the worker process.
+Lines written after the last complete page or set batch (e.g. a torn line) are dropped on load.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from itertools import islice
+from typing import Iterator
+
+from django.conf import settings
+
+from .. import entities
+
+_logger = logging.getLogger(__name__)
+
+PLAN, SNAPSHOT, PAGES, SET = 'plan.json', 'snapshot.jsonl', 'pages.jsonl', 'set.jsonl'
+SET_BATCH_SIZE = 1000   # set results written with one line
+
+
+def _chunk_key(criteria: dict) -> str:
+    return json.dumps(criteria, sort_keys=True)
+
+
+def _lines(path: str) -> Iterator:
+    """Decoded lines of a file. Reading stops at a torn line"""
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    _logger.warning(f'Torn checkpoint line in {path}')
+                    return
+    except FileNotFoundError:
+        return
+
+
+def _failed(result) -> bool:
+    """Set result of a keyword bid which was not set"""
+    return type(result) is dict and result.get('KeywordId') is not None and bool(result.get('Errors'))
+
+
+def _truncate(path: str, count: int):
+    """Drop lines after the first ``count`` ones: a torn line or keyword bids of a page which was not listed"""
+    try:
+        with open(path, 'rb+') as f:
+            for _ in range(count):
+                f.readline()
+            f.truncate()
+    except FileNotFoundError:
+        return
+
+
+def purge_checkpoints(directory: str, max_age: float, keep: str = None):
+    """
+    Remove checkpoints of runs which were not resumed for ``max_age`` seconds
+
+    :param directory:   directory of checkpoints
+    :param max_age:     seconds
+    :param keep:        name of checkpoint which should not be removed
+    :type directory:    str
+    :type max_age:      float
+    :type keep:         str
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            stale = name != keep and time.time() - os.path.getmtime(path) > max_age
+        except OSError:
+            continue
+        if stale:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class RunCheckpoint:
+    """
+    Progress of one keyword bids run. Run is resumed if checkpoint directory exists.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path:    checkpoint directory
+        :type path:     str
+        """
+        self.path = path
+        self.results = []       # set results received by previous attempts, except failed keyword bids
+        self.skipped = 0        # keyword bids which were not sent as set by previous attempts
+        self._offsets = {}      # chunk key: offset of the next page or None if chunk is received
+        self._pages = 0         # pages received by previous attempts
+        self._set = set()       # keyword ids set by previous attempts
+        self._files = {}
+        self._batch = []
+        self.load()
+
+    @classmethod
+    def for_run(cls, kw_bid_rule_id: int, run_id: str, max_age: float = None) -> 'RunCheckpoint':
+        """
+        Get checkpoint of a rule run from ``KEYWORD_BID_CHECKPOINT_DIR``. Stale ones are dropped.
+        Checkpoint of the run is dropped too if it was started more than ``max_age`` seconds ago, so that
+        a run redelivered late is not resumed with outdated auction data
+
+        :param kw_bid_rule_id:  DB id of rule
+        :param run_id:          id of the run
+        :param max_age:         seconds checkpoint can be resumed in, e.g. run time budget. \
+        ``KEYWORD_BID_CHECKPOINT_MAX_AGE`` by default
+        :type kw_bid_rule_id:   int
+        :type run_id:           str
+        :type max_age:          float
+        :rtype:                 RunCheckpoint
+        """
+        directory = os.path.join(settings.KEYWORD_BID_CHECKPOINT_DIR, f'rule_{kw_bid_rule_id}')
+        purge_checkpoints(directory, settings.KEYWORD_BID_CHECKPOINT_MAX_AGE, keep=run_id)
+        path = os.path.join(directory, run_id)
+        max_age = max_age or settings.KEYWORD_BID_CHECKPOINT_MAX_AGE
+        try:
+            age = time.time() - os.path.getmtime(os.path.join(path, PLAN))
+        except OSError:
+            age = 0
+        if age > max_age:
+            _logger.warning(f'Checkpoint of run {run_id} of rule {kw_bid_rule_id} was started {age:.0f}s ago, '
+                            f'run is started from scratch')
+            shutil.rmtree(path, ignore_errors=True)
+        checkpoint = cls(path)
+        if checkpoint.resumed:
+            _logger.info(f'Run {run_id} of rule {kw_bid_rule_id} is resumed: {checkpoint._pages} pages received, '
+                         f'{len(checkpoint.results)} keyword bids set')
+        return checkpoint
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self._pages or self.results)
+
+    def load(self):
+        """Load progress of previous attempts. Files are truncated to the progress, new lines are appended after it"""
+        pages = list(_lines(os.path.join(self.path, PAGES)))
+        for page in pages:
+            self._offsets[page['chunk']] = page['next']
+        self._pages = len(pages)
+        _truncate(os.path.join(self.path, PAGES), self._pages)
+        _truncate(os.path.join(self.path, SNAPSHOT), self._pages)
+        batches = list(_lines(os.path.join(self.path, SET)))
+        for batch in batches:
+            # keyword bids which were not set are sent again, so their results are replaced by new ones
+            self.results.extend(result for result in batch if not _failed(result))
+        _truncate(os.path.join(self.path, SET), len(batches))
+        self._set = {result['KeywordId'] for result in self.results if type(result) is dict and 'KeywordId' in result}
+
+    def plan(self, chunks: list or None, cached: dict = None) -> (list or None, dict or None):
+        """
+        Chunks of keyword bids requests and targets read from auction snapshot. Plan of the first attempt is kept,
+        so that chunks received before match chunks requested by the resumed run
+
+        :param chunks:  planned chunks of selection criteria or None for default chunks
+        :param cached:  ids of targets read from auction snapshot, e.g. ``{'CampaignIds': [1, 2]}``
+        :type chunks:   list or None
+        :type cached:   dict
+        :rtype:         (list or None, dict or None)
+        """
+        path = os.path.join(self.path, PLAN)
+        try:
+            with open(path) as f:
+                plan = json.load(f)
+            return plan['chunks'], plan.get('cached')
+        except (OSError, ValueError, KeyError):
+            pass
+        os.makedirs(self.path, exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'chunks': chunks, 'cached': cached}, f)
+        os.replace(f'{path}.tmp', path)
+        return chunks, cached
+
+    def resume_offset(self, criteria: dict) -> int or None:
+        """Offset of the next page of a chunk, 0 if chunk was not requested and None if it is received"""
+        return self._offsets.get(_chunk_key(criteria), 0)
+
+    def page_received(self, criteria: dict, offset: int, page: dict):
+        """
+        Save received page. Should be called after keyword bids of the page were consumed
+
+        :param criteria:    selection criteria of the chunk
+        :param offset:      offset of the page
+        :param page:        YD API keyword bids get result
+        :type criteria:     dict
+        :type offset:       int
+        :type page:         dict
+        """
+        key = _chunk_key(criteria)
+        self._offsets[key] = page.get('LimitedBy')
+        # keyword bids are written first, so a page is never listed without its data
+        self._write(SNAPSHOT, page.get('KeywordBids') or [])
+        self._write(PAGES, {'chunk': key, 'offset': offset, 'next': self._offsets[key]})
+
+    def snapshot(self) -> Iterator[dict]:
+        """Keyword bids data received by previous attempts"""
+        for page in islice(_lines(os.path.join(self.path, SNAPSHOT)), self._pages):
+            yield from page
+
+    def pending(self, kw_bids: Iterator[entities.KeywordBid]) -> Iterator[entities.KeywordBid]:
+        """Filter out keyword bids which were set by previous attempts"""
+        for kw_bid in kw_bids:
+            if kw_bid.keyword_id in self._set:
+                self.skipped += 1
+                continue
+            yield kw_bid
+
+    def record(self, results: Iterator[dict]) -> Iterator[dict]:
+        """Save set results as they are received"""
+        for result in results:
+            self._batch.append(result)
+            if len(self._batch) >= SET_BATCH_SIZE:
+                self.flush()
+            yield result
+        self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._write(SET, self._batch)
+            self._batch = []
+
+    def _write(self, name: str, data):
+        f = self._files.get(name)
+        if f is None:
+            os.makedirs(self.path, exist_ok=True)
+            f = self._files[name] = open(os.path.join(self.path, name), 'a')
+        f.write(json.dumps(data) + '\n')
+        f.flush()
+
+    def close(self):
+        """Flush and close checkpoint files. Checkpoint is kept for the next attempt"""
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def clear(self):
+        """Remove checkpoint when run is done"""
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
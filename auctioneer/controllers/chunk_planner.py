@@ -0,0 +1,263 @@
+"""
+Balanced chunks of keyword bids requests.
+
+Keyword bids are requested from YD API in parallel chunks of selection criteria. Splitting targets by id count
+only (10 campaigns or 1000 ad groups per request) turns a chunk with one huge campaign into a long chain of pages,
+while chunks of small campaigns finish at once. Planner keeps keyword counts of ad groups seen in previous runs
+and builds chunks of about the same expected number of keywords, splitting large campaigns to ad groups::
+
+    planner = KeywordChunkPlanner.for_rule(rule_id)
+    planner.refresh(gateway, selection_criteria, account_id)    # learn ad groups of new and large campaigns
+    chunks = planner.plan(selection_criteria)                   # [{'CampaignIds': [1, 3]}, {'AdGroupIds': [...]}, ...]
+    kw_bid_data = planner.watch(gateway.keyword_bids_gen(selection_criteria, chunks=chunks, ...))
+    ...
+    planner.save()                                              # keep counts for the next run
+
+Targets without known counts are chunked by id count. Ad groups of large campaigns are read again on every run,
+so that ad groups added since the last run are requested too. Local copy of reference data is used only if it was
+synced after the previous run, otherwise ad groups are read from YD API. Campaigns which ad groups can't be read
+are requested as a whole.
+"""
+import json
+import logging
+import os
+from collections import Counter
+from typing import Iterator
+
+from django.conf import settings
+
+from common import http
+from . import reference_data
+
+_logger = logging.getLogger(__name__)
+
+# YD API limits of ids in keyword bids SelectionCriteria
+IDS_LIMITS = {'CampaignIds': 10, 'AdGroupIds': 1000}
+
+
+class KeywordChunkPlanner:
+    """
+    Persistent keyword counts of ad groups of one rule and chunks planning.
+    """
+    field_names = ('CampaignId', 'AdGroupId')   #: YD API keyword bid fields keyword counts are collected from
+
+    def __init__(self, path: str, chunk_size: int = None):
+        """
+        :param path:            counts file path
+        :param chunk_size:      expected number of keywords in one chunk. ``KEYWORD_BID_CHUNK_SIZE`` by default
+        :type path:             str
+        :type chunk_size:       int
+        """
+        self.path = path
+        self.chunk_size = chunk_size or settings.KEYWORD_BID_CHUNK_SIZE
+        self.ad_groups = {}         # {ad_group_id: (campaign_id, keywords count)}
+        self._seen = Counter()      # keywords count of ad groups received in this run
+        self._seen_campaigns = {}   # {ad_group_id: campaign_id} of ad groups received in this run
+        self._refreshed = set()     # campaigns which ad groups were read in this run
+        self.saved_at = None        # timestamp counts were saved at by the previous run
+        self.load()
+
+    @classmethod
+    def for_rule(cls, kw_bid_rule_id: int) -> 'KeywordChunkPlanner':
+        """Get planner of a given rule from ``KEYWORD_BID_CHUNK_PLANNER_DIR``"""
+        return cls(os.path.join(settings.KEYWORD_BID_CHUNK_PLANNER_DIR, f'rule_{kw_bid_rule_id}.json'))
+
+    def campaigns(self) -> dict:
+        """
+        :rtype:     dict
+        :return:    known ad groups of campaigns with keywords count: {campaign_id: {ad_group_id: count}}
+        """
+        campaigns = {}
+        for ad_group_id, (campaign_id, count) in self.ad_groups.items():
+            campaigns.setdefault(campaign_id, {})[ad_group_id] = count
+        return campaigns
+
+    def plan(self, selection_criteria: dict) -> [dict] or None:
+        """
+        Split targets of selection criteria to chunks of about ``chunk_size`` expected keywords.
+        Campaigns with more keywords than ``chunk_size`` are split to ad groups if their ad groups were read
+        by :py:meth:`refresh`.
+
+        :param selection_criteria:  keyword bids selection criteria
+        :type selection_criteria:   dict
+        :rtype:                     list or None
+        :return:                    chunks of selection criteria: [{'CampaignIds': [...]}, {'AdGroupIds': [...]}] \
+        or None if targets can't be planned (e.g. KeywordIds)
+        """
+        units, unknown = [], []
+        if selection_criteria.get('CampaignIds'):
+            key = 'CampaignIds'
+            campaigns = self.campaigns()
+            for campaign_id in selection_criteria[key]:
+                ad_groups = campaigns.get(campaign_id)
+                if not ad_groups:
+                    unknown.append(campaign_id)
+                elif sum(ad_groups.values()) > self.chunk_size and campaign_id in self._refreshed:
+                    units.extend(('AdGroupIds', ad_group_id, count) for ad_group_id, count in ad_groups.items())
+                else:
+                    units.append((key, campaign_id, sum(ad_groups.values())))
+        elif selection_criteria.get('AdGroupIds'):
+            key = 'AdGroupIds'
+            for ad_group_id in selection_criteria[key]:
+                if ad_group_id in self.ad_groups:
+                    units.append((key, ad_group_id, self.ad_groups[ad_group_id][1]))
+                else:
+                    unknown.append(ad_group_id)
+        else:
+            return None
+        if not units:
+            return None
+        chunks = self._pack(units)
+        limit = IDS_LIMITS[key]
+        chunks.extend({key: unknown[i:i + limit]} for i in range(0, len(unknown), limit))
+        return chunks
+
+    def _pack(self, units: list) -> [dict]:
+        """First fit decreasing packing of (criteria key, id, count) units to chunks of ``chunk_size`` keywords"""
+        bins = []   # [key, ids, expected count]
+        for key, target_id, count in sorted(units, key=lambda unit: unit[2], reverse=True):
+            for chunk in bins:
+                if chunk[0] == key and chunk[2] + count <= self.chunk_size and len(chunk[1]) < IDS_LIMITS[key]:
+                    chunk[1].append(target_id)
+                    chunk[2] += count
+                    break
+            else:
+                bins.append([key, [target_id], count])
+        return [{key: ids} for key, ids, _ in bins]
+
+    def refresh(self, gateway: http.YandexDirectGateway, selection_criteria: dict, account_id: int = None):
+        """
+        Learn ad groups of campaigns which keyword counts are not known yet. Ad groups are read from local copy
+        of account reference data if it was synced after the previous run, otherwise from campaigns ads.
+        Keywords count of such ad groups is estimated as an average of known ad groups.
+        Ad groups of campaigns which are split to ad groups are read again, see :py:meth:`refresh_split`.
+
+        :param gateway:             gateway instance
+        :param selection_criteria:  keyword bids selection criteria
+        :param account_id:          DB id of account which reference data is used
+        :type gateway:              YandexDirectGateway
+        :type selection_criteria:   dict
+        :type account_id:           int
+        """
+        campaigns = self.campaigns()
+        estimate = round(sum(count for _, count in self.ad_groups.values()) / len(self.ad_groups)) \
+            if self.ad_groups else 1
+        split = [i for i in selection_criteria.get('CampaignIds') or ()
+                 if i in campaigns and sum(campaigns[i].values()) > self.chunk_size]
+        if split:
+            self.refresh_split(gateway, split, account_id, estimate)
+        unknown = [i for i in selection_criteria.get('CampaignIds') or () if i not in campaigns]
+        if not unknown:
+            return
+        for campaign_id, ad_group_ids in self._reference_ad_groups(account_id, unknown).items():
+            self.ad_groups.update((ad_group_id, (campaign_id, estimate)) for ad_group_id in ad_group_ids)
+        unknown = [i for i in unknown if i not in self.campaigns()]
+        limit = IDS_LIMITS['CampaignIds']
+        for i in range(0, len(unknown), limit):
+            ads = gateway.get_ads(selection_criteria={'CampaignIds': unknown[i:i + limit]},
+                                  field_names=['AdGroupId', 'CampaignId'])
+            for ad in ads:
+                if type(ad) is dict and ad.get('AdGroupId') and ad.get('CampaignId'):
+                    self.ad_groups.setdefault(ad['AdGroupId'], (ad['CampaignId'], estimate))
+
+    def refresh_split(self, gateway: http.YandexDirectGateway, campaign_ids: list, account_id: int = None,
+                      estimate: int = 1):
+        """
+        Read ad groups of campaigns which are split to ad groups. Ad groups which were removed are dropped,
+        new ones get estimated keywords count. Ad groups are read from local copy of account reference data
+        if it was synced after the previous run, otherwise from YD API. Campaigns which ad groups can't be read
+        are not split
+
+        :param gateway:         gateway instance
+        :param campaign_ids:    ids of campaigns with known ad groups
+        :param account_id:      DB id of account which reference data is used
+        :param estimate:        keywords count of new ad groups
+        :type gateway:          YandexDirectGateway
+        :type campaign_ids:     list
+        :type account_id:       int
+        :type estimate:         int
+        """
+        current = self._reference_ad_groups(account_id, campaign_ids)
+        missing = [i for i in campaign_ids if i not in current]
+        limit = IDS_LIMITS['CampaignIds']
+        for i in range(0, len(missing), limit):
+            ad_groups = {}
+            try:
+                for ad_group in gateway.get_ad_groups(selection_criteria={'CampaignIds': missing[i:i + limit]},
+                                                      field_names=['Id', 'CampaignId']):
+                    if type(ad_group) is not dict or not ad_group.get('Id') or not ad_group.get('CampaignId'):
+                        raise http.UnExpectedResult(f'Unexpected ad groups data {ad_group}')
+                    ad_groups.setdefault(ad_group['CampaignId'], []).append(ad_group['Id'])
+            except http.DeadlineExceeded:
+                raise
+            except Exception as e:
+                _logger.warning(f'Unable to read ad groups of campaigns {missing[i:i + limit]}, '
+                                f'they are requested as a whole: {e}')
+                continue
+            current.update(ad_groups)
+        campaigns = self.campaigns()
+        # removed ad groups are dropped first, as ad group may be moved between campaigns
+        for campaign_id, ad_group_ids in current.items():
+            for ad_group_id in set(campaigns.get(campaign_id) or ()) - set(ad_group_ids):
+                del self.ad_groups[ad_group_id]
+        for campaign_id, ad_group_ids in current.items():
+            for ad_group_id in ad_group_ids:
+                if self.ad_groups.get(ad_group_id, (None,))[0] != campaign_id:
+                    self.ad_groups[ad_group_id] = (campaign_id, estimate)
+            self._refreshed.add(campaign_id)
+
+    def _reference_ad_groups(self, account_id: int or None, campaign_ids: list) -> dict:
+        """
+        Ad groups of campaigns from local copy of account reference data. Local copy synced before the previous run
+        may miss ad groups added since, so it's not used
+        """
+        if account_id is None:
+            return {}
+        synced_at = reference_data.synced_at(account_id)
+        if synced_at is None:
+            return {}
+        if self.saved_at is not None and synced_at.timestamp() <= self.saved_at:
+            _logger.warning(f'Reference data of account {account_id} was not synced since the previous run '
+                            f'at {synced_at}, ad groups are read from YD API')
+            return {}
+        return reference_data.campaign_ad_groups(account_id, campaign_ids)
+
+    def watch(self, kw_bid_data: Iterator[dict]) -> Iterator[dict]:
+        """Count keywords of ad groups in keyword bids data received from YD API"""
+        seen, seen_campaigns = self._seen, self._seen_campaigns
+        for item in kw_bid_data:
+            ad_group_id = item.get('AdGroupId') if type(item) is dict else None
+            if ad_group_id:
+                seen[ad_group_id] += 1
+                seen_campaigns[ad_group_id] = item.get('CampaignId')
+            yield item
+
+    def load(self):
+        """Load counts from file. Planner has no counts if file does not exist"""
+        try:
+            with open(self.path) as f:
+                self.ad_groups = {int(ad_group_id): tuple(value) for ad_group_id, value in json.load(f).items()}
+            self.saved_at = os.path.getmtime(self.path)
+        except (OSError, ValueError, TypeError) as e:
+            _logger.debug(f'Unable to load keyword counts {self.path}: {e}')
+            self.ad_groups, self.saved_at = {}, None
+
+    def save(self):
+        """
+        Persist counts collected during the run. Ad groups of received campaigns which had no keywords
+        in this run are dropped. Should be called only when all keyword bids were received.
+        """
+        received_campaigns = set(self._seen_campaigns.values())
+        ad_groups = {ad_group_id: value for ad_group_id, value in self.ad_groups.items()
+                     if value[0] not in received_campaigns}
+        ad_groups.update((ad_group_id, (self._seen_campaigns[ad_group_id], count))
+                         for ad_group_id, count in self._seen.items())
+        self.ad_groups = ad_groups
+        self._seen, self._seen_campaigns = Counter(), {}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(ad_groups, f)
+        os.replace(tmp_path, self.path)
+        self.saved_at = os.path.getmtime(self.path)
+        _logger.debug(f'Saved keyword counts of {len(ad_groups)} ad groups to {self.path}')
@@ -0,0 +1,205 @@
+"""
+Columnar format of keyword bids batches.
+
+Keyword bids of a batch are written column by column as fixed-width int64 values, so that a batch file is
+memory-mapped and read by many processes without parsing and copying. Columns are NumPy arrays viewing the mapped
+file. If NumPy is not installed, columns are ``memoryview`` objects: they are not copied either, but they can only
+be read value by value, which is much slower for large batches::
+
+    write_batch('/tmp/batch.kwb', kw_bid_data)          # keyword bids data in YD API format
+    with KeywordBidBatch('/tmp/batch.kwb') as batch:
+        batch.columns['bid']                             # current search bids of all keywords
+        batch.columns['auction_bid']                     # auction bids, ``ladder_width`` items of every keyword
+        list(map_keyword_bids(batch))                    # keyword bid entities
+
+File layout, little-endian:
+
+* header: magic, number of keyword bids, ladder width, offset and size of string table
+* columns of ``COLUMNS`` - one value of every keyword bid
+* columns of ``LADDER_COLUMNS`` - ``ladder_width`` values of every keyword bid, padded with NULL
+* string table - JSON list of strings. String columns keep indexes in it, -1 for None
+
+Missing integer values are NULL. Fields other than ids, statuses, search bid and search auction bids
+(e.g. Network bids) are not kept.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterator
+
+from .. import entities
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'KWBATCH1'
+HEADER = struct.Struct('<8s4q24x')  # magic, count, ladder width, string table offset and size. Padded to 64 bytes
+NULL = -2 ** 63                     #: missing integer value
+COLUMNS = ('keyword_id', 'campaign_id', 'ad_group_id', 'serving_status', 'strategy_priority', 'bid', 'auction_size')
+LADDER_COLUMNS = {'traffic_volume': 'TrafficVolume', 'auction_bid': 'Bid', 'auction_price': 'Price'}
+STRING_COLUMNS = {'serving_status': 'ServingStatus', 'strategy_priority': 'StrategyPriority'}
+ID_COLUMNS = {'campaign_id': 'CampaignId', 'ad_group_id': 'AdGroupId'}
+# auction_size: NULL - no Search data, -1 - Search data without AuctionBids, otherwise number of auction bid items
+NO_AUCTION = -1
+
+
+def _int(value) -> int:
+    return NULL if value is None else value
+
+
+def write_batch(path: str, kw_bid_data: Iterator[dict]) -> int:
+    """
+    Write keyword bids data to a batch file. File is replaced atomically
+
+    :param path:            batch file path
+    :param kw_bid_data:     keyword bids data in YD API keywordbids.get format
+    :type path:             str
+    :type kw_bid_data:      Iterator[dict]
+    :rtype:                 int
+    :return:                number of keyword bids written
+    """
+    columns = {name: array('q') for name in COLUMNS}
+    ladders, strings, string_ids = [], [], {}
+    for item in kw_bid_data:
+        columns['keyword_id'].append(item['KeywordId'])
+        for name, field in ID_COLUMNS.items():
+            columns[name].append(_int(item.get(field)))
+        for name, field in STRING_COLUMNS.items():
+            value = item.get(field)
+            if value is not None and value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value)
+            columns[name].append(-1 if value is None else string_ids[value])
+        search, ladder = item.get('Search'), ()
+        if type(search) is dict:
+            auction_bids = search.get('AuctionBids')
+            ladder = (auction_bids.get('AuctionBidItems') or ()) if type(auction_bids) is dict else ()
+            columns['bid'].append(_int(search.get('Bid')))
+            columns['auction_size'].append(len(ladder) if type(auction_bids) is dict else NO_AUCTION)
+        else:
+            columns['bid'].append(NULL)
+            columns['auction_size'].append(NULL)
+        ladders.append(ladder)
+    count = len(columns['keyword_id'])
+    width = max((len(ladder) for ladder in ladders), default=0)
+    ladder_columns = {name: array('q', [NULL]) * (count * width) for name in LADDER_COLUMNS}
+    for index, ladder in enumerate(ladders):
+        for position, auction_item in enumerate(ladder):
+            for name, field in LADDER_COLUMNS.items():
+                ladder_columns[name][index * width + position] = _int(auction_item.get(field))
+    string_table = json.dumps(strings).encode()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, count, width, HEADER.size + 8 * count * (len(COLUMNS) + len(LADDER_COLUMNS) * width),
+                            len(string_table)))
+        for column in (*columns.values(), *ladder_columns.values()):
+            if sys.byteorder != 'little':
+                column.byteswap()
+            f.write(column.tobytes())
+        f.write(string_table)
+    os.replace(f'{path}.tmp', path)
+    return count
+
+
+class KeywordBidBatch:
+    """
+    Memory-mapped batch file of keyword bids. Columns are views of the file, not copies
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path:    batch file path
+        :type path:     str
+        :raises:        ValueError if file is not a keyword bids batch
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.ladder_width, strings_offset, strings_size = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a keyword bids batch')
+        if numpy is None and sys.byteorder != 'little':
+            self._mmap.close()
+            raise ValueError(f'NumPy is required to read {path} on a big-endian platform')
+        self.strings = json.loads(self._mmap[strings_offset:strings_offset + strings_size].decode())
+        self._buffer = None if numpy else memoryview(self._mmap)
+        self.columns = {}
+        offset = HEADER.size
+        for name, size in (*((name, self.count) for name in COLUMNS),
+                           *((name, self.count * self.ladder_width) for name in LADDER_COLUMNS)):
+            self.columns[name] = self._view(offset, size)
+            offset += 8 * size
+
+    def _view(self, offset: int, size: int):
+        if numpy is not None:
+            return numpy.frombuffer(self._mmap, dtype='<i8', count=size, offset=offset)
+        return self._buffer[offset:offset + 8 * size].cast('q')
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, name: str, index: int) -> str or None:
+        value = int(self.columns[name][index])
+        return None if value < 0 else self.strings[value]
+
+    def items(self) -> Iterator[dict]:
+        """Keyword bids data in YD API keywordbids.get format"""
+        columns, width = self.columns, self.ladder_width
+        for index in range(self.count):
+            item = {'KeywordId': int(columns['keyword_id'][index])}
+            for name, field in ID_COLUMNS.items():
+                value = int(columns[name][index])
+                if value != NULL:
+                    item[field] = value
+            for name, field in STRING_COLUMNS.items():
+                value = self._string(name, index)
+                if value is not None:
+                    item[field] = value
+            size = int(columns['auction_size'][index])
+            if size == NULL:
+                yield item
+                continue
+            search = item['Search'] = {}
+            bid = int(columns['bid'][index])
+            if bid != NULL:
+                search['Bid'] = bid
+            if size != NO_AUCTION:
+                ladder = []
+                for position in range(index * width, index * width + size):
+                    ladder.append({field: int(columns[name][position]) for name, field in LADDER_COLUMNS.items()
+                                   if columns[name][position] != NULL})
+                search['AuctionBids'] = {'AuctionBidItems': ladder}
+            yield item
+
+    def keyword_bids(self) -> Iterator[entities.KeywordBid]:
+        """Keyword bid entities"""
+        for item in self.items():
+            yield entities.KeywordBid(campaign_id=item.get('CampaignId'), ad_group_id=item.get('AdGroupId'),
+                                      keyword_id=item['KeywordId'], search=item.get('Search'),
+                                      serving_status=item.get('ServingStatus'),
+                                      strategy_priority=item.get('StrategyPriority'))
+
+    def close(self):
+        """Release column views and unmap the file. File stays mapped while NumPy views of it are referenced"""
+        for column in self.columns.values():
+            if type(column) is memoryview:
+                column.release()
+        self.columns = {}
+        if self._buffer is not None:
+            self._buffer.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
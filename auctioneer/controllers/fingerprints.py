@@ -0,0 +1,151 @@
+"""
+Controllers for incremental keyword bids recalculation.
+
+Auction data of most keywords doesn't change between two consecutive runs of a rule. So there is no need to
+recalculate and set such keywords again. For every rule we keep a store of keyword fingerprints: a hash of keyword
+auction ladder and its search bid. A keyword is passed to calculation only if its fingerprint has changed since
+the last run::
+
+    store = KeywordBidFingerprints.for_rule(rule_id, kw_bid_rule)
+    kw_bids = store.changed(get_keyword_bids(gateway, **params))       # skip keywords that were not changed
+    kw_bids = store.record(bid_calculator.apply_bid_rule(rule, kw_bids))
+    set_keyword_bids(gateway, kw_bids)
+    store.save()                                                        # persist fingerprints for the next run
+
+Fingerprints are kept in two sorted int64 arrays (keyword ids and hashes) and saved to a file, so even a store
+for millions of keywords takes a few megabytes.
+"""
+import hashlib
+import logging
+import os
+from array import array
+from bisect import bisect_left
+from typing import Iterator
+
+from django.conf import settings
+
+from . import bid_calculator
+from .. import entities
+
+_logger = logging.getLogger(__name__)
+
+_MAGIC = b'KBFP1'
+
+
+def keyword_bid_fingerprint(kw_bid: entities.KeywordBid) -> int:
+    """
+    Calculate keyword bid fingerprint: a hash of keyword auction ladder and current search bid
+
+    :param kw_bid:      keyword bid entity
+    :type kw_bid:       entities.KeywordBid
+    :rtype:             int
+    :return:            signed 64-bit hash
+    """
+    search = kw_bid.search or {}
+    ladder = tuple((item.get('Bid'), item.get('Price'), item.get('TrafficVolume'))
+                   for item in (search.get('AuctionBids') or {}).get('AuctionBidItems') or [])
+    digest = hashlib.blake2b(repr((search.get('Bid'), ladder)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def _rule_salt(kw_bid_rule: entities.KeywordBidRule) -> int:
+    """Fingerprints are only valid for the rule parameters they were calculated with"""
+    digest = hashlib.blake2b(repr(bid_calculator.rule_params(kw_bid_rule)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+class KeywordBidFingerprints:
+    """
+    Persistent store of keyword bid fingerprints for one rule.
+
+    Store is rebuilt on every run: keywords that were skipped keep their fingerprints, calculated keywords get
+    fingerprints of their new bids and keywords that were not received from YD API are dropped.
+    """
+    search_field_names = ('Bid', 'AuctionBids')     #: YD API keyword bid search fields fingerprints are made of
+
+    def __init__(self, path: str, kw_bid_rule: entities.KeywordBidRule):
+        """
+        :param path:            store file path
+        :param kw_bid_rule:     rule which keyword bids are stored
+        :type path:             str
+        :type kw_bid_rule:      entities.KeywordBidRule
+        """
+        self.path = path
+        self.salt = _rule_salt(kw_bid_rule)
+        self.skipped = self.changed_count = 0
+        self._keys, self._values = array('q'), array('q')
+        self._new_keys, self._new_values = array('q'), array('q')
+        self.load()
+
+    @classmethod
+    def for_rule(cls, kw_bid_rule_id: int, kw_bid_rule: entities.KeywordBidRule) -> 'KeywordBidFingerprints':
+        """Get store of a given rule from ``KEYWORD_BID_FINGERPRINTS_DIR``"""
+        return cls(os.path.join(settings.KEYWORD_BID_FINGERPRINTS_DIR, f'rule_{kw_bid_rule_id}.fp'), kw_bid_rule)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, keyword_id: int) -> int or None:
+        """Get stored fingerprint of a keyword"""
+        index = bisect_left(self._keys, keyword_id)
+        if index < len(self._keys) and self._keys[index] == keyword_id:
+            return self._values[index]
+        return None
+
+    def changed(self, kw_bids: Iterator[entities.KeywordBid]) -> Iterator[entities.KeywordBid]:
+        """
+        Filter out keyword bids which fingerprints were not changed since the last run.
+        """
+        for kw_bid in kw_bids:
+            fingerprint = self.get(kw_bid.keyword_id)
+            if fingerprint is not None and fingerprint == keyword_bid_fingerprint(kw_bid):
+                self.skipped += 1
+                self._new_keys.append(kw_bid.keyword_id)
+                self._new_values.append(fingerprint)
+                continue
+            self.changed_count += 1
+            yield kw_bid
+
+    def record(self, kw_bids: Iterator[entities.KeywordBid]) -> Iterator[entities.KeywordBid]:
+        """
+        Remember fingerprints of calculated keyword bids. Should wrap keyword bids *after* formulas applied,
+        so that fingerprint matches the bid which will be received from YD API on the next run.
+        """
+        for kw_bid in kw_bids:
+            self._new_keys.append(kw_bid.keyword_id)
+            self._new_values.append(keyword_bid_fingerprint(kw_bid))
+            yield kw_bid
+
+    def load(self):
+        """Load fingerprints from file. Store is empty if file does not exist or rule parameters were changed"""
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(len(_MAGIC) + 16)
+                salt, size = array('q', header[len(_MAGIC):])
+                if header[:len(_MAGIC)] != _MAGIC or salt != self.salt:
+                    _logger.debug(f'Fingerprints {self.path} are outdated')
+                    return
+                self._keys.fromfile(f, size)
+                self._values.fromfile(f, size)
+        except (OSError, EOFError, ValueError) as e:
+            _logger.debug(f'Unable to load fingerprints {self.path}: {e}')
+            self._keys, self._values = array('q'), array('q')
+
+    def save(self):
+        """
+        Persist fingerprints collected during the run. Should be called only when keyword bids were set successfully.
+        """
+        order = sorted(range(len(self._new_keys)), key=self._new_keys.__getitem__)
+        self._keys = array('q', (self._new_keys[i] for i in order))
+        self._values = array('q', (self._new_values[i] for i in order))
+        self._new_keys, self._new_values = array('q'), array('q')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_MAGIC)
+            array('q', [self.salt, len(self._keys)]).tofile(f)
+            self._keys.tofile(f)
+            self._values.tofile(f)
+        os.replace(tmp_path, self.path)
+        _logger.debug(f'Saved {len(self._keys)} fingerprints to {self.path}. '
+                      f'Changed: {self.changed_count}, skipped: {self.skipped}')
@@ -42,6 +42,7 @@ def map_keyword_bid_rule(kw_bid_rule_model: models.KeywordBidRule) -> entities.K
         'target_values': kw_bid_rule_model.target_values,
         'target_bid_diff': kw_bid_rule_model.get_target_bid_diff_display(),
         'bid_increase_percentage': kw_bid_rule_model.get_bid_increase_percentage_display(),
-        'max_bid': kw_bid_rule_model.get_max_bid_display()
+        'max_bid': kw_bid_rule_model.get_max_bid_display(),
+        'serving_statuses': kw_bid_rule_model.serving_statuses,
     }
     return entities.KeywordBidRule(**data)
@@ -6,18 +6,48 @@ Yandex Direct API, recalculates keyword bids with the given rules and sends new
 
 """
 import logging
-
+from itertools import chain
 from types import GeneratorType
 from typing import Iterator
 
-from common import http, utils
-from . import bid_calculator
+from common import http, timing, utils
+from . import auction_snapshot, bid_calculator, bid_history, checkpoint as run_checkpoint, \
+    chunk_planner as planner, columnar, fingerprints, resubmit
 from .. import entities
 
 _logger = logging.getLogger(__name__)
 
 
-def map_keyword_bids(kw_bid_data: GeneratorType) -> [entities.KeywordBid]:
+def has_auction_bids(item: dict) -> bool:
+    """Keyword bids without search auction bids are never changed by bid calculation formulas"""
+    return bool(((item.get('Search') or {}).get('AuctionBids') or {}).get('AuctionBidItems'))
+
+
+KEYWORD_BID_FILTERS = (has_auction_bids,)
+"""Client-side filters of Yandex Direct keyword bids data applied before mapping to entities"""
+
+
+@timing.timed('filter')
+def filter_keyword_bids(kw_bid_data: Iterator[dict], filters: tuple = KEYWORD_BID_FILTERS) -> Iterator[dict]:
+    """
+    Drop keyword bids data which is not passed by all filters. Use this for criteria that can't be sent to
+    Yandex Direct in SelectionCriteria, so that keyword bids which will not be changed are not mapped,
+    calculated and sent back.
+
+    :param kw_bid_data:     a collection of dictionaries with keyword bids data
+    :param filters:         a collection of callables taking keyword bid data and returning True to keep it
+    :type kw_bid_data:      Iterator[dict]
+    :type filters:          tuple
+    :rtype:                 Iterator[dict]
+    """
+    for item in kw_bid_data:
+        # unexpected data (e.g. API errors) is passed as is to be reported by mapping
+        if type(item) is not dict or 'KeywordId' not in item or all(f(item) for f in filters):
+            yield item
+
+
+@timing.timed('map')
+def map_keyword_bids(kw_bid_data: GeneratorType or columnar.KeywordBidBatch) -> [entities.KeywordBid]:
     """
     Create multiple KeywordBid entites from data.
 
@@ -40,11 +70,17 @@ def map_keyword_bids(kw_bid_data: GeneratorType) -> [entities.KeywordBid]:
         ...
         ]
 
-    :param kw_bid_data:     a collection of dictionaries with keyword bids data
-    :type kw_bid_data:      GeneratorType
+    Memory-mapped batch of keyword bids :py:class:`auctioneer.controllers.columnar.KeywordBidBatch` is mapped
+    from its columns.
+
+    :param kw_bid_data:     a collection of dictionaries with keyword bids data or keyword bids batch
+    :type kw_bid_data:      GeneratorType or columnar.KeywordBidBatch
     :return:                a generator of keyword bids entities
     :rtype:                 Iterator[KeywordBid]
     """
+    if isinstance(kw_bid_data, columnar.KeywordBidBatch):
+        yield from kw_bid_data.keyword_bids()
+        return
     for item in kw_bid_data:
         try:
             entity = entities.KeywordBid(**{utils.camel_to_snake(k): v for k, v in item.items()})
@@ -53,7 +89,10 @@ def map_keyword_bids(kw_bid_data: GeneratorType) -> [entities.KeywordBid]:
         yield entity
 
 
-def get_keyword_bids(gateway: http.YandexDirectGateway, **kwargs) -> Iterator[entities.KeywordBid]:
+def get_keyword_bids(gateway: http.YandexDirectGateway, filters: tuple = KEYWORD_BID_FILTERS,
+                     chunk_planner: planner.KeywordChunkPlanner = None, checkpoint: run_checkpoint.RunCheckpoint = None,
+                     snapshot: auction_snapshot.AuctionSnapshotStore = None,
+                     **kwargs) -> Iterator[entities.KeywordBid]:
     """
     Load all keyword bids for given params from yandex direct gateway and map data
     to :py:class:`auctioneer.entities.KeywordBid`.
@@ -66,31 +105,81 @@ def get_keyword_bids(gateway: http.YandexDirectGateway, **kwargs) -> Iterator[en
         keyword_bids = ctrl.keyword_bids.get_keyword_bids(gateway, **kwb_selection_criteria)
 
     :param gateway:         gateway instance
+    :param filters:         client-side keyword bids data filters. See :py:func:`filter_keyword_bids`
+    :param chunk_planner:   optional planner of balanced request chunks. It also counts received keywords
+    :param checkpoint:      optional run checkpoint. Keyword bids received by previous attempts of the run are taken \
+    from it and only the rest is requested
+    :param snapshot:        optional auction snapshot store of the account. Targets fetched within its max age are \
+    read from it, keyword bids of other targets are requested and saved to it
     :type gateway:          YandexDirectGateway
+    :type filters:          tuple
+    :type chunk_planner:    chunk_planner.KeywordChunkPlanner
+    :type checkpoint:       run_checkpoint.RunCheckpoint
+    :type snapshot:         auction_snapshot.AuctionSnapshotStore
     :return:                generator of keyword bids entities
     :rtype:                 [entities.KeywordBid]
     """
-    yield from map_keyword_bids(gateway.keyword_bids_gen(**kwargs))
-
-
-def set_keyword_bids(gateway: http.YandexDirectGateway, keyword_bids: [entities.KeywordBid]) -> Iterator[dict]:
+    if chunk_planner:
+        kwargs['chunks'] = chunk_planner.plan(kwargs['selection_criteria'])
+    cached = None
+    if snapshot:
+        chunks = kwargs.get('chunks') or gateway.keyword_bids_chunks(kwargs['selection_criteria'])
+        kwargs['chunks'], cached = snapshot.split(chunks, kwargs)
+    sources = []
+    if checkpoint:
+        resumed = checkpoint.resumed
+        kwargs['chunks'], cached = checkpoint.plan(kwargs.get('chunks'), cached)
+        sources.append(checkpoint.snapshot())
+        kw_bid_data = gateway.keyword_bids_gen(checkpoint=checkpoint, **kwargs)
+    else:
+        resumed = False
+        kw_bid_data = gateway.keyword_bids_gen(**kwargs)
+    if snapshot and cached:
+        sources.append(snapshot.read(cached, kwargs))
+    if snapshot and not resumed:
+        # targets fetched partly by previous attempts of the run are not listed in snapshot
+        kw_bid_data = snapshot.record(kw_bid_data, kwargs)
+    if sources:
+        kw_bid_data = chain(*sources, kw_bid_data)
+    if chunk_planner:
+        kw_bid_data = chunk_planner.watch(kw_bid_data)
+    if filters:
+        kw_bid_data = filter_keyword_bids(kw_bid_data, filters)
+    yield from map_keyword_bids(kw_bid_data)
+
+
+def set_keyword_bids(gateway: http.YandexDirectGateway, keyword_bids: [entities.KeywordBid],
+                     failed: resubmit.FailedKeywordBids = None) -> Iterator[dict]:
     """
     Send data to Yandex direct gateway to set keyword bids.
 
     :param gateway:         gateway instance
     :param keyword_bids:    a collection of :py:class:`auctioneer.entities.KeywordBid`
+    :param failed:          optional collector of keyword bids which were not set. Ones failed with temporary \
+    errors are sent again
     :type gateway:          YandexDirectGateway
     :type keyword_bids:     iter
+    :type failed:           resubmit.FailedKeywordBids
     :rtype:                 Iterator[dict]
     :return:                Iterator of dictionaries with `Yandex Direct response data \
     <https://tech.yandex.ru/direct/doc/ref-v5/keywordbids/set-docpage/>`_
 
     """
-    data = [{'KeywordId': kw_bid.keyword_id, 'SearchBid': kw_bid.search.get('Bid')} for kw_bid in keyword_bids]
-    yield from gateway.set_keyword_bids(data)
-
-
-def calculate_keyword_bids(gateway: http.YandexDirectGateway, kw_bid_rule: entities.KeywordBidRule, **params) -> list:
+    data = ({'KeywordId': kw_bid.keyword_id, 'SearchBid': kw_bid.search.get('Bid')} for kw_bid in keyword_bids)
+    data = list(timing.timed_iter('serialize', data))
+    results = gateway.set_keyword_bids(data)
+    if failed:
+        results = failed.watch(gateway, data, results)
+    yield from results
+
+
+def calculate_keyword_bids(gateway: http.YandexDirectGateway, kw_bid_rule: entities.KeywordBidRule,
+                           history: bid_history.KeywordBidHistoryWriter = None,
+                           fingerprints_store: fingerprints.KeywordBidFingerprints = None,
+                           chunk_planner: planner.KeywordChunkPlanner = None,
+                           checkpoint: run_checkpoint.RunCheckpoint = None,
+                           failed: resubmit.FailedKeywordBids = None,
+                           snapshot: auction_snapshot.AuctionSnapshotStore = None, **params) -> list:
     """
     Recalculate bids for a given rule.
 
@@ -98,18 +187,64 @@ def calculate_keyword_bids(gateway: http.YandexDirectGateway, kw_bid_rule: entit
 
     :param gateway:         gateway instance
     :param kw_bid_rule:     rule instance to apply to keyword bids
+    :param history:         optional keyword bids history writer to record changed bids
+    :param fingerprints_store:  optional fingerprints store. If set, only keyword bids changed since the last \
+    run are calculated and set
+    :param chunk_planner:   optional planner of balanced keyword bids request chunks
+    :param checkpoint:      optional run checkpoint. Pages and set results are saved to it, so that a failed run \
+    is resumed without fetching and setting keyword bids again
+    :param failed:          optional collector of keyword bids which were not set. Ones failed with temporary \
+    errors are sent again
+    :param snapshot:        optional auction snapshot store of the account. Keyword bids are read from it within \
+    its max age and bids which were set are updated in it
     :param params:          additional params. Mainly these are params for retrieving keyword bids from YD API
     :type gateway:          YandexDirectGateway
     :type kw_bid_rule:      entities.KeywordBidRule
+    :type history:          bid_history.KeywordBidHistoryWriter
+    :type fingerprints_store:   fingerprints.KeywordBidFingerprints
+    :type chunk_planner:    chunk_planner.KeywordChunkPlanner
+    :type checkpoint:       run_checkpoint.RunCheckpoint
+    :type failed:           resubmit.FailedKeywordBids
+    :type snapshot:         auction_snapshot.AuctionSnapshotStore
     :type params:           dict
     :rtype:                 dict
     :return:                dictionary with `Yandex Direct response data \
     <https://tech.yandex.ru/direct/doc/ref-v5/keywordbids/set-docpage/>`_
     """
     # recieve keyword bids from yandex direct
-    kw_bids_gen = get_keyword_bids(gateway, **params)
+    kw_bids_gen = get_keyword_bids(gateway, chunk_planner=chunk_planner, checkpoint=checkpoint, snapshot=snapshot,
+                                   **params)
+    if fingerprints_store:
+        kw_bids_gen = fingerprints_store.changed(kw_bids_gen)
+    if history:
+        kw_bids_gen = history.watch(kw_bids_gen)
     # apply calculation formulas to each keyword bid
     kw_bids = bid_calculator.apply_bid_rule(kw_bid_rule, kw_bids_gen)
+    if fingerprints_store:
+        kw_bids = fingerprints_store.record(kw_bids)
+    if checkpoint:
+        # keyword bids set by previous attempts are not sent and recorded to history again
+        kw_bids = checkpoint.pending(kw_bids)
+    if history:
+        kw_bids = history.record(kw_bids)
+    if snapshot:
+        kw_bids = snapshot.record_bids(kw_bids)
     # send keyword bids to yandex direct api
-    response = list(set_keyword_bids(gateway, kw_bids))
+    response = list(checkpoint.results) if checkpoint else []
+    if failed:
+        # failures of previous attempts are reported too
+        for result in response:
+            failed.add(result)
+    results = set_keyword_bids(gateway, kw_bids, failed=failed)
+    if checkpoint:
+        results = checkpoint.record(results)
+    if snapshot:
+        results = snapshot.record_results(results)
+    try:
+        for result in results:
+            response.append(result)
+    except http.DeadlineExceeded as e:
+        # keep results of chunks which were set before deadline
+        e.partial = response
+        raise
     return response
@@ -0,0 +1,210 @@
+"""
+Controllers for Yandex Direct reference data: campaigns, ad groups, ads and sitelinks sets of an account.
+
+Reference data rarely changes, but reading it from Yandex Direct on every run costs API units and time.
+Local copy is kept in :py:class:`auctioneer.models.YdCampaign` and related models and is synced incrementally
+with Yandex Direct changes service::
+
+    sync_reference_data(gateway, account_id)        # full sync on the first call, only changes afterwards
+    campaign_ad_groups(account_id, [1, 2])          # {1: [10, 11], 2: [20]} read from local copy
+
+Changes service timestamp of the last sync is kept in :py:class:`auctioneer.models.YdSyncState`.
+Changed objects are fetched first and written in one short transaction, so local copy is never left half updated
+and no transaction is kept open during API requests. Sitelinks sets of written ads are fetched afterwards.
+Responses cache is bypassed as changed objects must be read from API.
+"""
+import logging
+
+from django.db import transaction
+
+from common import http
+from common.http import cache
+from .. import models
+
+_logger = logging.getLogger(__name__)
+
+# YD API limits of ids in one request
+CAMPAIGN_IDS_LIMIT = 10
+AD_GROUP_IDS_LIMIT = 1000
+AD_IDS_LIMIT = 10_000
+SITELINKS_SET_IDS_LIMIT = 10_000
+
+
+def _chunks(ids: list, limit: int):
+    ids = list(ids)
+    return (ids[i:i + limit] for i in range(0, len(ids), limit))
+
+
+def _items(result) -> list:
+    """Objects received from YD API. Error results break sync rather than leaving local copy partially synced"""
+    items = list(result)
+    for item in items:
+        if type(item) is not dict or 'Id' not in item:
+            raise http.UnExpectedResult(item)
+    return items
+
+
+def _get_campaigns(gateway: http.YandexDirectGateway, account_id: int, ids: list = None) -> [models.YdCampaign]:
+    result = gateway.get_campaigns(selection_criteria={'Ids': ids} if ids else {}, field_names=['Id', 'Name'])
+    return [models.YdCampaign(id=c['Id'], account_id=account_id, name=c.get('Name') or '') for c in _items(result)]
+
+
+def _get_ad_groups(gateway: http.YandexDirectGateway, account_id: int, **criteria) -> [models.YdAdGroup]:
+    result = gateway.get_ad_groups(selection_criteria=criteria, field_names=['Id', 'CampaignId', 'Name'])
+    return [models.YdAdGroup(id=g['Id'], account_id=account_id, campaign_id=g['CampaignId'], name=g.get('Name') or '')
+            for g in _items(result)]
+
+
+def _get_ads(gateway: http.YandexDirectGateway, account_id: int, **criteria) -> [models.YdAd]:
+    result = gateway.get_ads(selection_criteria=criteria, field_names=['Id', 'AdGroupId', 'CampaignId', 'Type'],
+                             text_ad_field_names=['SitelinkSetId'])
+    return [models.YdAd(id=ad['Id'], account_id=account_id, campaign_id=ad['CampaignId'],
+                        ad_group_id=ad['AdGroupId'], type=ad.get('Type') or '',
+                        sitelink_set_id=(ad.get('TextAd') or {}).get('SitelinkSetId'))
+            for ad in _items(result)]
+
+
+def _replace(model, objects: list, **stale):
+    """Delete stale rows and rows of given objects and insert objects"""
+    if stale:
+        model.objects.filter(**stale).delete()
+    for ids in _chunks((o.id for o in objects), AD_IDS_LIMIT):
+        model.objects.filter(id__in=ids).delete()
+    model.objects.bulk_create(objects, batch_size=1000)
+
+
+def _fetch_campaigns_children(gateway: http.YandexDirectGateway, account_id: int,
+                              campaign_ids: list) -> ([models.YdAdGroup], [models.YdAd]):
+    """Ad groups and ads of campaigns received from YD API"""
+    ad_groups, ads = [], []
+    for ids in _chunks(campaign_ids, CAMPAIGN_IDS_LIMIT):
+        ad_groups.extend(_get_ad_groups(gateway, account_id, CampaignIds=ids))
+        ads.extend(_get_ads(gateway, account_id, CampaignIds=ids))
+    return ad_groups, ads
+
+
+def _replace_campaigns_children(account_id: int, campaign_ids: list, ad_groups: list, ads: list):
+    """Replace ad groups and ads of campaigns with ones received from YD API"""
+    _replace(models.YdAdGroup, ad_groups, account_id=account_id, campaign_id__in=campaign_ids)
+    _replace(models.YdAd, ads, account_id=account_id, campaign_id__in=campaign_ids)
+
+
+def _sync_sitelinks(gateway: http.YandexDirectGateway, account_id: int) -> int:
+    """Fetch sitelinks sets used by local ads which are not synced yet. Sitelinks sets can't be changed in YD"""
+    used = set(models.YdAd.objects.filter(account_id=account_id, sitelink_set_id__isnull=False)
+               .values_list('sitelink_set_id', flat=True))
+    known = set(models.YdSitelinksSet.objects.filter(account_id=account_id).values_list('id', flat=True))
+    sets = []
+    for ids in _chunks(sorted(used - known), SITELINKS_SET_IDS_LIMIT):
+        result = gateway.get_sitelinks(selection_criteria={'Ids': ids}, field_names=['Id', 'Sitelinks'])
+        sets.extend(models.YdSitelinksSet(id=s['Id'], account_id=account_id, sitelinks=s.get('Sitelinks') or [])
+                    for s in _items(result))
+    models.YdSitelinksSet.objects.bulk_create(sets, batch_size=1000)
+    return len(sets)
+
+
+def _full_sync(gateway: http.YandexDirectGateway, account_id: int) -> (str, dict):
+    # take timestamp first: changes made during sync will be picked by the next one
+    timestamp = gateway.check_dictionaries()
+    campaigns = _get_campaigns(gateway, account_id)
+    campaign_ids = [c.id for c in campaigns]
+    ad_groups, ads = _fetch_campaigns_children(gateway, account_id, campaign_ids)
+    with transaction.atomic():
+        models.YdCampaign.objects.filter(account_id=account_id).delete()
+        models.YdCampaign.objects.bulk_create(campaigns, batch_size=1000)
+        _replace_campaigns_children(account_id, campaign_ids, ad_groups, ads)
+        models.YdAdGroup.objects.filter(account_id=account_id).exclude(campaign_id__in=campaign_ids).delete()
+        models.YdAd.objects.filter(account_id=account_id).exclude(campaign_id__in=campaign_ids).delete()
+    return timestamp, {'full': True, 'campaigns': len(campaigns), 'ad_groups': len(ad_groups), 'ads': len(ads),
+                       'sitelinks_sets': _sync_sitelinks(gateway, account_id)}
+
+
+def _incremental_sync(gateway: http.YandexDirectGateway, account_id: int, since: str) -> (str, dict):
+    changes = gateway.check_campaigns(since)
+    timestamp = changes['Timestamp']
+    changed = {c['CampaignId']: set(c.get('ChangesIn') or ()) for c in changes.get('Campaigns') or ()}
+    known = set(models.YdCampaign.objects.filter(account_id=account_id, id__in=list(changed))
+                .values_list('id', flat=True))
+    new = [i for i in changed if i not in known]
+    self_changed = [i for i in known if 'SELF' in changed[i]]
+    children_changed = [i for i in known if 'CHILDREN' in changed[i]]
+    campaigns = _get_campaigns(gateway, account_id, self_changed + new) if self_changed or new else []
+    resync = [c.id for c in campaigns if c.id in new]
+    ad_groups, ads, not_found_ad_groups, not_found_ads = [], [], [], []
+    for ids in _chunks(children_changed, CAMPAIGN_IDS_LIMIT):
+        result = gateway.check_changes(since, field_names=['AdGroupIds', 'AdIds'], CampaignIds=ids)
+        modified, not_found = result.get('Modified') or {}, result.get('NotFound') or {}
+        resync.extend((result.get('Unprocessed') or {}).get('CampaignIds') or ())
+        for chunk in _chunks(modified.get('AdGroupIds') or (), AD_GROUP_IDS_LIMIT):
+            ad_groups.extend(_get_ad_groups(gateway, account_id, Ids=chunk))
+        for chunk in _chunks(modified.get('AdIds') or (), AD_IDS_LIMIT):
+            ads.extend(_get_ads(gateway, account_id, Ids=chunk))
+        not_found_ad_groups.extend(not_found.get('AdGroupIds') or ())
+        not_found_ads.extend(not_found.get('AdIds') or ())
+    resync_ad_groups, resync_ads = _fetch_campaigns_children(gateway, account_id, resync) if resync else ([], [])
+    with transaction.atomic():
+        _replace(models.YdCampaign, campaigns)
+        # campaigns which are not received anymore were deleted or archived
+        models.YdCampaign.objects.filter(account_id=account_id, id__in=self_changed + new).exclude(
+            id__in=[c.id for c in campaigns]).delete()
+        _replace(models.YdAdGroup, ad_groups)
+        _replace(models.YdAd, ads)
+        models.YdAdGroup.objects.filter(account_id=account_id, id__in=not_found_ad_groups).delete()
+        models.YdAd.objects.filter(account_id=account_id, id__in=not_found_ads).delete()
+        if resync:
+            _replace_campaigns_children(account_id, resync, resync_ad_groups, resync_ads)
+    return timestamp, {'full': False, 'campaigns': len(campaigns), 'ad_groups': len(ad_groups) + len(resync_ad_groups),
+                       'ads': len(ads) + len(resync_ads), 'sitelinks_sets': _sync_sitelinks(gateway, account_id)}
+
+
+def sync_reference_data(gateway: http.YandexDirectGateway, account_id: int) -> dict:
+    """
+    Sync local copy of account campaigns, ad groups, ads and sitelinks sets with Yandex Direct.
+    Account data is fetched in full on the first sync. Next syncs fetch only objects changed since the previous one.
+
+    :param gateway:         gateway authorized for the account
+    :param account_id:      DB id of :py:class:`common.account.models.Account`
+    :type gateway:          YandexDirectGateway
+    :type account_id:       int
+    :rtype:                 dict
+    :return:                sync stats: {'full': False, 'campaigns': 1, 'ad_groups': 2, 'ads': 2, ...}
+    """
+    state = models.YdSyncState.objects.filter(account_id=account_id).first()
+    with cache.bypass():
+        if state is None:
+            timestamp, stats = _full_sync(gateway, account_id)
+        else:
+            timestamp, stats = _incremental_sync(gateway, account_id, state.timestamp)
+    models.YdSyncState.objects.update_or_create(account_id=account_id, defaults={'timestamp': timestamp})
+    _logger.info(f'Reference data of account {account_id} synced: {stats}')
+    return stats
+
+
+def campaign_ad_groups(account_id: int, campaign_ids: list) -> dict:
+    """
+    Ad groups of campaigns from local copy of reference data
+
+    :param account_id:      DB id of :py:class:`common.account.models.Account`
+    :param campaign_ids:    YD campaigns ids
+    :type account_id:       int
+    :type campaign_ids:     list
+    :rtype:                 dict
+    :return:                {campaign_id: [ad_group_id, ...]} of synced campaigns
+    """
+    ad_groups = {}
+    rows = models.YdAdGroup.objects.filter(account_id=account_id, campaign_id__in=list(campaign_ids))
+    for campaign_id, ad_group_id in rows.values_list('campaign_id', 'id'):
+        ad_groups.setdefault(campaign_id, []).append(ad_group_id)
+    return ad_groups
+
+
+def synced_at(account_id: int):
+    """
+    Time reference data of account was synced at
+
+    :param account_id:      DB id of :py:class:`common.account.models.Account`
+    :type account_id:       int
+    :rtype:                 datetime or None
+    :return:                time of the last successful sync or None if account was never synced
+    """
+    return models.YdSyncState.objects.filter(account_id=account_id).values_list('synced_at', flat=True).first()
@@ -0,0 +1,148 @@
+"""
+Controllers for keyword bids which were not set.
+
+Yandex Direct reports a result of every keyword bid of a set request. Some keyword bids fail with temporary errors
+(e.g. service is busy) while others in the same request are set. Instead of accepting such failures or retrying the
+whole run, keyword bids of temporary errors are sent again in small batches with backoff within the same run::
+
+    failed = FailedKeywordBids(error_codes=(1000, 1001), attempts=3)
+    results = failed.watch(gateway, data, gateway.set_keyword_bids(data))   # results of the last attempts
+    failed.report()     # {'resubmitted': 10, 'recovered': 9, 'errors': {'1000': {'count': 1, 'keyword_ids': [1]}}}
+
+Failures which are left are collected to a compact report: number of failed keyword bids and a few of their ids
+per error code.
+"""
+import logging
+import time
+from typing import Iterator
+
+from django.conf import settings
+
+from common import http
+
+_logger = logging.getLogger(__name__)
+
+
+def _error_codes(result) -> list:
+    if type(result) is not dict:
+        return []
+    return [error.get('Code') for error in result.get('Errors') or () if type(error) is dict]
+
+
+def _batches(items: list, size: int):
+    return (items[i:i + size] for i in range(0, len(items), size))
+
+
+class FailedKeywordBids:
+    """
+    Re-submits keyword bids failed with temporary errors and collects failures of a run
+    """
+
+    def __init__(self, error_codes: tuple = (52, 1000, 1001, 1002), attempts: int = 3, batch_size: int = 500,
+                 backoff: float = 1.0, max_ids: int = 100):
+        """
+        :param error_codes:     codes of temporary errors
+        :param attempts:        max attempts to send failed keyword bids again, 0 - failures are only collected
+        :param batch_size:      keyword bids sent with one request
+        :param backoff:         seconds to wait before the first attempt. Doubled on every next attempt
+        :param max_ids:         max keyword ids of every error code in report
+        :type error_codes:      tuple
+        :type attempts:         int
+        :type batch_size:       int
+        :type backoff:          float
+        :type max_ids:          int
+        """
+        self.error_codes = set(error_codes)
+        self.attempts = attempts
+        self.batch_size = batch_size
+        self.backoff = backoff
+        self.max_ids = max_ids
+        self.resubmitted = self.recovered = 0
+        self._errors = {}   # error code: [count, keyword ids]
+
+    @classmethod
+    def from_settings(cls) -> 'FailedKeywordBids':
+        """Get instance configured by ``KEYWORD_BID_RESUBMIT_*`` settings"""
+        return cls(error_codes=settings.KEYWORD_BID_RESUBMIT_ERROR_CODES,
+                   attempts=settings.KEYWORD_BID_RESUBMIT_ATTEMPTS,
+                   batch_size=settings.KEYWORD_BID_RESUBMIT_BATCH_SIZE,
+                   backoff=settings.KEYWORD_BID_RESUBMIT_BACKOFF,
+                   max_ids=settings.KEYWORD_BID_FAILURES_MAX_IDS)
+
+    def is_transient(self, result: dict) -> bool:
+        """Keyword bid failed with temporary errors only"""
+        codes = _error_codes(result)
+        return bool(codes) and all(code in self.error_codes for code in codes)
+
+    def add(self, result: dict):
+        """Count a final set result if keyword bid was not set"""
+        for code in set(_error_codes(result)):
+            error = self._errors.setdefault(code, [0, []])
+            error[0] += 1
+            if len(error[1]) < self.max_ids and result.get('KeywordId') is not None:
+                error[1].append(result['KeywordId'])
+
+    def watch(self, gateway: http.YandexDirectGateway, data: [dict], results: Iterator[dict]) -> Iterator[dict]:
+        """
+        Pass set results through. Results of temporary errors are held back and their keyword bids are sent again,
+        so that the result of the last attempt is passed for them
+
+        :param gateway:     gateway instance
+        :param data:        keyword bids data which was sent: [{'KeywordId': 1, 'SearchBid': 1000}, ...]
+        :param results:     set results of the data
+        :type gateway:      YandexDirectGateway
+        :type data:         list
+        :type results:      Iterator[dict]
+        :rtype:             Iterator[dict]
+        """
+        held = {}
+        for result in results:
+            if self.attempts and self.is_transient(result) and result.get('KeywordId') is not None:
+                held[result['KeywordId']] = result
+                continue
+            self.add(result)
+            yield result
+        items = [item for item in data if item.get('KeywordId') in held] if held else []
+        for attempt in range(self.attempts):
+            if not items:
+                break
+            backoff = self.backoff * 2 ** attempt
+            run_deadline = http.deadline.current()
+            if run_deadline and run_deadline.remaining() <= backoff:
+                _logger.warning(f'No time left to resubmit {len(items)} failed keyword bids')
+                break
+            time.sleep(backoff)
+            self.resubmitted += len(items)
+            _logger.info(f'Resubmitting {len(items)} keyword bids failed with temporary errors. Attempt {attempt + 1}')
+            for batch in _batches(items, self.batch_size):
+                # keyword bids were counted as sent with the first attempt
+                for result in gateway.send_keyword_bids(batch):
+                    keyword_id = result.get('KeywordId') if type(result) is dict else None
+                    if keyword_id not in held:
+                        _logger.warning(f'Unexpected result of resubmitted keyword bids: {result}')
+                        continue
+                    if self.is_transient(result):
+                        held[keyword_id] = result
+                        continue
+                    del held[keyword_id]
+                    self.recovered += not _error_codes(result)
+                    self.add(result)
+                    yield result
+            items = [item for item in items if item['KeywordId'] in held]
+        for result in held.values():
+            self.add(result)
+            yield result
+
+    def report(self) -> dict or None:
+        """
+        Compact report of keyword bids which were not set
+
+        :rtype:     dict or None
+        :return:    {'resubmitted': 10, 'recovered': 9, 'errors': {'1000': {'count': 1, 'keyword_ids': [1]}}} \
+        or None if every keyword bid was set with the first attempt
+        """
+        if not (self._errors or self.resubmitted):
+            return None
+        return {'resubmitted': self.resubmitted, 'recovered': self.recovered,
+                'errors': {str(code): {'count': count, 'keyword_ids': ids}
+                           for code, (count, ids) in sorted(self._errors.items(), key=lambda e: str(e[0]))}}
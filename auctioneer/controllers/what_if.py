@@ -0,0 +1,219 @@
+"""
+Controllers for what-if simulation of keyword bid rules.
+
+Rule parameters are tuned against stored auctions instead of production. Every combination of parameter values
+is evaluated over a columnar batch of keyword bids at once, without mapping keyword bids to entities::
+
+    variants = rule_variants(kw_bid_rule, target_bid_diffs=[5, 10], bid_increase_percentages=[10], max_bids=[50, 100])
+    simulate_rule(kw_bid_rule, variants)
+    # [{'target_bid_diff': 5, 'bid_increase_percentage': 10, 'max_bid': 50, 'keywords': 1000, 'changed': 920,
+    #   'bids': {'min': 1000000, 'p25': ..., 'median': ..., 'p75': ..., 'max': 50000000, 'mean': ...},
+    #   'spend_delta': 120000000}, ...]
+
+Keyword bids are taken from the auction snapshot of rule account, see
+:py:mod:`auctioneer.controllers.auction_snapshot`. Calculation mirrors
+:py:class:`auctioneer.formulas.SearchBidFormula`, so that simulated bids match bids the rule would set.
+
+Projected spend of a keyword is traffic volume multiplied by price of the first auction position its bid reaches,
+divided by 100. Spend delta is the difference of projected spend of simulated and current bids of all keywords.
+Columns are evaluated with NumPy. If NumPy is not installed, every keyword bid is evaluated by a plain Python loop
+for every variant, which is orders of magnitude slower for large batches; evaluation path is logged.
+"""
+import copy
+import logging
+import os
+import time
+from itertools import product
+
+from django.conf import settings
+
+from . import auction_snapshot, bid_calculator, columnar, keyword_bid_rule as rules
+from .. import entities, models
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_logger = logging.getLogger(__name__)
+
+MAX_VARIANTS = 1000     # parameter combinations of one simulation
+PERCENTILES = {'min': 0, 'p25': 25, 'median': 50, 'p75': 75, 'max': 100}
+GRID_PARAMS = ('target_bid_diff', 'bid_increase_percentage', 'max_bid')
+
+
+def rule_variants(kw_bid_rule: models.KeywordBidRule, **grid) -> [models.KeywordBidRule]:
+    """
+    Copies of a rule with every combination of parameter values. Copies are not saved
+
+    :param kw_bid_rule:     rule to simulate
+    :param grid:            lists of values of ``target_bid_diffs``, ``bid_increase_percentages`` and ``max_bids`` \
+    in rule model units. Value of the rule is used if a list is not set
+    :type kw_bid_rule:      models.KeywordBidRule
+    :type grid:             dict
+    :rtype:                 [models.KeywordBidRule]
+    :raises:                ValueError if there are more than ``MAX_VARIANTS`` combinations
+    """
+    values = [grid.get(f'{param}s') or [getattr(kw_bid_rule, param)] for param in GRID_PARAMS]
+    count = 1
+    for param_values in values:
+        count *= len(param_values)
+    if count > MAX_VARIANTS:
+        raise ValueError(f'{count} parameter combinations, at most {MAX_VARIANTS} are simulated at once')
+    variants = []
+    for combination in product(*values):
+        variant = copy.copy(kw_bid_rule)
+        for param, value in zip(GRID_PARAMS, combination):
+            setattr(variant, param, value)
+        variants.append(variant)
+    return variants
+
+
+def snapshot_batch(kw_bid_rule: models.KeywordBidRule, max_age: float = None) -> str or None:
+    """
+    Export keyword bids of rule targets from auction snapshot of rule account to a batch file.
+    Batch exported within ``max_age`` seconds is reused
+
+    :param kw_bid_rule:     rule to simulate
+    :param max_age:         seconds, ``KEYWORD_BID_SNAPSHOT_MAX_AGE`` if not set
+    :type kw_bid_rule:      models.KeywordBidRule
+    :type max_age:          float
+    :rtype:                 str or None
+    :return:                batch file path or None if snapshot has no keyword bids of rule targets
+    """
+    max_age = settings.KEYWORD_BID_SNAPSHOT_MAX_AGE if max_age is None else max_age
+    path = os.path.join(settings.KEYWORD_BID_SNAPSHOT_DIR, f'rule_{kw_bid_rule.id}.kwb')
+    try:
+        if time.time() - os.path.getmtime(path) <= max_age:
+            return path
+    except OSError:
+        pass
+    rule = rules.map_keyword_bid_rule(kw_bid_rule)
+    store = auction_snapshot.AuctionSnapshotStore.for_account(rule.account)
+    params = bid_calculator.request_fields((*bid_calculator.BID_CALCULATION_FORMULAS, store))
+    targets = {rule.target_type: rule.target_values}
+    params['selection_criteria'] = dict(targets)
+    if rule.serving_statuses:
+        params['selection_criteria']['ServingStatuses'] = list(rule.serving_statuses)
+    try:
+        count = store.export(targets, params, path)
+    finally:
+        store.close()
+    if not count:
+        os.remove(path)
+        return None
+    return path
+
+
+def simulate_rule(kw_bid_rule: models.KeywordBidRule, variants: [models.KeywordBidRule]) -> [dict] or None:
+    """
+    Simulate rule variants over keyword bids of rule targets from auction snapshot
+
+    :param kw_bid_rule:     rule to simulate
+    :param variants:        rule copies with parameters to simulate, see :py:func:`rule_variants`
+    :type kw_bid_rule:      models.KeywordBidRule
+    :type variants:         [models.KeywordBidRule]
+    :rtype:                 [dict] or None
+    :return:                parameters in rule model units and results of every variant \
+    or None if there is no snapshot of rule targets
+    """
+    path = snapshot_batch(kw_bid_rule)
+    if not path:
+        return None
+    with columnar.KeywordBidBatch(path) as batch:
+        results = simulate(batch, [rules.map_keyword_bid_rule(variant) for variant in variants])
+    return [{**{param: getattr(variant, param) for param in GRID_PARAMS}, **result}
+            for variant, result in zip(variants, results)]
+
+
+def simulate(batch: columnar.KeywordBidBatch, kw_bid_rules: [entities.KeywordBidRule]) -> [dict]:
+    """
+    Evaluate search bids of every rule over keyword bids batch. Keyword bids with less than two auction bid items
+    are not changed by formulas and are not counted
+
+    :param batch:           keyword bids batch
+    :param kw_bid_rules:    rules to evaluate
+    :type batch:            columnar.KeywordBidBatch
+    :type kw_bid_rules:     [entities.KeywordBidRule]
+    :rtype:                 [dict]
+    :return:                results of every rule: number of evaluated and changed keyword bids, \
+    distribution of calculated bids and projected spend delta
+    """
+    started = time.perf_counter()
+    if numpy is not None:
+        evaluate, path = _evaluate_numpy, 'NumPy'
+    else:
+        evaluate, path = _evaluate_python, 'Python loops, NumPy is not installed'
+        _logger.warning(f'NumPy is not installed, {len(batch)} keyword bids are simulated with slow Python loops')
+    results = list(evaluate(batch, kw_bid_rules))
+    _logger.info(f'{len(kw_bid_rules)} rule variants simulated over {len(batch)} keyword bids with {path} in '
+                 f'{time.perf_counter() - started:.2f}s')
+    return results
+
+
+def _result(keywords: int, changed: int, sorted_bids, mean: float, new_spend: float, current_spend: float) -> dict:
+    bids = {name: int(sorted_bids[(keywords - 1) * percentile // 100]) if keywords else None
+            for name, percentile in PERCENTILES.items()}
+    bids['mean'] = float(mean) if keywords else None
+    return {'keywords': keywords, 'changed': int(changed), 'bids': bids,
+            'spend_delta': round(float(new_spend) - float(current_spend))}
+
+
+def _evaluate_numpy(batch: columnar.KeywordBidBatch, kw_bid_rules: [entities.KeywordBidRule]):
+    count, width = len(batch), batch.ladder_width
+    if width < 2:
+        yield from (_result(0, 0, (), 0, 0, 0) for _ in kw_bid_rules)
+        return
+    ladder_bid = batch.columns['auction_bid'].reshape(count, width)
+    valid = (batch.columns['auction_size'] >= 2) & (ladder_bid[:, 1] > 0)
+    keywords = int(numpy.count_nonzero(valid))
+    ladder_bid = ladder_bid[valid]
+    traffic = batch.columns['traffic_volume'].reshape(count, width)[valid]
+    price = batch.columns['auction_price'].reshape(count, width)[valid]
+    positions = numpy.arange(width) < batch.columns['auction_size'][valid][:, None]
+    rows = numpy.arange(keywords)
+    first, second, current = ladder_bid[:, 0], ladder_bid[:, 1], batch.columns['bid'][valid]
+    diff = (first - second) / second
+
+    def spend(bids) -> float:
+        # the first position of auction which bid is not higher than keyword bid
+        reached = positions & (ladder_bid <= bids[:, None])
+        index = reached.argmax(axis=1)
+        return numpy.where(reached.any(axis=1), traffic[rows, index] * price[rows, index], 0).sum() / 100
+
+    current_spend = spend(current)
+    for rule in kw_bid_rules:
+        base = numpy.where(diff < rule.target_bid_diff, first, second)
+        new = numpy.minimum(base * (1 + rule.bid_increase_percentage), rule.max_bid).astype('int64')
+        changed = numpy.count_nonzero(new != current)
+        mean = new.mean() if keywords else 0
+        yield _result(keywords, changed, numpy.sort(new), mean, spend(new), current_spend)
+
+
+def _evaluate_python(batch: columnar.KeywordBidBatch, kw_bid_rules: [entities.KeywordBidRule]):
+    columns, width = batch.columns, batch.ladder_width
+    keyword_bids = []   # current bid, first and second auction bid, [(auction bid, traffic volume, price)]
+    for index in range(len(batch)):
+        size = columns['auction_size'][index]
+        start = index * width
+        if size < 2 or columns['auction_bid'][start + 1] <= 0:
+            continue
+        ladder = [(columns['auction_bid'][position], columns['traffic_volume'][position],
+                   columns['auction_price'][position]) for position in range(start, start + size)]
+        keyword_bids.append((columns['bid'][index], ladder[0][0], ladder[1][0], ladder))
+
+    def spend(bid: int, ladder: list) -> float:
+        return next((traffic * price / 100 for auction_bid, traffic, price in ladder if auction_bid <= bid), 0)
+
+    current_spend = sum(spend(current, ladder) for current, _, _, ladder in keyword_bids)
+    for rule in kw_bid_rules:
+        new_bids, changed, new_spend = [], 0, 0
+        for current, first, second, ladder in keyword_bids:
+            bid = int(min((first if (first - second) / second < rule.target_bid_diff else second) *
+                          (1 + rule.bid_increase_percentage), rule.max_bid))
+            new_bids.append(bid)
+            changed += bid != current
+            new_spend += spend(bid, ladder)
+        new_bids.sort()
+        mean = sum(new_bids) / len(new_bids) if new_bids else 0
+        yield _result(len(new_bids), changed, new_bids, mean, new_spend, current_spend)
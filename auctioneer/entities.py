@@ -11,14 +11,16 @@ class KeywordBid(NamedTuple):
     data source is decoupled from entity. So you may decide to store KeywordBid data in data base or other source
     and will require minimal changes in application.
 
+    Only fields used by calculation formulas are requested from YD API, other fields are None.
+
     """
-    campaign_id: int        #: YD Campaign ID
-    ad_group_id: int        #: YD AdGroup ID
-    keyword_id: int         #: YD KeywordBid ID
-    search: dict            #: Search bids collection data (may include current Bid and AuctionBids data
-    network: dict           #: Same as Search bid but for Network
-    serving_status: str
-    strategy_priority: str
+    campaign_id: int = None         #: YD Campaign ID
+    ad_group_id: int = None         #: YD AdGroup ID
+    keyword_id: int = None          #: YD KeywordBid ID
+    search: dict = None             #: Search bids collection data (may include current Bid and AuctionBids data
+    network: dict = None            #: Same as Search bid but for Network
+    serving_status: str = None
+    strategy_priority: str = None
 
     def as_dict(self) -> dict:
         """Returns a dictionary with keys in YD representation and entity attributes values"""
@@ -61,3 +63,7 @@ class KeywordBidRule(NamedTuple):
     """
     Upper threshold for our bid increase
     """
+    serving_statuses: list = ()
+    """
+    Keyword serving statuses rule should be applied to. All keywords if empty
+    """
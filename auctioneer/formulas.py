@@ -26,7 +26,13 @@ class KeywordBidFormula:
         formula(*args, **kwargs)        # function formula application
         formula.apply(*args, **kwargs)  # method call formula application
 
+    Formula declares keyword bid fields it reads, so that only these fields are requested from Yandex Direct API.
+    Fields which are not requested are None in KeywordBid entity.
     """
+    field_names = ()            #: YD API keyword bid FieldNames used by formula
+    search_field_names = ()     #: YD API keyword bid SearchFieldNames used by formula
+    network_field_names = ()    #: YD API keyword bid NetworkFieldNames used by formula
+
     def __init__(self, keyword_bid: entities.KeywordBid, rule: entities.KeywordBidRule):
         """
         :param keyword_bid:         keyword bid **entity**
@@ -59,6 +65,8 @@ class SearchBidFormula(KeywordBidFormula):
     Search Bid calculation algorithm.
     Calculates new search bid that should be set on a given keyword
     """
+    search_field_names = ('Bid', 'AuctionBids')
+
     def apply(self, *args, **kwargs):
         """
         More info on calculation algorithm `here <https://jira.lamoda.ru/browse/MARK-455>`_.
@@ -2,21 +2,116 @@
 Auctioneer controller.
 Here we should implement main login of auctioneer app.
 """
+import logging
+import os
+from uuid import uuid4
+
+from django.conf import settings
+from django.dispatch import Signal
+
 from auctioneer import controllers
+from common import http, timing
 from common.account import controllers as account
 
+_logger = logging.getLogger(__name__)
+
+run_aborted = Signal(providing_args=['reason', 'sent'])
+"""Sent when a run is aborted before all keyword bids were set, with number of set results received"""
+keyword_bids_failed = Signal(providing_args=['failures'])
+"""Sent when some keyword bids of a run were not set or were resubmitted, with compact failures report"""
+
 
 class NoResponseError(Exception):
     """"""
 
 
-def run(kw_bid_rule_id: int):
+def _report_failures(failed: controllers.resubmit.FailedKeywordBids):
+    report = failed.report()
+    if report:
+        _logger.warning(f'Keyword bids were not set: {report}')
+        keyword_bids_failed.send(sender=run.__name__, failures=report)
+
+
+def run(kw_bid_rule_id: int, run_id: str = None, time_budget: float = None):
     kw_bid_rule = controllers.keyword_bid_rule.get_keywordbid_rule(kw_bid_rule_id)
     assert kw_bid_rule, 'No keyword bid rule found.'  # this is here to break gracefuly
     kw_bid_rule_entity = controllers.keyword_bid_rule.map_keyword_bid_rule(kw_bid_rule)
     gateway = account.make_yd_gateway(kw_bid_rule_entity.account)
     params = {'selection_criteria': {kw_bid_rule_entity.target_type: kw_bid_rule_entity.target_values}}
-    response = controllers.keyword_bids.calculate_keyword_bids(gateway, kw_bid_rule_entity, **params)
+    if kw_bid_rule_entity.serving_statuses:
+        # filter keywords on Yandex Direct side
+        params['selection_criteria']['ServingStatuses'] = list(kw_bid_rule_entity.serving_statuses)
+    run_id = run_id or uuid4().hex
+    history = fingerprints = planner = recorder = timer = checkpoint = snapshot = None
+    if settings.KEYWORD_BID_FINGERPRINTS_ENABLED:
+        fingerprints = controllers.fingerprints.KeywordBidFingerprints.for_rule(kw_bid_rule_id, kw_bid_rule_entity)
+    if settings.KEYWORD_BID_CHUNK_PLANNER_ENABLED:
+        planner = controllers.chunk_planner.KeywordChunkPlanner.for_rule(kw_bid_rule_id)
+    if settings.KEYWORD_BID_CHECKPOINT_ENABLED:
+        # a run redelivered after its time budget is not resumed with outdated auction data
+        checkpoint = controllers.checkpoint.RunCheckpoint.for_run(kw_bid_rule_id, run_id, max_age=time_budget)
+    if settings.KEYWORD_BID_SNAPSHOT_ENABLED:
+        snapshot = controllers.auction_snapshot.AuctionSnapshotStore.for_account(kw_bid_rule_entity.account)
+    if settings.KEYWORD_BID_HISTORY_ENABLED:
+        history = controllers.bid_history.KeywordBidHistoryWriter(run_id)
+        history.start()
+    # request only keyword bid fields which are used in this run
+    consumers = (*controllers.bid_calculator.BID_CALCULATION_FORMULAS,
+                 *filter(None, (history, fingerprints, planner, snapshot)))
+    params.update(controllers.bid_calculator.request_fields(consumers))
+    failed = controllers.resubmit.FailedKeywordBids.from_settings()
+    if settings.YD_TRAFFIC_RECORD_DIR:
+        os.makedirs(settings.YD_TRAFFIC_RECORD_DIR, exist_ok=True)
+        recorder = http.HttpRecorder(os.path.join(settings.YD_TRAFFIC_RECORD_DIR, f'{run_id}.jsonl.gz'))
+        gateway.client.configure(recorder=recorder)
+    if settings.STAGE_TIMING_ENABLED:
+        timer = timing.StageTimer()
+        timer.start()
+    try:
+        with http.deadline.use(http.Deadline(time_budget) if time_budget else None):
+            if planner:
+                planner.refresh(gateway, params['selection_criteria'], kw_bid_rule_entity.account)
+            response = controllers.keyword_bids.calculate_keyword_bids(gateway, kw_bid_rule_entity,
+                                                                       history=history,
+                                                                       fingerprints_store=fingerprints,
+                                                                       chunk_planner=planner,
+                                                                       checkpoint=checkpoint, failed=failed,
+                                                                       snapshot=snapshot, **params)
+    except http.DeadlineExceeded as e:
+        # abort cleanly: results received so far are returned, but counts and fingerprints are not saved
+        # as not every calculated bid was set
+        response = e.partial or []
+        _logger.warning(f'Run {run_id} of rule {kw_bid_rule_id} aborted: {e}. {len(response)} results received')
+        run_aborted.send(sender=run.__name__, reason=str(e), sent=len(response))
+        _report_failures(failed)
+        if checkpoint:
+            checkpoint.clear()
+        return response
+    finally:
+        if timer:
+            timer.stop()
+        if history:
+            history.close()
+        if recorder:
+            gateway.client.configure(recorder=None)
+            recorder.close()
+        if checkpoint:
+            # kept for retry of the failed run
+            checkpoint.close()
+        if snapshot:
+            _logger.info(f'Run {run_id} of rule {kw_bid_rule_id}: {snapshot.hits} targets read from auction snapshot, '
+                         f'{snapshot.misses} requested')
+            snapshot.close()
+    if checkpoint:
+        checkpoint.clear()
+    _report_failures(failed)
+    if planner:
+        planner.save()
+    if fingerprints:
+        fingerprints.save()
+        if not fingerprints.changed_count:
+            # nothing has changed since the last run, so nothing was sent to YD API
+            return response
     if not response:
         raise NoResponseError('No response recieved')
     return response
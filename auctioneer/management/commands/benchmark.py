@@ -0,0 +1,48 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctioneer import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark get-calculate-set cycle stages and compare results to a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(benchmarks.DEFAULT_SIZES),
+                            help='Number of keywords in data sets')
+        parser.add_argument('--case', action='append', choices=list(benchmarks.BENCHMARKS), dest='cases',
+                            help='Case to run. All cases are run by default')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs of every case')
+        parser.add_argument('--output', default='-', help='JSON results file. Results are printed if not set')
+        parser.add_argument('--baseline', help='JSON results file to compare with')
+        parser.add_argument('--threshold', type=float, default=benchmarks.DEFAULT_THRESHOLD,
+                            help='Relative slowdown considered a regression')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        results = benchmarks.run_benchmarks(sizes=options['sizes'], cases=options['cases'],
+                                            repeat=options['repeat'])
+        if options['output'] == '-':
+            json.dump(results, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        else:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+        for result in results['results']:
+            self.stderr.write(f'{result["case"]:<24}{result["size"]:>10}{result["min"]:>12.4f}s'
+                              f'{result["items_per_second"] or 0:>14.0f} items/s')
+        if baseline is None:
+            return
+        comparison = benchmarks.compare(results, baseline, options['threshold'])
+        for item in comparison:
+            self.stderr.write(f'{item["case"]:<24}{item["size"]:>10}{item["baseline"]:>12.4f}s'
+                              f'{item["current"]:>12.4f}s{item["change"]:>+9.1%}'
+                              f'{"  REGRESSION" if item["regression"] else ""}')
+        regressions = [item for item in comparison if item['regression']]
+        if regressions:
+            raise CommandError(f'{len(regressions)} benchmark regressions over {options["threshold"]:.0%}')
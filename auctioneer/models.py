@@ -6,8 +6,9 @@ Model management logic implemented in :py:mod:`auctioneer.controllers`
 
 import logging
 
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
 from django.db import models
+from django.utils import timezone
 
 from common.account.models import Account
 from . import constants
@@ -46,6 +47,12 @@ class KeywordBidRule(models.Model):
     """
     Upper threshold for our bid increase
     """
+    serving_statuses = ArrayField(models.CharField(max_length=20, choices=constants.KEYWORD_SERVING_STATUSES),
+                                  blank=True, default=list, verbose_name='Serving statuses')
+    """
+    Keyword serving statuses rule should be applied to. Keywords with other statuses are not requested from
+    Yandex Direct. All keywords are requested if empty.
+    """
 
     class Meta:
         verbose_name = 'Keyword Rule'
@@ -74,3 +81,112 @@ class KeywordBidRule(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class KeywordBidChange(models.Model):
+    """
+    History of keyword bids changed by rule runs.
+
+    Rows are written in bulk with Postgres COPY by :py:class:`auctioneer.controllers.bid_history.KeywordBidHistoryWriter`
+    and removed after ``KEYWORD_BID_HISTORY_RETENTION_DAYS`` by
+    :py:func:`auctioneer.controllers.bid_history.purge_keyword_bid_history`.
+    Avoid creating rows one by one through ORM.
+    """
+    run_id = models.CharField(max_length=64, db_index=True)
+    """Id of the run (celery task id) which changed the bid"""
+    keyword_id = models.BigIntegerField()
+    """YD KeywordBid ID"""
+    old_bid = models.BigIntegerField(null=True)
+    """Search bid received from YD API before calculation"""
+    new_bid = models.BigIntegerField(null=True)
+    """Search bid calculated and sent to YD API"""
+    first_auction_bid = models.BigIntegerField(null=True)
+    """Bid of the first AuctionBidItem at the moment of calculation"""
+    second_auction_bid = models.BigIntegerField(null=True)
+    """Bid of the second AuctionBidItem at the moment of calculation"""
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = 'Keyword bid change'
+        verbose_name_plural = 'Keyword bid changes'
+        index_together = [('keyword_id', 'created_at')]
+
+    def __str__(self):
+        return f'{self.keyword_id}: {self.old_bid} -> {self.new_bid}'
+
+
+class YdCampaign(models.Model):
+    """
+    Local copy of Yandex Direct campaign.
+
+    Reference data models are kept in sync with Yandex Direct by
+    :py:func:`auctioneer.controllers.reference_data.sync_reference_data`. Ids are Yandex Direct ids.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = 'YD campaign'
+        verbose_name_plural = 'YD campaigns'
+
+    def __str__(self):
+        return self.name or str(self.id)
+
+
+class YdAdGroup(models.Model):
+    """Local copy of Yandex Direct ad group"""
+    id = models.BigIntegerField(primary_key=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    campaign_id = models.BigIntegerField(db_index=True)
+    name = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = 'YD ad group'
+        verbose_name_plural = 'YD ad groups'
+
+    def __str__(self):
+        return self.name or str(self.id)
+
+
+class YdAd(models.Model):
+    """Local copy of Yandex Direct ad"""
+    id = models.BigIntegerField(primary_key=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    campaign_id = models.BigIntegerField(db_index=True)
+    ad_group_id = models.BigIntegerField(db_index=True)
+    type = models.CharField(max_length=50, blank=True)
+    sitelink_set_id = models.BigIntegerField(null=True)
+    """Sitelinks set of text ad"""
+
+    class Meta:
+        verbose_name = 'YD ad'
+        verbose_name_plural = 'YD ads'
+
+
+class YdSitelinksSet(models.Model):
+    """Local copy of Yandex Direct sitelinks set"""
+    id = models.BigIntegerField(primary_key=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    sitelinks = JSONField(default=list)
+
+    class Meta:
+        verbose_name = 'YD sitelinks set'
+        verbose_name_plural = 'YD sitelinks sets'
+
+
+class YdSyncState(models.Model):
+    """
+    Yandex Direct changes service timestamp reference data of account was synced at.
+    Reference data is synced from scratch if account has no state.
+    """
+    account = models.OneToOneField(Account, on_delete=models.CASCADE, related_name='yd_sync_state')
+    timestamp = models.CharField(max_length=30)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'YD sync state'
+        verbose_name_plural = 'YD sync states'
+
+    def __str__(self):
+        return f'{self.account}: {self.timestamp}'
@@ -6,9 +6,14 @@ from django.conf import settings
 
 from .models import Account
 from ..http import oauth
+from ..http.breaker import CircuitBreaker
+from ..http.cache import ResponseCache
 from ..http.gateway import YandexDirectGateway, OAuthGateway
 from . import costants as const
 
+_response_cache = _circuit_breaker = None
+
+
 def set_account_token(account_id: int, token: str, force: bool = False) -> int:
     """
     Check if account already has token or we try to set new token from yandex api.
@@ -81,6 +86,7 @@ def get_client_login(token: str) -> str:
     :rtype:             str
     """
     gateway = YandexDirectGateway(token=token)
+    gateway.default_api_url = settings.YD_API_URL
     result = gateway.get_client_login()
     return result
 
@@ -97,5 +103,59 @@ def make_yd_gateway(account_id: int) -> YandexDirectGateway:
     assert account.acc_type == const.YD_ACCOUNT_TYPE, f'Wrong account type. ' \
         f'Expected {const.YD_ACCOUNT_TYPE}, got {account.acc_type}'
     gateway = YandexDirectGateway(token=account.token)
+    gateway.default_api_url = settings.YD_API_URL
+    gateway.client.configure(wire_log_max_bytes=settings.YD_WIRE_LOG_MAX_BYTES,
+                             wire_log_sample_rate=settings.YD_WIRE_LOG_SAMPLE_RATE,
+                             response_cache=get_response_cache(),
+                             circuit_breaker=get_circuit_breaker(),
+                             keep_alive_idle_timeout=settings.YD_KEEP_ALIVE_IDLE_TIMEOUT)
     return gateway
 
+
+def get_response_cache() -> ResponseCache or None:
+    """
+    Process-wide cache of read-only Yandex Direct API responses configured by ``YD_RESPONSE_CACHE_*`` settings
+
+    :rtype:     ResponseCache or None
+    :return:    cache or None if caching is disabled
+    """
+    global _response_cache
+    if not settings.YD_RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(ttl=settings.YD_RESPONSE_CACHE_TTL,
+                                        max_bytes=settings.YD_RESPONSE_CACHE_MAX_BYTES,
+                                        path=settings.YD_RESPONSE_CACHE_DIR,
+                                        max_disk_bytes=settings.YD_RESPONSE_CACHE_DIR_MAX_BYTES)
+    return _response_cache
+
+
+def get_circuit_breaker() -> CircuitBreaker or None:
+    """
+    Process-wide circuit breaker of Yandex Direct API endpoints configured by ``YD_CIRCUIT_*`` settings
+
+    :rtype:     CircuitBreaker or None
+    :return:    breaker or None if it is disabled
+    """
+    global _circuit_breaker
+    if not settings.YD_CIRCUIT_BREAKER_ENABLED:
+        return None
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker(failure_threshold=settings.YD_CIRCUIT_FAILURE_THRESHOLD,
+                                          reset_timeout=settings.YD_CIRCUIT_RESET_TIMEOUT)
+    return _circuit_breaker
+
+
+def keep_alive_yd_connections() -> int:
+    """
+    Open keep-alive connections to Yandex Direct API configured by ``YD_KEEP_ALIVE_*`` settings. Connections idle
+    for too long are closed and opened again
+
+    :rtype:     int
+    :return:    number of connections opened
+    """
+    if not settings.YD_KEEP_ALIVE_CONNECTIONS:
+        return 0
+    client = YandexDirectGateway.client
+    client.configure(keep_alive_idle_timeout=settings.YD_KEEP_ALIVE_IDLE_TIMEOUT)
+    return client.keep_alive(settings.YD_API_URL, settings.YD_KEEP_ALIVE_CONNECTIONS)
@@ -1,7 +1,12 @@
 import os
-from celery import Celery
+import time
+
+from celery import Celery, signals
 from django.conf import settings
 
+from common import metrics, timing
+from common.http import YandexDirectGateway
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings" if os.path.isfile('settings.py') else 'common.settings')
 
 app = Celery()
@@ -9,3 +14,61 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 app.conf.task_routes = settings.TASK_ROUTES
 app.conf.CELERY_TRACK_STARTED = True
+
+
+# Metrics exporter. Worker processes flush their metrics to files aggregated by /metrics view
+
+_task_started = {}
+
+
+@signals.before_task_publish.connect
+def _set_published_at(sender=None, headers=None, **kwargs):
+    headers['published_at'] = time.time()
+
+
+@signals.worker_init.connect
+@signals.worker_process_init.connect
+def _start_metrics_flusher(**kwargs):
+    metrics.start_flusher()
+
+
+@signals.task_prerun.connect
+def _observe_task_start(sender=None, task_id=None, task=None, **kwargs):
+    now = time.time()
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at:
+        metrics.task_queue_wait.observe(max(now - published_at, 0), task=task.name)
+    _task_started[task_id] = now
+
+
+@signals.task_postrun.connect
+def _observe_task_end(sender=None, task_id=None, task=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started:
+        metrics.task_duration.observe(time.time() - started, task=task.name)
+    if settings.METRICS_ENABLED:
+        YandexDirectGateway.client.pool_stats()
+        metrics.flush()
+
+
+# Keep-alive connections to Yandex Direct API are opened at worker start and before tasks after idle periods
+
+@signals.worker_process_init.connect
+def _warm_up_connections(**kwargs):
+    from common.account.controllers import keep_alive_yd_connections
+    keep_alive_yd_connections()
+
+
+@signals.task_prerun.connect
+def _keep_alive_connections(sender=None, task=None, **kwargs):
+    if not task.request.is_eager:
+        from common.account.controllers import keep_alive_yd_connections
+        keep_alive_yd_connections()
+
+
+def _observe_stage_timings(sender=None, timings=None, **kwargs):
+    for stage, data in timings['stages'].items():
+        metrics.run_stage_duration.observe(data['seconds'], stage=stage)
+
+
+timing.stage_timings.connect(_observe_stage_timings)
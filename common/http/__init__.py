@@ -1,4 +1,8 @@
 from .constants import *
 from .gateway import *
 from .client import *
-from .exceptions import *
\ No newline at end of file
+from .exceptions import *
+from .replay import *
+from .cache import *
+from .breaker import *
+from .deadline import *
@@ -0,0 +1,124 @@
+"""
+Circuit breakers of API endpoints.
+
+When API degrades, every request is retried by transport adapter and then by gateway, so runs pile up waiting
+on a service which is down. Client keeps a circuit per account and endpoint. After ``failure_threshold``
+consecutive failures the circuit opens and requests fail at once with :py:class:`CircuitOpen` instead of being
+sent. After ``reset_timeout`` seconds the circuit is half-open: one trial request is sent and closes the circuit
+on success or opens it again on failure::
+
+    YandexDirectGateway.client.configure(circuit_breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30))
+    try:
+        gateway.get_client_login()
+    except CircuitOpen as e:
+        retry_later(countdown=e.retry_after)
+
+Circuit states are exported as ``http_circuit_state`` metric.
+"""
+import threading
+import time
+from logging import getLogger
+
+from common import metrics
+from .exceptions import CircuitOpen
+
+__all__ = ['CircuitBreaker', 'Circuit']
+_logger = getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+STATE_NAMES = {CLOSED: 'closed', OPEN: 'open', HALF_OPEN: 'half-open'}
+
+
+class Circuit:
+    """
+    State of one account endpoint. Thread safe.
+    """
+    def __init__(self, account: str, endpoint: str, failure_threshold: int, reset_timeout: float,
+                 clock=time.monotonic):
+        self.account = account
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0
+        self._trial = False     # half-open trial request is in flight
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def before(self):
+        """
+        Check request can be sent
+
+        :raises:    CircuitOpen if circuit is open or its trial request is still in flight
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            retry_after = self._opened_at + self.reset_timeout - self._clock()
+            if self.state == OPEN and retry_after <= 0:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return
+        metrics.http_circuit_rejected.inc(endpoint=self.endpoint)
+        raise CircuitOpen(f'Circuit of {self.endpoint} is {STATE_NAMES[self.state]}', retry_after=max(retry_after, 1))
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+                self._set_state(OPEN)
+
+    def release(self):
+        """Request ended with neither success nor failure. State is kept, next trial request may be sent"""
+        with self._lock:
+            self._trial = False
+
+    def _set_state(self, state: int):
+        if state != self.state:
+            _logger.warning(f'Circuit of {self.endpoint} ({self.account}) is {STATE_NAMES[state]}')
+        self.state = state
+        metrics.http_circuit_state.set(state, account=self.account, endpoint=self.endpoint)
+
+
+class CircuitBreaker:
+    """
+    Circuits of all accounts and endpoints requested by a client
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, clock=time.monotonic):
+        """
+        :param failure_threshold:   consecutive failures which open circuit
+        :param reset_timeout:       seconds circuit stays open before trial request
+        :param clock:               monotonic clock function
+        :type failure_threshold:    int
+        :type reset_timeout:        float
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def circuit(self, account: str, endpoint: str) -> Circuit:
+        """Get circuit of account endpoint. New circuits are closed"""
+        key = (account, endpoint)
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            with self._lock:
+                circuit = self._circuits.setdefault(key, Circuit(account, endpoint, self.failure_threshold,
+                                                                 self.reset_timeout, self._clock))
+        return circuit
+
+    def states(self) -> dict:
+        """States of known circuits: {(account, endpoint): 'closed'}"""
+        return {key: STATE_NAMES[circuit.state] for key, circuit in list(self._circuits.items())}
@@ -0,0 +1,249 @@
+"""
+Cache of read-only API responses.
+
+Campaigns, ads, sitelinks and client data rarely change, but are requested with the same payloads again and again.
+Client looks responses of such requests up in cache before sending them::
+
+    cache = ResponseCache(ttl={'campaigns': 300, 'clients': 3600}, max_bytes=64 * 2 ** 20, path='/tmp/yd_cache',
+                          max_disk_bytes=512 * 2 ** 20)
+    YandexDirectGateway.client.configure(response_cache=cache)
+
+Responses are keyed on request url, canonical JSON body and authorization headers, so different accounts
+never share responses. Only ``get`` method responses of endpoints listed in ``ttl`` are cached: keyword bids and
+other endpoints which data goes stale quickly are always sent to API.
+
+In-memory entries are evicted in least recently used order when their total size exceeds ``max_bytes``.
+If ``path`` is given, entries are also written to files in that directory and shared between worker processes.
+Files are pruned on write at most once in ``prune_interval`` seconds: expired files are removed, then files closest
+to expiry are removed while their total size exceeds ``max_disk_bytes``.
+
+Code which must see current data, e.g. after changes service reported objects as changed, reads around cache::
+
+    with bypass():
+        campaigns = list(gateway.get_campaigns(selection_criteria={'Ids': changed_ids}))
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging import getLogger
+
+import requests
+
+__all__ = ['ResponseCache']
+_logger = getLogger(__name__)
+_local = threading.local()
+
+# request headers which identify account data belongs to
+_ACCOUNT_HEADERS = ('Authorization', 'Client-Login')
+
+
+def canonical_body(body) -> bytes:
+    """JSON request body with sorted keys, so equal payloads get equal keys regardless of keys order"""
+    if not body:
+        return b''
+    try:
+        return json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+    except (TypeError, ValueError):
+        return body if type(body) is bytes else body.encode()
+
+
+@contextmanager
+def bypass():
+    """Send requests of current thread to API without looking them up in cache"""
+    previous = getattr(_local, 'bypass', False)
+    _local.bypass = True
+    try:
+        yield
+    finally:
+        _local.bypass = previous
+
+
+class ResponseCache:
+    """
+    TTL and LRU cache of successful API responses with optional on-disk backend. Thread safe.
+    """
+    def __init__(self, ttl: dict, max_bytes: int = 64 * 2 ** 20, path: str = None, max_disk_bytes: int = 512 * 2 ** 20,
+                 prune_interval: float = 60):
+        """
+        :param ttl:             seconds responses of endpoints are valid for: {endpoint: ttl}
+        :param max_bytes:       max total size of in-memory responses
+        :param path:            directory to share responses between processes in. Memory only if None
+        :param max_disk_bytes:  max total size of response files in ``path``
+        :param prune_interval:  min seconds between prunes of response files
+        :type ttl:              dict
+        :type max_bytes:        int
+        :type path:             str
+        :type max_disk_bytes:   int
+        :type prune_interval:   float
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        self.prune_interval = prune_interval
+        self.size = self.hits = self.misses = 0
+        self._pruned_at = 0
+        self._data = OrderedDict()     # {key: (expires at, content)}
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, endpoint: str, request: requests.PreparedRequest) -> str or None:
+        """
+        Cache key of request
+
+        :rtype:     str or None
+        :return:    key or None if request should not be cached
+        """
+        if not self.ttl.get(endpoint) or request.method != 'POST' or getattr(_local, 'bypass', False):
+            return None
+        body = canonical_body(request.body)
+        try:
+            if json.loads(body).get('method') != 'get':
+                return None
+        except (ValueError, AttributeError):
+            return None
+        digest = hashlib.sha256(request.url.encode())
+        for header in _ACCOUNT_HEADERS:
+            digest.update(b'\0' + (request.headers.get(header) or '').encode())
+        digest.update(b'\0' + body)
+        return f'{endpoint}-{digest.hexdigest()}'
+
+    def get(self, key: str) -> bytes or None:
+        """Cached response content or None if there is no valid response"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        entry = self._read(key)
+        if entry and entry[0] <= now:
+            self._remove(key)
+            entry = None
+        with self._lock:
+            if entry:
+                self._put(key, entry)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def set(self, key: str, endpoint: str, content: bytes):
+        """Cache response content for endpoint ttl"""
+        entry = (time.time() + self.ttl[endpoint], content)
+        with self._lock:
+            self._put(key, entry)
+            prune = bool(self.path) and time.time() - self._pruned_at >= self.prune_interval
+            if prune:
+                self._pruned_at = time.time()
+        self._write(key, entry)
+        if prune:
+            self.prune()
+
+    def clear(self):
+        """Drop all in-memory and on-disk responses"""
+        with self._lock:
+            self._data.clear()
+            self.size = self.hits = self.misses = 0
+        if self.path:
+            for name in os.listdir(self.path):
+                self._remove(name)
+
+    def prune(self) -> int:
+        """
+        Remove expired response files and files closest to expiry while total size of files exceeds
+        ``max_disk_bytes``. Temporary files left by crashed writers are removed too
+
+        :rtype:     int
+        :return:    number of removed files
+        """
+        if not self.path:
+            return 0
+        now = time.time()
+        entries, removed = [], 0   # [(expires at, size, file name)]
+        try:
+            items = list(os.scandir(self.path))
+        except OSError as e:
+            _logger.warning(f'Unable to prune response cache {self.path}: {e}')
+            return 0
+        for item in items:
+            try:
+                if item.name.endswith('.tmp'):
+                    if item.stat().st_mtime < now - self.prune_interval:
+                        self._remove(item.name)
+                        removed += 1
+                    continue
+                with open(item.path, 'rb') as f:
+                    expires = float(f.readline())
+                size = item.stat().st_size
+            except (OSError, ValueError):
+                continue
+            if expires <= now:
+                self._remove(item.name)
+                removed += 1
+            else:
+                entries.append((expires, size, item.name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(name)
+            total -= size
+            removed += 1
+        if removed:
+            _logger.debug(f'Removed {removed} response files from cache {self.path}, {total} bytes left')
+        return removed
+
+    def info(self) -> dict:
+        """Cache hit/miss counters"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': self.size, 'entries': len(self._data),
+                'max_bytes': self.max_bytes}
+
+    def _put(self, key: str, entry: tuple):
+        old = self._data.pop(key, None)
+        if old:
+            self.size -= len(old[1])
+        if len(entry[1]) > self.max_bytes:
+            return
+        self._data[key] = entry
+        self.size += len(entry[1])
+        while self.size > self.max_bytes:
+            _, (_, content) = self._data.popitem(last=False)
+            self.size -= len(content)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def _remove(self, key: str):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def _read(self, key: str) -> tuple or None:
+        if not self.path:
+            return None
+        try:
+            with open(self._file(key), 'rb') as f:
+                expires, content = f.read().split(b'\n', 1)
+            return float(expires), content
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key: str, entry: tuple):
+        if not self.path:
+            return
+        tmp_path = f'{self._file(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(f'{entry[0]}\n'.encode())
+                f.write(entry[1])
+            os.replace(tmp_path, self._file(key))
+        except OSError as e:
+            _logger.warning(f'Unable to write response to cache {self.path}: {e}')
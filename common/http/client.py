@@ -4,16 +4,27 @@ That is not for a business logic, but for any http processing logic like: sendin
 errors and
 timeouts etc. Response data should be processed in a gateway or gateway's client code
 """
+import hashlib
 import json
 from collections import defaultdict, deque
 from concurrent.futures import ThreadPoolExecutor, Future
-from logging import getLogger
+from functools import partial
+from logging import getLogger, DEBUG
+from queue import Empty
+from random import random
+from threading import Lock
+from time import perf_counter, monotonic
+from urllib.parse import urlsplit
 from uuid import uuid4
 
 import requests
 from requests.adapters import HTTPAdapter, Retry
+from urllib3.util.connection import is_connection_dropped
 
-from .exceptions import ConfigError, PayloadError
+from common import metrics, timing, tracing
+from common.logger import Truncated
+from . import deadline
+from .exceptions import ConfigError, PayloadError, DeadlineExceeded
 from .oauth import YandexDirectAuth, Authorizable, YandexOAuth
 
 _logger = getLogger(__name__)
@@ -21,6 +32,56 @@ _logger = getLogger(__name__)
 
 __all__ = ['YandexOauthClient', 'AsyncGatewayHttpClient', 'YandexDirectClient', 'Authorizable']
 
+# YD API error codes of temporary unavailability. Same as retried by gateway
+YD_UNAVAILABLE_ERROR_CODES = (52, 1000, 1001, 1002)
+# error responses are small, larger responses are not parsed to look for error
+_ERROR_MAX_BYTES = 4096
+
+
+def _endpoint(url: str) -> str:
+    return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+
+
+def _request_key(kwargs: dict) -> str:
+    """Hash of request params which does not depend on order of keys in payload"""
+    return hashlib.sha1(json.dumps(kwargs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _take_idle(pool) -> list:
+    """
+    Take all idle connections out of urllib3 connection pool. Items are taken at once as pool queue is LIFO and
+    would return the same connection again. ``None`` items are free slots of connections not opened yet
+    """
+    items = []
+    while pool.pool is not None:
+        try:
+            items.append(pool.pool.get(block=False))
+        except Empty:
+            break
+    return items
+
+
+def _is_cacheable(response: requests.Response) -> bool:
+    """Only successful API results are cached, errors are not"""
+    if response.status_code != 200:
+        return False
+    try:
+        data = response.json()
+    except ValueError:
+        return False
+    return type(data) is dict and 'result' in data and 'error' not in data
+
+
+def _cached_response(request: requests.PreparedRequest, content: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.headers['Content-Type'] = 'application/json'
+    response.url = request.url
+    response.request = request
+    response._content = content
+    return response
+
 
 class HttpResponseResult:
 
@@ -46,11 +107,14 @@ class HttpResponseResult:
 
 class AsyncHttpResponseResult:
 
-    def __init__(self, result: Future):
+    def __init__(self, result: Future, span: tracing.Span = None):
         self._result = result
+        # span which was current when request was sent
+        self.span = span
 
     def result(self):
-        return self._result.result().result()
+        # future may be shared by coalesced requests, so every caller gets its own copy of response data
+        return HttpResponseResult(self._result.result().response).result()
 
 
 class GatewayHttpClient:
@@ -62,16 +126,28 @@ class GatewayHttpClient:
     """
 
     DEFAULT_CONFIG = {
-        'retry': Retry(status=3, total=10, connect=3, backoff_factor=0.5,
-                       status_forcelist=[502, 500, 524, 423, 400],
-                       method_whitelist=False, raise_on_status=False),
-        'default_request_timeout': 15,
+        'retry': deadline.DeadlineRetry(status=3, total=10, connect=3, backoff_factor=0.5,
+                                        status_forcelist=[502, 500, 524, 423, 400],
+                                        method_whitelist=False, raise_on_status=False),
+        'connect_timeout': 5,
+        'default_request_timeout': 15,  # read timeout
         'http_methods_allowed': ('GET', 'HEAD', 'POST', 'DELETE', 'PUT'),
-        'connection_pool_size': requests.adapters.DEFAULT_POOLSIZE
+        'connection_pool_size': requests.adapters.DEFAULT_POOLSIZE,
+        'transport': None,      # transport adapter to use instead of network, e.g. replay.ReplayAdapter
+        'recorder': None,       # request/response pairs recorder, e.g. replay.HttpRecorder
+        'wire_log_max_bytes': 2048,     # max bytes of request and response body in DEBUG wire logs, None - no limit
+        'wire_log_sample_rate': 1.0,    # share of requests logged in DEBUG wire logs
+        'response_cache': None,         # cache of read-only requests responses, e.g. cache.ResponseCache
+        'single_flight': True,          # identical read requests in flight share one response (pool_send only)
+        'circuit_breaker': None,        # fail fast on endpoints which keep failing, e.g. breaker.CircuitBreaker
+        'keep_alive_idle_timeout': None,    # seconds idle pooled connections are closed after, None - never
     }
 
     def __init__(self, **kwargs):
         self.__session = self._retry_policy = None
+        self._last_used = None      # monotonic time of the last request sent or connections warm-up
+        self._warmed = defaultdict(int)     # connections opened by warm-up per host
+        self._exported_pool_stats = {}
         self._config = self.DEFAULT_CONFIG.copy()
         self.headers = {}
         self.configure(**kwargs)
@@ -83,6 +159,11 @@ class GatewayHttpClient:
     def configure(self, **kwargs):
         self._config.update(kwargs)
         self.set_retry_policy(self._config['retry'])
+        if 'transport' in kwargs:
+            # session should be recreated to mount new transport
+            self.__session = None
+            self._warmed.clear()
+            self._exported_pool_stats.clear()
 
     def set_retry_policy(self, retry):
         if not any([
@@ -96,7 +177,19 @@ class GatewayHttpClient:
         if not self.configured:
             raise ConfigError(f'{self.__class__.__name__} was not properly configured.')
         p_request = self._prepare_request(**kwargs)
+        cache = self._config['response_cache']
+        endpoint = _endpoint(p_request.url)
+        key = cache.key(endpoint, p_request) if cache else None
+        if key is None:
+            return HttpResponseResult(self._send(p_request))
+        content = cache.get(key)
+        if content is not None:
+            metrics.http_cache_requests.inc(endpoint=endpoint, result='hit')
+            return HttpResponseResult(_cached_response(p_request, content))
+        metrics.http_cache_requests.inc(endpoint=endpoint, result='miss')
         response = self._send(p_request)
+        if _is_cacheable(response):
+            cache.set(key, endpoint, response.content)
         return HttpResponseResult(response)
 
     def _make_payload(self, **kwargs) -> tuple:
@@ -142,13 +235,139 @@ class GatewayHttpClient:
             # Default requests.Session() object does not retry requests if they fail
             # Here we can apply retry policy to handle failed requests
             # more info [http://docs.python-requests.org/en/master/api/#requests.adapters.HTTPAdapter]
-            retry_adapter = HTTPAdapter(max_retries=self._retry_policy,
-                                        pool_maxsize=self._config['connection_pool_size'],
-                                        pool_connections=self._config['connection_pool_size'])
-            self.__session.mount('https://', retry_adapter)
-            self.__session.mount('http://', retry_adapter)
+            adapter = self._config['transport'] or HTTPAdapter(max_retries=self._retry_policy,
+                                                               pool_maxsize=self._config['connection_pool_size'],
+                                                               pool_connections=self._config['connection_pool_size'])
+            self.__session.mount('https://', adapter)
+            self.__session.mount('http://', adapter)
         return self.__session
 
+    def _pools(self) -> list:
+        """urllib3 connection pools of the session. Empty if custom transport is mounted"""
+        manager = getattr(self._session.get_adapter('https://'), 'poolmanager', None)
+        if self._config['transport'] is not None or manager is None:
+            return []
+        return [pool for pool in (manager.pools.get(key) for key in manager.pools.keys()) if pool is not None]
+
+    def _connect(self, conn) -> bool:
+        conn.timeout = self._config['connect_timeout']
+        try:
+            conn.connect()
+        except Exception as e:
+            _logger.warning(f'Could not open connection to {conn.host}: {e}')
+            conn.close()
+            return False
+        return True
+
+    def warm_up(self, url: str, connections: int = None) -> int:
+        """
+        Open keep-alive connections to url host ahead of requests, so that first requests do not wait for DNS lookup
+        and TLS handshake. Connections are opened in parallel and left idle in the pool. Nothing is done if custom
+        transport is mounted
+
+        :param url:             url of the host, e.g. API base url
+        :param connections:     number of open connections to have in the pool, pool size by default
+        :type url:              str
+        :type connections:      int
+        :rtype:                 int
+        :return:                number of connections opened
+        """
+        if self._config['transport'] is not None:
+            return 0
+        adapter = self._session.get_adapter(url)
+        pool = adapter.get_connection(url)
+        # same TLS settings as connections opened by requests
+        adapter.cert_verify(pool, url, True, None)
+        items = _take_idle(pool)
+        connections = min(connections or len(items), len(items))
+        closed = [i for i, conn in enumerate(items[:connections]) if conn is None or is_connection_dropped(conn)]
+        for i in closed:
+            if items[i] is not None:
+                items[i].close()
+            items[i] = pool._new_conn()
+        if closed:
+            with ThreadPoolExecutor(max_workers=len(closed)) as executor:
+                opened = sum(executor.map(self._connect, [items[i] for i in closed]))
+        else:
+            opened = 0
+        for conn in items:
+            pool._put_conn(conn)
+        self._warmed[pool.host] += len(closed)
+        self._last_used = monotonic()
+        if opened:
+            metrics.http_pool_warmed.inc(opened, host=pool.host)
+            _logger.debug(f'{opened} connections to {pool.host} opened ahead of requests')
+        return opened
+
+    def reap_idle(self, max_idle: float = None) -> int:
+        """
+        Close idle pooled connections if no request was sent for ``max_idle`` seconds. Servers drop keep-alive
+        connections idle for a while and a request sent over a dropped connection fails and is retried
+
+        :param max_idle:    seconds, ``keep_alive_idle_timeout`` config by default
+        :type max_idle:     float
+        :rtype:             int
+        :return:            number of connections closed
+        """
+        max_idle = self._config['keep_alive_idle_timeout'] if max_idle is None else max_idle
+        if max_idle is None or self._last_used is None or monotonic() - self._last_used < max_idle:
+            return 0
+        total = 0
+        for pool in self._pools():
+            items, closed = _take_idle(pool), 0
+            for i, conn in enumerate(items):
+                if conn is not None:
+                    closed += conn.sock is not None
+                    conn.close()
+                    # free slot, next request opens new connection
+                    items[i] = None
+            for conn in items:
+                pool._put_conn(conn)
+            if closed:
+                metrics.http_pool_reaped.inc(closed, host=pool.host)
+            total += closed
+        return total
+
+    def keep_alive(self, url: str, connections: int = None) -> int:
+        """
+        Warm-up hook to call at worker start and before work after idle periods: connections idle for too long are
+        closed and missing ones are opened
+
+        :param url:             url of the host, e.g. API base url
+        :param connections:     number of open connections to have in the pool, pool size by default
+        :type url:              str
+        :type connections:      int
+        :rtype:                 int
+        :return:                number of connections opened
+        """
+        self.reap_idle()
+        return self.warm_up(url, connections)
+
+    def pool_stats(self) -> dict:
+        """
+        Connection reuse stats of the session pools. Requests sent over an open pooled connection are hits,
+        requests which opened a new connection are misses. Hits and misses since the previous call are exported
+        as ``http_pool_requests_total`` metric
+
+        :rtype:     dict
+        :return:    {host: {'requests': 10, 'hits': 8, 'misses': 2, 'warmed': 4, 'idle': 4}}
+        """
+        stats = {}
+        for pool in self._pools():
+            with pool.pool.mutex:
+                idle = sum(1 for conn in pool.pool.queue if conn is not None and conn.sock is not None)
+            warmed = self._warmed[pool.host]
+            misses = max(pool.num_connections - warmed, 0)
+            stats[pool.host] = {'requests': pool.num_requests, 'hits': max(pool.num_requests - misses, 0),
+                                'misses': misses, 'warmed': warmed, 'idle': idle}
+        for host, host_stats in stats.items():
+            exported = self._exported_pool_stats.get(host, {'hits': 0, 'misses': 0})
+            for result in ('hits', 'misses'):
+                if host_stats[result] > exported[result]:
+                    metrics.http_pool_requests.inc(host_stats[result] - exported[result], host=host, result=result)
+            self._exported_pool_stats[host] = {'hits': host_stats['hits'], 'misses': host_stats['misses']}
+        return stats
+
     def _send(self, prepared_request: requests.PreparedRequest) -> requests.Response:
         """
         This is the main method that sends requests and handles responses and connection errors.
@@ -159,23 +378,73 @@ class GatewayHttpClient:
         <http://docs.python-requests.org/en/master/api/#requests.PreparedRequest>`_
         :rtype: `requests.Response <http://docs.python-requests.org/en/master/api/#requests.Response>`_
         """
-        _logger.debug(
-            f'[REQUEST]\n'
-            f'[URL]: {prepared_request.url}\n'
-            f'[METHOD]: {prepared_request.method}\n'
-            f'[BODY]: {prepared_request.body}\n'
-            f'[HEADERS]: {prepared_request.headers}\n'
-            f'[/REQUEST]\n'
-        )
-        response = self._session.send(prepared_request, timeout=self._config['default_request_timeout'])
-        _logger.debug(f'[RESPONSE]\n'
-                      f'[STATUS]: {response.status_code}\n'
-                      f'[HEADERS]: {response.headers}\n'
-                      f'[CONTENT]: {response.content}\n'
-                      f'[/RESPONSE]\n')
+        # wire logs are formatted lazily by logging handler, only if DEBUG is enabled and request is sampled
+        log_wire = _logger.isEnabledFor(DEBUG) and random() < self._config['wire_log_sample_rate']
+        max_bytes = self._config['wire_log_max_bytes']
+        if log_wire:
+            _logger.debug('[REQUEST]\n[URL]: %s\n[METHOD]: %s\n[BODY]: %s\n[HEADERS]: %s\n[/REQUEST]\n',
+                          prepared_request.url, prepared_request.method,
+                          Truncated(prepared_request.body, max_bytes), prepared_request.headers)
+        endpoint = _endpoint(prepared_request.url)
+        run_deadline = deadline.current()
+        timeout = (self._config['connect_timeout'], self._config['default_request_timeout'])
+        if run_deadline:
+            run_deadline.check()
+            timeout = run_deadline.timeout(*timeout)
+        breaker = self._config['circuit_breaker']
+        circuit = breaker.circuit(self._account_key(), endpoint) if breaker else None
+        if circuit:
+            circuit.before()
+        settled = False     # circuit got success or failure of the request
+        try:
+            self.reap_idle()
+            self._last_used = monotonic()
+            metrics.http_requests_in_flight.inc(endpoint=endpoint)
+            start = perf_counter()
+            with tracing.span('request', endpoint=endpoint, sent=len(prepared_request.body or b'')) as span:
+                try:
+                    response = self._session.send(prepared_request, timeout=timeout)
+                except Exception:
+                    if run_deadline and run_deadline.expired:
+                        # request was cut by run deadline, service is not to blame
+                        raise DeadlineExceeded(f'Request to {endpoint} was not completed before deadline')
+                    if circuit:
+                        settled = True
+                        circuit.failure()
+                    raise
+                finally:
+                    metrics.http_requests_in_flight.dec(endpoint=endpoint)
+                if span:
+                    span.set(status=response.status_code, received=len(response.content))
+            if circuit:
+                settled = True
+                if self._failed(response):
+                    circuit.failure()
+                else:
+                    circuit.success()
+        finally:
+            if circuit and not settled:
+                # e.g. request was cut by run deadline, so that trial of half-open circuit is not held forever
+                circuit.release()
+        metrics.http_request_duration.observe(perf_counter() - start, endpoint=endpoint)
+        timing.add_bytes('sent', len(prepared_request.body or b''))
+        timing.add_bytes('received', len(response.content))
+        if self._config['recorder']:
+            self._config['recorder'].record(prepared_request, response)
+        if log_wire:
+            _logger.debug('[RESPONSE]\n[STATUS]: %s\n[HEADERS]: %s\n[CONTENT]: %s\n[/RESPONSE]\n',
+                          response.status_code, response.headers, Truncated(response.content, max_bytes))
 
         return response
 
+    def _account_key(self) -> str:
+        """Account which circuit is used for requests"""
+        return ''
+
+    def _failed(self, response: requests.Response) -> bool:
+        """Whether response means that service is unavailable"""
+        return response.status_code >= 500 or response.status_code == 429
+
 
 class AsyncGatewayHttpClient(GatewayHttpClient):
     """
@@ -189,11 +458,14 @@ class AsyncGatewayHttpClient(GatewayHttpClient):
         for response, payload in client.pool_receive(pool_id):
             yield response.result().data
 
+    Read requests identical to a request which is still in flight are not sent again, but share its response.
     """
     def __init__(self, max_workers=4, **kwargs):
         super().__init__(connection_pool_size=max_workers, **kwargs)
         self.__executor = ThreadPoolExecutor(max_workers=max_workers)
         self.__results_buffer = defaultdict(deque)
+        self.__in_flight = {}
+        self.__in_flight_lock = Lock()
 
     def get_pool_id(self) -> str:
         return str(uuid4())
@@ -201,15 +473,49 @@ class AsyncGatewayHttpClient(GatewayHttpClient):
     def pool_send(self, pool_id: str, **kwargs):
         """
         Executes http_requests in async manner with threaded executor.
-        Future results are saved to queue with buffer_id key
+        Future results are saved to queue with buffer_id key.
+        Request is sent with the current tracing span of the calling thread as parent span and within
+        its deadline
 
         :param pool_id:     Unique buffer id from where async-results will be readed later
         :type pool_id:      str
         :param kwargs:      http-request params (same as requests.Request params)
         :return:
         """
-        future = self.__executor.submit(self.send, **kwargs)
-        self.__results_buffer[pool_id].append((future, kwargs))
+        span = tracing.current()
+        send = tracing.wrap(deadline.wrap(self.send, deadline.current()), span)
+        key = self._flight_key(kwargs) if self._config['single_flight'] else None
+        if key is None:
+            future = self.__executor.submit(send, **kwargs)
+        else:
+            with self.__in_flight_lock:
+                future = self.__in_flight.get(key)
+                shared = future is not None
+                if not shared:
+                    future = self.__in_flight[key] = self.__executor.submit(send, **kwargs)
+            if shared:
+                metrics.http_coalesced_requests.inc(endpoint=_endpoint(kwargs.get('url', '')))
+            else:
+                future.add_done_callback(partial(self._land, key))
+        self.__results_buffer[pool_id].append((future, kwargs, span))
+
+    def _land(self, key: str, future: Future):
+        """Forget completed request, so next identical requests are sent again"""
+        with self.__in_flight_lock:
+            if self.__in_flight.get(key) is future:
+                del self.__in_flight[key]
+
+    def _flight_key(self, kwargs: dict) -> str or None:
+        """
+        Key of identical requests which may share one response
+
+        :param kwargs:      http-request params
+        :rtype:             str or None
+        :return:            key or None if request changes data and should always be sent
+        """
+        if kwargs.get('method') not in ('GET', 'HEAD'):
+            return None
+        return _request_key(kwargs)
 
     def pool_receive(self, pool_id: str) -> [(AsyncHttpResponseResult, dict)]:
         """
@@ -219,11 +525,11 @@ class AsyncGatewayHttpClient(GatewayHttpClient):
         :rtype:             Iterable[(HttpResponseResult, dict)]
         """
         while self.__results_buffer[pool_id]:
-            future, payload = self.__results_buffer[pool_id].popleft()
+            future, payload, span = self.__results_buffer[pool_id].popleft()
             if future.done():
-                yield AsyncHttpResponseResult(future), payload
+                yield AsyncHttpResponseResult(future, span), payload
             else:
-                self.__results_buffer[pool_id].append((future, payload))
+                self.__results_buffer[pool_id].append((future, payload, span))
         del self.__results_buffer[pool_id]
 
 
@@ -267,3 +573,43 @@ class YandexDirectClient(AsyncGatewayHttpClient, Authorizable):
         p_request = super()._prepare_request(**kwargs)
         p_request.prepare_auth(auth=self.auth_data)
         return p_request
+
+    def _flight_key(self, kwargs: dict) -> str or None:
+        # YD API reads are POST requests of "get" method. Responses are shared by requests of the same account only
+        body = kwargs.get('json')
+        if kwargs.get('method') != 'POST' or type(body) is not dict or body.get('method') != 'get':
+            return super()._flight_key(kwargs)
+        auth = (getattr(self.auth_data, '_token', None), self.headers.get('Client-Login'))
+        return _request_key({'auth': auth, **kwargs})
+
+    def _account_key(self) -> str:
+        # token is not exposed in metrics labels
+        token = getattr(getattr(self, 'auth_data', None), '_token', None) or ''
+        return hashlib.sha1(f'{token}{self.headers.get("Client-Login") or ""}'.encode()).hexdigest()[:10]
+
+    def _failed(self, response: requests.Response) -> bool:
+        # YD API reports unavailability with status 200 error responses
+        if super()._failed(response):
+            return True
+        content = response.content
+        if len(content) > _ERROR_MAX_BYTES or b'error_code' not in content:
+            return False
+        try:
+            return response.json()['error']['error_code'] in YD_UNAVAILABLE_ERROR_CODES
+        except (ValueError, KeyError, TypeError):
+            return False
+
+    def _send(self, prepared_request: requests.PreparedRequest) -> requests.Response:
+        response = super()._send(prepared_request)
+        # Units header is "spent by request/rest/daily limit"
+        # more info https://tech.yandex.ru/direct/doc/dg/concepts/units-docpage/
+        units, login = response.headers.get('Units'), response.headers.get('Units-Used-Login')
+        if units:
+            try:
+                spent, rest, _ = map(int, units.split('/'))
+            except ValueError:
+                _logger.debug(f'Unexpected Units header: {units}')
+            else:
+                metrics.yd_units_spent.inc(spent, login=login)
+                metrics.yd_units_rest.set(rest, login=login)
+        return response
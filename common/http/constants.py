@@ -33,6 +33,11 @@ YD_CAMPAIGNS_FIELDNAMES = ("Id", "Name")
 
 YD_ADS_FIELDNAMES = ("AdGroupId", "CampaignId", "Id", "Type")
 
+YD_AD_GROUPS_FIELDNAMES = ("Id", "CampaignId", "Name")
+
+# Objects which changes are checked by changes.check method
+YD_CHANGES_FIELDNAMES = ("CampaignIds", "AdGroupIds", "AdIds")
+
 YD_ADS_TYPES = ('TextAd', 'DynamicTextAd', 'MobileAppAd',
                  'TextImageAd', 'MobileAppImageAd', 'TextAdBuilderAd', 'MobileAppAdBuilderAd',
                  'CpcVideoAdBuilderAd', 'CpmBannerAdBuilderAd')
@@ -51,6 +56,8 @@ class YdAPiV5EndpointsStruct:
     CAMPAIGNS = 'campaigns'
     ADS = 'ads'
     SITELINKS = 'sitelinks'
+    AD_GROUPS = 'adgroups'
+    CHANGES = 'changes'
     # add new endpoints here ...
 
 
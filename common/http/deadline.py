@@ -0,0 +1,105 @@
+"""
+Time budget of a run propagated to every request it sends.
+
+A run gets a deadline - a point in time by which it should be done. Deadline is current per thread like tracing
+span, client caps request timeouts with remaining time and retries stop as soon as the budget is spent::
+
+    with deadline.use(deadline.Deadline(600)):
+        gateway.keyword_bids_gen(...)       # requests of every chunk are sent with remaining time as timeout
+
+Requests sent after the deadline raise :py:class:`common.http.exceptions.DeadlineExceeded`.
+``pool_send`` passes current deadline to executor threads, so requests sent in parallel share the budget.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from requests.adapters import Retry
+
+from .exceptions import DeadlineExceeded
+
+__all__ = ['Deadline', 'DeadlineRetry']
+_local = threading.local()
+
+
+class Deadline:
+    """
+    Point in time by which work should be done
+    """
+    __slots__ = ('seconds', 'expires_at')
+
+    def __init__(self, seconds: float):
+        """
+        :param seconds:     time budget in seconds from now
+        :type seconds:      float
+        """
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left, 0 if deadline has passed"""
+        return max(self.expires_at - time.monotonic(), 0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        """
+        :raises:    DeadlineExceeded if deadline has passed
+        """
+        if self.expired:
+            raise DeadlineExceeded(f'Time budget of {self.seconds:.0f}s is spent')
+
+    def timeout(self, connect: float, read: float) -> (float, float):
+        """Connect and read timeouts capped by remaining time"""
+        remaining = self.remaining()
+        return min(connect, remaining), min(read, remaining)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.seconds}, remaining={self.remaining():.1f})'
+
+
+def current() -> Deadline or None:
+    """Deadline of current thread"""
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def use(target: Deadline or None):
+    """Make deadline current in a block of code. Earlier of current and new deadline is used"""
+    previous = current()
+    if target is not None and previous is not None and previous.expires_at < target.expires_at:
+        target = previous
+    _local.deadline = target
+    try:
+        yield target
+    finally:
+        _local.deadline = previous
+
+
+def wrap(func, target: Deadline or None):
+    """Wrap function to run it with deadline as current, e.g. in executor thread"""
+    if target is None:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with use(target):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class DeadlineRetry(Retry):
+    """
+    Transport retry policy which gives up when deadline of current thread has passed and never sleeps past it
+    """
+    def is_exhausted(self) -> bool:
+        target = current()
+        return super().is_exhausted() or (target is not None and target.expired)
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        target = current()
+        return backoff if target is None else min(backoff, target.remaining())
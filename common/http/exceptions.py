@@ -13,4 +13,20 @@ class MaxRetry(Exception):
 
 
 class UnExpectedResult(Exception):
-    ...
\ No newline at end of file
+    ...
+
+
+class DeadlineExceeded(Exception):
+    """Time budget of a run is spent. ``partial`` keeps results collected before the deadline"""
+
+    def __init__(self, message: str = '', partial=None):
+        super().__init__(message)
+        self.partial = partial
+
+
+class CircuitOpen(Exception):
+    """Request was not sent as circuit of the endpoint is open. Retry after ``retry_after`` seconds"""
+
+    def __init__(self, message: str = '', retry_after: float = 0):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -7,7 +7,7 @@ change.
 from logging import getLogger
 from types import GeneratorType
 
-from common import signals
+from common import metrics, signals, timing, tracing
 from . import constants
 from .client import YandexOauthClient, YandexDirectClient, Authorizable
 from .exceptions import UnExpectedResult
@@ -45,6 +45,8 @@ class YandexDirectGateway(AuthorizableGateway):
     default_api_url = "https://api.direct.yandex.com"  #: yandex direct api base url
     api_version = 'v5'  #: yandex direct api version that is used by gateway
     endpoints = constants.YdAPiV5EndpointsStruct  #: yandex direct api endpoints
+    #: ids of keyword bids selection criteria sent with one request
+    KEYWORD_BIDS_CHUNK_LIMITS = {'KeywordIds': 10_000, 'AdGroupIds': 1000, 'CampaignIds': 10}
 
     def get_api_url(self) -> str:
         return f'{self.default_api_url}/json/{self.api_version}'
@@ -63,20 +65,26 @@ class YandexDirectGateway(AuthorizableGateway):
         # more info here https://tech.yandex.ru/direct/doc/dg/best-practice/get-docpage/
         if 'LimitedBy' in result:
             yield result
-            kwargs['json']['params'].update({'Page': {'Offset': result['LimitedBy']}})
+            # request payload may be shared with requests which are still being sent, so it is copied
+            params = {**kwargs['json']['params'], 'Page': {'Offset': result['LimitedBy']}}
+            kwargs['json'] = {**kwargs['json'], 'params': params}
             if pool_id:
-                self.client.pool_send(pool_id, **kwargs)
+                with tracing.use(tracing.start_span('page', offset=result['LimitedBy'])):
+                    self.client.pool_send(pool_id, **kwargs)
             else:
                 result = self.get_response_result(self.client.send(**kwargs).result().data)
                 yield from self.paginated_result(result, **kwargs)
         else:
             yield result
 
+    @tracing.traced('fetch')
+    @timing.timed('fetch')
     @gateway_retry(retry_codes=[52, 1000, 1001, 1002])
     def keyword_bids_gen(self, selection_criteria: dict,
                          field_names: list = constants.YD_KEYWORD_BIDS_FIELDNAMES,
                          search_field_names: list = constants.YD_KEYWORD_BIDS_SEARCH_FIELDS,
-                         network_field_names: list = constants.YD_KEYWORD_BIDS_NETWORK_FIELDS) -> GeneratorType:
+                         network_field_names: list = constants.YD_KEYWORD_BIDS_NETWORK_FIELDS,
+                         chunks: list = None, checkpoint=None) -> GeneratorType:
         """
         This is a generator for keywords bids items in yandex direct api. Default request returns up to 10 000 keyword
         bid items, though we should repeat request until all keyword items recieved. This method will fetch one package
@@ -97,7 +105,8 @@ class YandexDirectGateway(AuthorizableGateway):
         Basically you may provide only 'selection_criteria' parameter as others are already set to default values
 
         :param selection_criteria:          keyword bids selection criteria. You may provide one of three keys \
-        that represent keyword bid groups. Values should be a list of ids that correspond to a given group
+        that represent keyword bid groups. Values should be a list of ids that correspond to a given group. \
+        Other criteria (e.g. ServingStatuses) are sent with every request
         :type selection_criteria:           dict
         :param field_names:                 fields that should be requested from YD API
         :type field_names:                  list
@@ -105,33 +114,83 @@ class YandexDirectGateway(AuthorizableGateway):
         :type search_field_names:           list
         :param network_field_names:         fields that should be included in Network entities
         :type network_field_names:          list
+        :param chunks:                      selection criteria of every request, e.g. \
+        ``[{'CampaignIds': [1, 2]}, {'AdGroupIds': [3, 4]}]``. Ids of selection criteria are split to requests \
+        by YD API limits if None
+        :type chunks:                       list
+        :param checkpoint:                  optional progress store of the fetch, e.g. \
+        :py:class:`auctioneer.controllers.checkpoint.RunCheckpoint`. Chunks it reports as received are not requested, \
+        others are requested from the offset it returns. Every received page is passed to it
         :rtype: GeneratorType
         :returns:                           A generator of keyword bids json - data
         """
 
         api_url = f'{self.get_api_url()}/{self.endpoints.KEYWORD_BIDS}'
         pool_id = self.client.get_pool_id()
-        limits = {'KeywordIds': 10_000, 'AdGroupIds': 1000, 'CampaignIds': 10}
-        key = next(iter(selection_criteria))
-        payload = {
-            'method': 'get',
-            'params': {
-                'SelectionCriteria': selection_criteria,
-                'FieldNames': field_names,
-                'SearchFieldNames': search_field_names or [],
-                'NetworkFieldNames': network_field_names or []
+        other_criteria = {k: v for k, v in selection_criteria.items() if k not in self.KEYWORD_BIDS_CHUNK_LIMITS}
+        if chunks is None:
+            chunks = self.keyword_bids_chunks(selection_criteria)
+        for index, chunk_criteria in enumerate(chunks):
+            chunk = next(iter(chunk_criteria.values()))
+            criteria = {**other_criteria, **chunk_criteria}
+            offset = checkpoint.resume_offset(criteria) if checkpoint else 0
+            if offset is None:
+                # chunk was received before
+                continue
+            # every request gets its own payload as requests are prepared in executor threads
+            payload = {
+                'method': 'get',
+                'params': {
+                    'SelectionCriteria': criteria,
+                    'FieldNames': field_names,
+                    'SearchFieldNames': search_field_names or [],
+                    'NetworkFieldNames': network_field_names or []
+                }
             }
-        }
-        for chunk in Chunker(items=selection_criteria[key], limit=limits[key]):
-            payload['params']['SelectionCriteria'] = {key: chunk}
-            self.client.pool_send(pool_id, method='POST', url=api_url, json=payload)
+            if offset:
+                payload['params']['Page'] = {'Offset': offset}
+            metrics.yd_chunk_size.observe(len(chunk), operation='get')
+            # chunk span lasts until the last page of the chunk is received, every page has its own span
+            chunk_span = tracing.start_span('chunk', index=index, size=len(chunk))
+            with tracing.use(tracing.start_span('page', parent=chunk_span, offset=0)):
+                self.client.pool_send(pool_id, method='POST', url=api_url, json=payload)
         for response, request_payload in self.client.pool_receive(pool_id):
-            result = self.get_response_result(response.result().data)
+            with timing.stage('decode'):
+                result = self.get_response_result(response.result().data)
+            chunk_span = None
+            if response.span:
+                response.span.finish()
+                chunk_span = response.span.parent
+                if chunk_span and 'LimitedBy' not in result:
+                    chunk_span.finish()
             paginated = self.paginated_result(result, pool_id=pool_id, **request_payload)
-            yield from formatter(paginated, key='KeywordBids')
+            if checkpoint:
+                paginated = self._checkpointed(paginated, checkpoint, request_payload['json']['params'])
+            yield from tracing.iter_in(chunk_span, formatter(paginated, key='KeywordBids'))
+
+    def keyword_bids_chunks(self, selection_criteria: dict) -> list:
+        """
+        Split ids of keyword bids selection criteria to chunks by YD API limits of one request
+
+        :param selection_criteria:  keyword bids selection criteria, e.g. ``{'CampaignIds': [1, 2]}``
+        :type selection_criteria:   dict
+        :rtype:                     list
+        :return:                    selection criteria of every request, e.g. ``[{'CampaignIds': [1, 2]}]``
+        """
+        key = next(k for k in selection_criteria if k in self.KEYWORD_BIDS_CHUNK_LIMITS)
+        limit = self.KEYWORD_BIDS_CHUNK_LIMITS[key]
+        return [{key: chunk} for chunk in Chunker(items=selection_criteria[key], limit=limit)]
+
+    @staticmethod
+    def _checkpointed(pages: GeneratorType, checkpoint, params: dict) -> GeneratorType:
+        """Report page to checkpoint after all its items were consumed. Error results are not reported"""
+        offset = (params.get('Page') or {}).get('Offset', 0)
+        for page in pages:
+            yield page
+            if type(page) is dict and 'error_code' not in page:
+                checkpoint.page_received(params['SelectionCriteria'], offset, page)
 
     @signals.params_interceptor.intercept
-    @gateway_retry(retry_codes=[52, 1000, 1001, 1002])
     def set_keyword_bids(self, data: [dict]) -> GeneratorType:
         """
         Set new bids on given keywords in Yandex Direct API.
@@ -141,24 +200,54 @@ class YandexDirectGateway(AuthorizableGateway):
 
             keyword_bids_data = [{'KeywordId': 123, 'SearchBid':1000} ... ]
 
+        Keyword bids data is intercepted to count keyword bids sent by a run. Use :py:meth:`send_keyword_bids` to send
+        keyword bids which were counted already, e.g. ones failed with temporary errors
+
+        :param data:            a collection of keyword bids data
+        :type data:             list
+        :rtype:                 Iterator[dict]
+        :return:                YD *keyword bids set* response structure. Every result has KeywordId \
+        of its keyword bid, even if it was not set
+        """
+        return self.send_keyword_bids(data)
+
+    @tracing.traced('set')
+    @timing.timed('set')
+    @gateway_retry(retry_codes=[52, 1000, 1001, 1002])
+    def send_keyword_bids(self, data: [dict]) -> GeneratorType:
+        """
+        Send keyword bids set requests. See :py:meth:`set_keyword_bids`
+
         :param data:            a collection of keyword bids data
         :type data:             list
         :rtype:                 Iterator[dict]
         :return:                YD *keyword bids set* response structure
         """
+        if not data:
+            return
         api_url = f'{self.get_api_url()}/{self.endpoints.KEYWORD_BIDS}'
         queue = self.client.get_pool_id()
-        payload = {
-            'method': 'set',
-            'params': {
-                'KeywordBids': data
+        for index, chunk in enumerate(Chunker(data, limit=10000)):
+            payload = {
+                'method': 'set',
+                'params': {
+                    'KeywordBids': chunk
+                }
             }
-        }
-        for chunk in Chunker(data, limit=10000):
-            payload['params']['KeywordBids'] = chunk
-            self.client.pool_send(queue, method='POST', url=api_url, json=payload)
-        for response, _ in self.client.pool_receive(queue):
-            result = self.get_response_result(response.result().data)
+            metrics.yd_chunk_size.observe(len(chunk), operation='set')
+            with tracing.use(tracing.start_span('set_chunk', index=index, size=len(chunk))):
+                self.client.pool_send(queue, method='POST', url=api_url, json=payload)
+        for response, payload in self.client.pool_receive(queue):
+            with timing.stage('decode'):
+                result = self.get_response_result(response.result().data)
+            if response.span:
+                response.span.finish()
+            set_results = result.get('SetResults') if type(result) is dict else None
+            if type(set_results) is list:
+                # results are in order of request items, but have no KeywordId if keyword bid was not set
+                for item, set_result in zip(payload['json']['params']['KeywordBids'], set_results):
+                    if type(set_result) is dict and type(item) is dict:
+                        set_result.setdefault('KeywordId', item.get('KeywordId'))
             yield from formatter(result, 'SetResults')
 
     def get_client_login(self) -> str:
@@ -280,6 +369,92 @@ class YandexDirectGateway(AuthorizableGateway):
         paginated = self.paginated_result(result, method='POST', url=api_url, json=payload)
         yield from formatter(paginated, key='SitelinksSets')
 
+    @gateway_retry(retry_codes=[52, 1000, 1001, 1002])
+    def get_ad_groups(self, selection_criteria: dict,
+                      field_names=constants.YD_AD_GROUPS_FIELDNAMES) -> GeneratorType:
+        """
+        Yandex Direct ad groups generator.
+        `API Docs <https://tech.yandex.ru/direct/doc/ref-v5/adgroups/get-docpage/>`_
+
+        :param selection_criteria:  ad groups selection criteria, e.g. {'CampaignIds': [1, 2]} or {'Ids': [1, 2]}
+        :type selection_criteria:   dict
+        :param field_names:         ad group fields
+        :type field_names:          list
+        :rtype:                     GeneratorType
+        :return:                    Generator of yandex direct ad groups
+        """
+        api_url = f'{self.get_api_url()}/{self.endpoints.AD_GROUPS}'
+        payload = {
+            'method': 'get',
+            'params': {
+                'SelectionCriteria': selection_criteria,
+                'FieldNames': field_names,
+            }
+        }
+        response = self.client.send(method='POST', url=api_url, json=payload)
+        result = self.get_response_result(response.result().data)
+        paginated = self.paginated_result(result, method='POST', url=api_url, json=payload)
+        yield from formatter(paginated, key='AdGroups')
+
+    def _changes(self, method: str, params: dict) -> dict:
+        api_url = f'{self.get_api_url()}/{self.endpoints.CHANGES}'
+        response = self.client.send(method='POST', url=api_url, json={'method': method, 'params': params})
+        data = response.result().data
+        result = data.get('result') if type(data) is dict else None
+        if not result or 'Timestamp' not in result:
+            raise UnExpectedResult(self.get_response_result(data))
+        return result
+
+    def check_dictionaries(self) -> str:
+        """
+        Get current Yandex Direct server time. Use it as a starting timestamp of changes check.
+        `API Docs <https://tech.yandex.ru/direct/doc/ref-v5/changes/checkDictionaries-docpage/>`_
+
+        :rtype:     str
+        :return:    server timestamp, e.g. 2019-01-01T00:00:00Z
+        :raises:    UnExpectedResult if no timestamp received
+        """
+        return self._changes('checkDictionaries', {})['Timestamp']
+
+    def check_campaigns(self, timestamp: str) -> dict:
+        """
+        Get campaigns changed since timestamp.
+        `API Docs <https://tech.yandex.ru/direct/doc/ref-v5/changes/checkCampaigns-docpage/>`_::
+
+            {'Campaigns': [{'CampaignId': 1, 'ChangesIn': ['SELF', 'CHILDREN']}], 'Timestamp': '...'}
+
+        ``SELF`` means campaign itself has changed, ``CHILDREN`` - its ad groups, ads or keywords.
+
+        :param timestamp:   timestamp returned by previous check
+        :type timestamp:    str
+        :rtype:             dict
+        :return:            changed campaigns and current server timestamp
+        :raises:            UnExpectedResult if no timestamp received
+        """
+        return self._changes('checkCampaigns', {'Timestamp': timestamp})
+
+    def check_changes(self, timestamp: str, field_names=constants.YD_CHANGES_FIELDNAMES, **ids) -> dict:
+        """
+        Get ids of campaigns objects changed since timestamp.
+        `API Docs <https://tech.yandex.ru/direct/doc/ref-v5/changes/check-docpage/>`_::
+
+            gateway.check_changes(timestamp, CampaignIds=[1, 2], field_names=['AdGroupIds', 'AdIds'])
+            {'Modified': {'AdGroupIds': [...], 'AdIds': [...]}, 'NotFound': {...}, 'Unprocessed': {...},
+             'Timestamp': '...'}
+
+        Changes of objects listed in Unprocessed were not checked as there were too many of them.
+
+        :param timestamp:   timestamp returned by previous check
+        :param field_names: which objects changes to check: CampaignIds, AdGroupIds, AdIds, CampaignsStat
+        :param ids:         one of CampaignIds, AdGroupIds, AdIds with a list of ids
+        :type timestamp:    str
+        :type field_names:  list
+        :rtype:             dict
+        :return:            changed objects ids and current server timestamp
+        :raises:            UnExpectedResult if no timestamp received
+        """
+        return self._changes('check', {**ids, 'FieldNames': list(field_names), 'Timestamp': timestamp})
+
 
 class OAuthGateway(AuthorizableGateway):
     """
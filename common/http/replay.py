@@ -0,0 +1,154 @@
+"""
+Record and replay of http traffic.
+
+Recorder writes every request/response pair sent by a client to a gzip-compressed JSON lines archive.
+The archive can then be served offline by :py:class:`ReplayAdapter` - a transport adapter that answers requests
+with recorded responses instead of sending them to network::
+
+    # record
+    recorder = HttpRecorder('/tmp/run.jsonl.gz')
+    YandexDirectGateway.client.configure(recorder=recorder)
+    ...
+    recorder.close()
+
+    # replay with recorded latencies
+    YandexDirectGateway.client.configure(transport=ReplayAdapter('/tmp/run.jsonl.gz'))
+
+    # replay with 50ms +/- 10ms latency
+    YandexDirectGateway.client.configure(transport=ReplayAdapter('/tmp/run.jsonl.gz', latency=0.05, jitter=0.01))
+
+"""
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from logging import getLogger
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+__all__ = ['HttpRecorder', 'ReplayAdapter']
+_logger = getLogger(__name__)
+
+
+def _body_bytes(body) -> bytes:
+    if body is None:
+        return b''
+    return body if type(body) is bytes else body.encode()
+
+
+def request_key(method: str, url: str, body) -> tuple:
+    """Replay lookup key of a request"""
+    return method.upper(), url, hashlib.sha1(_body_bytes(body)).hexdigest()
+
+
+class HttpRecorder:
+    """
+    Writes request/response pairs to compressed JSON lines archive.
+    Request headers are not recorded as they contain authorization data.
+    """
+    def __init__(self, path: str):
+        """
+        :param path:        archive file path. Records are appended if archive exists
+        :type path:         str
+        """
+        self.path = path
+        self.recorded = 0
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, request: requests.PreparedRequest, response: requests.Response):
+        """Write request and response to archive. Safe to call from multiple threads"""
+        record = {
+            'method': request.method,
+            'url': request.url,
+            'body': _body_bytes(request.body).decode('utf-8', 'replace'),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': dict(response.headers),
+            'content': response.content.decode('utf-8', 'replace'),
+            'elapsed': response.elapsed.total_seconds(),
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line)
+            self._file.write('\n')
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        _logger.debug(f'Recorded {self.recorded} responses to {self.path}')
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    `Transport adapter <http://docs.python-requests.org/en/master/user/advanced/#transport-adapters>`_ serving
+    recorded responses.
+
+    Responses are looked up by request method, url and body. If the same request was recorded multiple times,
+    responses are served in recorded order and then repeated from the beginning.
+    """
+    def __init__(self, path: str, latency: float = None, jitter: float = 0.0, strict: bool = True):
+        """
+        :param path:        archive file path written by :py:class:`HttpRecorder`
+        :param latency:     seconds to wait before returning response. Recorded latency is used if None
+        :param jitter:      random +/- deviation of latency in seconds
+        :param strict:      raise ConnectionError on requests that were not recorded, otherwise return 404 response
+        :type path:         str
+        :type latency:      float
+        :type jitter:       float
+        :type strict:       bool
+        """
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.strict = strict
+        self._records = defaultdict(deque)
+        self._lock = threading.Lock()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._records[request_key(record['method'], record['url'], record['body'])].append(record)
+
+    def _next_record(self, request: requests.PreparedRequest) -> dict or None:
+        with self._lock:
+            records = self._records.get(request_key(request.method, request.url, request.body))
+            if not records:
+                return None
+            records.rotate(-1)
+            return records[-1]
+
+    def _delay(self, record: dict) -> float:
+        latency = record['elapsed'] if self.latency is None else self.latency
+        if self.jitter:
+            latency += random.uniform(-self.jitter, self.jitter)
+        return max(latency, 0)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        record = self._next_record(request)
+        if record is None:
+            if self.strict:
+                raise requests.ConnectionError(f'No recorded response for {request.method} {request.url}',
+                                               request=request)
+            record = {'status': 404, 'reason': 'Not Recorded', 'headers': {}, 'content': '', 'elapsed': 0}
+        time.sleep(self._delay(record))
+        response = requests.Response()
+        response.status_code = record['status']
+        response.reason = record['reason']
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response.headers.pop('Content-Encoding', None)
+        response._content = record['content'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
@@ -1,7 +1,10 @@
 import time
 from logging import getLogger
 from types import GeneratorType
-from .exceptions import MaxRetry
+
+from common import metrics
+from . import deadline
+from .exceptions import MaxRetry, DeadlineExceeded
 
 
 _logger = getLogger(__name__)
@@ -42,11 +45,16 @@ class gateway_retry:
                     # Gateway expectes to receive particular data on status-200 response. But in some cases Yandex API
                     # may return unexpected data. Typically those are status-200 responses,
                     # but has errors inside response-body (because service was unable to process request)
+                    metrics.yd_retries.inc(error_code=result['error_code'])
                     with self:
                         if self.can_retry:
+                            backoff = self.backoff
+                            run_deadline = deadline.current()
+                            if run_deadline and run_deadline.remaining() <= backoff:
+                                raise DeadlineExceeded(f'No time left to retry error {result}')
                             _logger.debug(f'Retry count: {self._retry_count}. '
                                           f'Backoff: {self._backoff}. Reason: {result}')
-                            time.sleep(self.backoff)
+                            time.sleep(backoff)
                             yield from wrapper(*args, **kwargs)
                         else:
                             raise MaxRetry(f'Max retries exceeded with error {result}')
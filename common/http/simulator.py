@@ -0,0 +1,529 @@
+"""
+Local stand-in for Yandex Direct API v5.
+
+Simulator serves ``keywordbids`` (get, set), ``campaigns``, ``adgroups``, ``ads``, ``sitelinks``, ``changes`` and
+``clients`` endpoints
+for a synthetic account of a configurable size. Account data is not stored but generated from object ids, so
+an account of millions of keywords takes no memory. Simulator follows YD API behaviour that matters for
+performance testing: ``LimitedBy`` pagination, ``Units`` headers, errors and latency::
+
+    account = SimulatedAccount(campaigns=100, ad_groups=100, keywords=100)     # 1M keywords
+    api = YdApiSimulator(account, errors={52: 0.01}, latency='lognormal:-3,0.5')
+    server = make_server(api, port=8080)
+    server.serve_forever()
+
+Gateway is pointed to simulator with ``YD_API_URL`` setting (``http://localhost:8080``).
+Run it with ``python manage.py yd_simulator``.
+
+Simulator can also be served in-process, without network, with :py:class:`SimulatorAdapter` transport::
+
+    YandexDirectGateway.client.configure(transport=SimulatorAdapter(api))
+"""
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from logging import getLogger
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from . import constants
+
+__all__ = ['SimulatedAccount', 'YdApiSimulator', 'SimulatorAdapter', 'make_server']
+_logger = getLogger(__name__)
+
+YD_ERRORS = {
+    52: 'Authorization server temporarily unavailable',
+    53: 'Authorization error',
+    152: 'Insufficient points',
+    1000: 'Service temporarily unavailable',
+    1001: 'Service temporarily unavailable',
+    1002: 'Operation error',
+    8000: 'Invalid request',
+}
+
+_CAMPAIGN_BASE = 10_000_000
+_AD_GROUP_BASE = 1_000_000_000
+_KEYWORD_BASE = 10_000_000_000
+_AD_BASE = 5_000_000_000
+_SITELINKS_BASE = 700_000_000
+_TIMESTAMP_EPOCH = datetime(2019, 1, 1)
+
+
+class SimulatedAccount:
+    """
+    Synthetic Yandex Direct account: campaigns consist of ad groups, ad groups consist of keywords and one ad.
+
+    Object ids are derived from object position, so any object can be found by id without storing anything::
+
+        campaign_id = 10 000 000 + campaign index
+        ad_group_id = 1 000 000 000 + campaign index * ad_groups + ad group index
+        keyword_id = 10 000 000 000 + ad group position * keywords + keyword index
+
+    Keyword auctions are generated from keyword id and ``seed``. A ``auction_change_rate`` share of keywords
+    gets a new auction every ``auction_period`` seconds. Only bids set through API are stored.
+
+    Campaigns and ad groups can be changed with :py:meth:`rename_campaign` and :py:meth:`change_ad_group`.
+    Every change advances account version, which is reported by ``changes`` endpoint as a timestamp.
+    """
+    def __init__(self, campaigns: int = 10, ad_groups: int = 10, keywords: int = 100, login: str = 'simulator',
+                 seed: int = 0, auction_change_rate: float = 0.0, auction_period: int = 300):
+        """
+        :param campaigns:               number of campaigns
+        :param ad_groups:               number of ad groups in every campaign
+        :param keywords:                number of keywords in every ad group
+        :param login:                   account login
+        :param seed:                    auctions random seed
+        :param auction_change_rate:     share of keywords which auction changes every period
+        :param auction_period:          auction change period in seconds
+        """
+        self.campaigns = campaigns
+        self.ad_groups = ad_groups
+        self.keywords = keywords
+        self.login = login
+        self.seed = seed
+        self.auction_change_rate = auction_change_rate
+        self.auction_period = auction_period
+        self._bids = {}
+        self._names = {}
+        self.version = 0
+        self._changes = []     # (version, campaign_id, ad_group_id or None)
+        self._lock = threading.Lock()
+
+    @property
+    def total_keywords(self) -> int:
+        return self.campaigns * self.ad_groups * self.keywords
+
+    def campaign_ids(self) -> range:
+        return range(_CAMPAIGN_BASE, _CAMPAIGN_BASE + self.campaigns)
+
+    def ad_group_ids(self, campaign_id: int) -> range:
+        start = _AD_GROUP_BASE + (campaign_id - _CAMPAIGN_BASE) * self.ad_groups
+        return range(start, start + self.ad_groups)
+
+    def keyword_ids(self, ad_group_id: int) -> range:
+        start = _KEYWORD_BASE + (ad_group_id - _AD_GROUP_BASE) * self.keywords
+        return range(start, start + self.keywords)
+
+    def has_campaign(self, campaign_id: int) -> bool:
+        return campaign_id in self.campaign_ids()
+
+    def has_ad_group(self, ad_group_id: int) -> bool:
+        return 0 <= ad_group_id - _AD_GROUP_BASE < self.campaigns * self.ad_groups
+
+    def has_keyword(self, keyword_id: int) -> bool:
+        return 0 <= keyword_id - _KEYWORD_BASE < self.total_keywords
+
+    def keyword_ad_group_id(self, keyword_id: int) -> int:
+        return _AD_GROUP_BASE + (keyword_id - _KEYWORD_BASE) // self.keywords
+
+    def ad_group_campaign_id(self, ad_group_id: int) -> int:
+        return _CAMPAIGN_BASE + (ad_group_id - _AD_GROUP_BASE) // self.ad_groups
+
+    def ad_id(self, ad_group_id: int) -> int:
+        return _AD_BASE + ad_group_id - _AD_GROUP_BASE
+
+    def sitelinks_set_id(self, campaign_id: int) -> int:
+        return _SITELINKS_BASE + campaign_id - _CAMPAIGN_BASE
+
+    @staticmethod
+    def serving_status(keyword_id: int) -> str:
+        return 'RARELY_SERVED' if keyword_id % 10 == 3 else 'ELIGIBLE'
+
+    def campaign_name(self, campaign_id: int) -> str:
+        return self._names.get(campaign_id, f'Campaign {campaign_id}')
+
+    def ad_group_name(self, ad_group_id: int) -> str:
+        return self._names.get(ad_group_id, f'Ad group {ad_group_id}')
+
+    def rename_campaign(self, campaign_id: int, name: str):
+        with self._lock:
+            self._names[campaign_id] = name
+            self.version += 1
+            self._changes.append((self.version, campaign_id, None))
+
+    def change_ad_group(self, ad_group_id: int, name: str):
+        """Rename ad group. Ad group and its ad are reported as modified"""
+        with self._lock:
+            self._names[ad_group_id] = name
+            self.version += 1
+            self._changes.append((self.version, self.ad_group_campaign_id(ad_group_id), ad_group_id))
+
+    def changes_since(self, version: int) -> list:
+        """Changes made after account version: [(campaign_id, ad_group_id or None)]"""
+        return [(campaign_id, ad_group_id) for v, campaign_id, ad_group_id in self._changes if v > version]
+
+    def set_bid(self, keyword_id: int, bid: int):
+        with self._lock:
+            self._bids[keyword_id] = bid
+
+    def keyword_bid(self, keyword_id: int) -> dict:
+        """Full keyword bid data in YD API keywordbids.get format"""
+        epoch = 0
+        if self.auction_change_rate:
+            epoch = int(time.time() // self.auction_period)
+            if random.Random(epoch * 7919 + keyword_id).random() >= self.auction_change_rate:
+                epoch = 0
+        rnd = random.Random(hash((self.seed, keyword_id, epoch)))
+        bid = rnd.randint(1, 100) * 1_000_000
+        items, traffic = [], 100
+        for _ in range(rnd.randint(2, 7)):
+            items.append({'TrafficVolume': traffic, 'Bid': bid, 'Price': int(bid * rnd.uniform(0.6, 0.95))})
+            traffic = max(traffic - rnd.randint(1, 25), 1)
+            bid = max(int(bid * rnd.uniform(0.5, 0.99)), 300_000)
+        ad_group_id = self.keyword_ad_group_id(keyword_id)
+        return {
+            'KeywordId': keyword_id,
+            'AdGroupId': ad_group_id,
+            'CampaignId': self.ad_group_campaign_id(ad_group_id),
+            'ServingStatus': self.serving_status(keyword_id),
+            'StrategyPriority': 'NORMAL',
+            'Search': {'Bid': self._bids.get(keyword_id, items[0]['Bid']), 'AuctionBids': {'AuctionBidItems': items}},
+            'Network': {'Bid': 300_000, 'Coverage': {'CoverageItems': [{'Probability': 100, 'Bid': 300_000}]}},
+        }
+
+    def select_keyword_ids(self, criteria: dict):
+        """Generate ids of keywords matching keywordbids SelectionCriteria"""
+        if criteria.get('KeywordIds'):
+            yield from (i for i in criteria['KeywordIds'] if self.has_keyword(i))
+        elif criteria.get('AdGroupIds'):
+            for ad_group_id in criteria['AdGroupIds']:
+                if self.has_ad_group(ad_group_id):
+                    yield from self.keyword_ids(ad_group_id)
+        else:
+            for campaign_id in criteria.get('CampaignIds') or ():
+                if self.has_campaign(campaign_id):
+                    for ad_group_id in self.ad_group_ids(campaign_id):
+                        yield from self.keyword_ids(ad_group_id)
+
+    def select_ad_group_ids(self, criteria: dict):
+        """Generate ids of ad groups matching ads SelectionCriteria"""
+        if criteria.get('Ids'):
+            yield from (i - _AD_BASE + _AD_GROUP_BASE for i in criteria['Ids']
+                        if self.has_ad_group(i - _AD_BASE + _AD_GROUP_BASE))
+        elif criteria.get('AdGroupIds'):
+            yield from (i for i in criteria['AdGroupIds'] if self.has_ad_group(i))
+        else:
+            for campaign_id in criteria.get('CampaignIds') or ():
+                if self.has_campaign(campaign_id):
+                    yield from self.ad_group_ids(campaign_id)
+
+
+class _ApiError(Exception):
+
+    def __init__(self, code: int, detail: str = ''):
+        super().__init__(code, detail)
+        self.code = code
+        self.detail = detail
+
+
+def _project(item: dict, field_names) -> dict:
+    return {k: v for k, v in item.items() if k in field_names}
+
+
+class YdApiSimulator:
+    """
+    Yandex Direct API v5 request handler. Transport independent: takes endpoint and request body,
+    returns response body and headers. Use :py:func:`make_server` to serve it over http.
+    """
+    def __init__(self, account: SimulatedAccount, page_limit: int = 10_000, errors: dict = None,
+                 latency: str = None, units_limit: int = 1_000_000, units_per_call: int = 10,
+                 units_per_object: float = 0.01, seed: int = None, item_errors: dict = None):
+        """
+        :param account:             simulated account
+        :param page_limit:          max objects in one get response, more objects are paginated with LimitedBy
+        :param errors:              error injection rates: {error_code: share of requests}
+        :param latency:             latency distribution: ``fixed:seconds``, ``uniform:min,max``, \
+        ``lognormal:mu,sigma`` or None
+        :param units_limit:         daily units limit of account. 152 error is returned when it is spent
+        :param units_per_call:      units cost of a call
+        :param units_per_object:    units cost of every returned or set object
+        :param seed:                errors and latency random seed
+        :param item_errors:         error injection rates of set keyword bids: {error_code: share of keyword bids}
+        """
+        self.account = account
+        self.page_limit = page_limit
+        self.errors = errors or {}
+        self.item_errors = item_errors or {}
+        self.latency = self.parse_latency(latency)
+        self.units_limit = units_limit
+        self.units_per_call = units_per_call
+        self.units_per_object = units_per_object
+        self.units_spent = 0
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._handlers = {
+            (constants.YdAPiV5EndpointsStruct.KEYWORD_BIDS, 'get'): self.get_keyword_bids,
+            (constants.YdAPiV5EndpointsStruct.KEYWORD_BIDS, 'set'): self.set_keyword_bids,
+            (constants.YdAPiV5EndpointsStruct.CAMPAIGNS, 'get'): self.get_campaigns,
+            (constants.YdAPiV5EndpointsStruct.AD_GROUPS, 'get'): self.get_ad_groups,
+            (constants.YdAPiV5EndpointsStruct.ADS, 'get'): self.get_ads,
+            (constants.YdAPiV5EndpointsStruct.SITELINKS, 'get'): self.get_sitelinks,
+            (constants.YdAPiV5EndpointsStruct.CLIENTS, 'get'): self.get_clients,
+            (constants.YdAPiV5EndpointsStruct.CHANGES, 'checkDictionaries'): self.check_dictionaries,
+            (constants.YdAPiV5EndpointsStruct.CHANGES, 'checkCampaigns'): self.check_campaigns,
+            (constants.YdAPiV5EndpointsStruct.CHANGES, 'check'): self.check_changes,
+        }
+
+    @staticmethod
+    def parse_latency(spec: str or None):
+        """Parse latency distribution spec into a function returning latency in seconds"""
+        if not spec:
+            return lambda rnd: 0
+        name, _, args = spec.partition(':')
+        params = [float(a) for a in args.split(',') if a]
+        distributions = {
+            'fixed': lambda rnd: params[0],
+            'uniform': lambda rnd: rnd.uniform(*params),
+            'lognormal': lambda rnd: rnd.lognormvariate(*params),
+        }
+        if name not in distributions:
+            raise ValueError(f'Unknown latency distribution {spec}. Use one of {list(distributions)}')
+        return distributions[name]
+
+    def handle(self, endpoint: str, body: bytes, authorized: bool = True) -> (dict, dict):
+        """
+        Process API request
+
+        :param endpoint:        YD API endpoint name, e.g. keywordbids
+        :param body:            request body
+        :param authorized:      whether request has authorization token
+        :return:                response body and response headers
+        """
+        request_id = uuid4().hex
+        with self._lock:
+            self.requests += 1
+            delay = self.latency(self._random)
+            injected = next((code for code, rate in self.errors.items() if self._random.random() < rate), None)
+        time.sleep(max(delay, 0))
+        headers = {'RequestId': request_id}
+        try:
+            if not authorized:
+                raise _ApiError(53, 'Invalid OAuth token')
+            if injected:
+                raise _ApiError(injected)
+            try:
+                request = json.loads(body)
+                handler = self._handlers[(endpoint, request['method'])]
+            except (ValueError, KeyError, TypeError):
+                raise _ApiError(8000, f'Unsupported request to {endpoint}')
+            result, objects = handler(request.get('params') or {})
+            headers['Units'] = self._spend_units(objects)
+            headers['Units-Used-Login'] = self.account.login
+            return {'result': result}, headers
+        except _ApiError as e:
+            return {'error': {'request_id': request_id, 'error_code': e.code,
+                              'error_string': YD_ERRORS.get(e.code, ''), 'error_detail': e.detail}}, headers
+
+    def _spend_units(self, objects: int) -> str:
+        cost = int(self.units_per_call + objects * self.units_per_object)
+        with self._lock:
+            if self.units_spent + cost > self.units_limit:
+                raise _ApiError(152, 'Daily units limit exceeded')
+            self.units_spent += cost
+            return f'{cost}/{self.units_limit - self.units_spent}/{self.units_limit}'
+
+    def _page(self, items, params: dict) -> (list, dict):
+        offset = (params.get('Page') or {}).get('Offset', 0)
+        limit = min((params.get('Page') or {}).get('Limit', self.page_limit), self.page_limit)
+        page = list(islice(items, offset, offset + limit + 1))
+        extra = {}
+        if len(page) > limit:
+            page = page[:limit]
+            extra['LimitedBy'] = offset + limit
+        return page, extra
+
+    def get_keyword_bids(self, params: dict) -> (dict, int):
+        criteria = params.get('SelectionCriteria') or {}
+        if not any(criteria.get(k) for k in ('KeywordIds', 'AdGroupIds', 'CampaignIds')):
+            raise _ApiError(8000, 'SelectionCriteria should contain KeywordIds, AdGroupIds or CampaignIds')
+        statuses = criteria.get('ServingStatuses')
+        field_names = params.get('FieldNames') or ()
+        search_fields, network_fields = params.get('SearchFieldNames'), params.get('NetworkFieldNames')
+        keyword_ids = self.account.select_keyword_ids(criteria)
+        if statuses:
+            keyword_ids = (i for i in keyword_ids if self.account.serving_status(i) in statuses)
+        page, extra = self._page(keyword_ids, params)
+        keyword_bids = []
+        for item in map(self.account.keyword_bid, page):
+            keyword_bid = _project(item, field_names)
+            if search_fields:
+                keyword_bid['Search'] = _project(item['Search'], search_fields)
+            if network_fields:
+                keyword_bid['Network'] = _project(item['Network'], network_fields)
+            keyword_bids.append(keyword_bid)
+        return {'KeywordBids': keyword_bids, **extra}, len(keyword_bids)
+
+    def set_keyword_bids(self, params: dict) -> (dict, int):
+        keyword_bids = params.get('KeywordBids') or []
+        if len(keyword_bids) > 10_000:
+            raise _ApiError(8000, 'Too many KeywordBids in request')
+        results = []
+        for keyword_bid in keyword_bids:
+            keyword_id = keyword_bid.get('KeywordId')
+            if not self.account.has_keyword(keyword_id):
+                results.append({'Errors': [{'Code': 8800, 'Message': 'Object not found', 'Details': ''}]})
+                continue
+            with self._lock:
+                injected = next((code for code, rate in self.item_errors.items() if self._random.random() < rate),
+                                None)
+            if injected:
+                results.append({'Errors': [{'Code': injected, 'Message': YD_ERRORS.get(injected, ''), 'Details': ''}]})
+                continue
+            if keyword_bid.get('SearchBid') is not None:
+                self.account.set_bid(keyword_id, keyword_bid['SearchBid'])
+            results.append({'KeywordId': keyword_id})
+        return {'SetResults': results}, len(keyword_bids)
+
+    def get_campaigns(self, params: dict) -> (dict, int):
+        ids = (params.get('SelectionCriteria') or {}).get('Ids')
+        campaign_ids = (i for i in ids if self.account.has_campaign(i)) if ids else iter(self.account.campaign_ids())
+        campaigns = ({'Id': i, 'Name': self.account.campaign_name(i)} for i in campaign_ids)
+        page, extra = self._page(campaigns, params)
+        field_names = params.get('FieldNames') or constants.YD_CAMPAIGNS_FIELDNAMES
+        return {'Campaigns': [_project(c, field_names) for c in page], **extra}, len(page)
+
+    def get_ads(self, params: dict) -> (dict, int):
+        criteria = params.get('SelectionCriteria') or {}
+        field_names = params.get('FieldNames') or constants.YD_ADS_FIELDNAMES
+        text_ad_fields = params.get('TextAdFieldNames')
+        page, extra = self._page(self.account.select_ad_group_ids(criteria), params)
+        ads = []
+        for ad_group_id in page:
+            campaign_id = self.account.ad_group_campaign_id(ad_group_id)
+            ad = {'Id': self.account.ad_id(ad_group_id), 'AdGroupId': ad_group_id, 'CampaignId': campaign_id,
+                  'Type': constants.YdAdTypes.TEXT_AD}
+            ad = _project(ad, field_names)
+            if text_ad_fields:
+                ad['TextAd'] = _project({'SitelinkSetId': self.account.sitelinks_set_id(campaign_id),
+                                         'Href': f'https://example.com/{ad_group_id}'}, text_ad_fields)
+            ads.append(ad)
+        return {'Ads': ads, **extra}, len(ads)
+
+    def get_ad_groups(self, params: dict) -> (dict, int):
+        criteria = params.get('SelectionCriteria') or {}
+        if criteria.get('Ids'):
+            criteria = {'AdGroupIds': criteria['Ids']}
+        field_names = params.get('FieldNames') or constants.YD_AD_GROUPS_FIELDNAMES
+        page, extra = self._page(self.account.select_ad_group_ids(criteria), params)
+        ad_groups = [_project({'Id': i, 'CampaignId': self.account.ad_group_campaign_id(i),
+                               'Name': self.account.ad_group_name(i)}, field_names) for i in page]
+        return {'AdGroups': ad_groups, **extra}, len(ad_groups)
+
+    def get_sitelinks(self, params: dict) -> (dict, int):
+        ids = (params.get('SelectionCriteria') or {}).get('Ids') or []
+        field_names = params.get('FieldNames') or constants.YD_SITELINKS_COLLECTION_FIELDNAMES
+        sets = ({'Id': i, 'Sitelinks': [{'Title': f'Link {n}', 'Href': f'https://example.com/{i}/{n}'}
+                                        for n in range(4)]} for i in ids)
+        page, extra = self._page(sets, params)
+        return {'SitelinksSets': [_project(s, field_names) for s in page], **extra}, len(page)
+
+    def get_clients(self, params: dict) -> (dict, int):
+        return {'Clients': [{'Login': self.account.login}]}, 1
+
+    @staticmethod
+    def timestamp(version: int) -> str:
+        """Account version as YD API changes timestamp"""
+        return (_TIMESTAMP_EPOCH + timedelta(seconds=version)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def _changes_since(self, params: dict) -> list:
+        try:
+            since = datetime.strptime(params['Timestamp'], '%Y-%m-%dT%H:%M:%SZ')
+        except (KeyError, TypeError, ValueError):
+            raise _ApiError(8000, 'Timestamp is required')
+        return self.account.changes_since(int((since - _TIMESTAMP_EPOCH).total_seconds()))
+
+    def check_dictionaries(self, params: dict) -> (dict, int):
+        return {'Timestamp': self.timestamp(self.account.version)}, 0
+
+    def check_campaigns(self, params: dict) -> (dict, int):
+        timestamp = self.timestamp(self.account.version)
+        changes_in = {}
+        for campaign_id, ad_group_id in self._changes_since(params):
+            changes_in.setdefault(campaign_id, set()).add('CHILDREN' if ad_group_id else 'SELF')
+        campaigns = [{'CampaignId': i, 'ChangesIn': sorted(changes)} for i, changes in sorted(changes_in.items())]
+        return {'Campaigns': campaigns, 'Timestamp': timestamp}, len(campaigns)
+
+    def check_changes(self, params: dict) -> (dict, int):
+        timestamp = self.timestamp(self.account.version)
+        field_names = params.get('FieldNames') or ()
+        campaign_ids = set(params.get('CampaignIds') or ())
+        ad_group_ids = set(params.get('AdGroupIds') or ())
+        if not campaign_ids and not ad_group_ids:
+            raise _ApiError(8000, 'CampaignIds or AdGroupIds are required')
+        modified = {}
+        for campaign_id, ad_group_id in self._changes_since(params):
+            if campaign_id not in campaign_ids and ad_group_id not in ad_group_ids:
+                continue
+            if ad_group_id is None:
+                if 'CampaignIds' in field_names:
+                    modified.setdefault('CampaignIds', set()).add(campaign_id)
+                continue
+            if 'AdGroupIds' in field_names:
+                modified.setdefault('AdGroupIds', set()).add(ad_group_id)
+            if 'AdIds' in field_names:
+                modified.setdefault('AdIds', set()).add(self.account.ad_id(ad_group_id))
+        result = {'Modified': {k: sorted(v) for k, v in modified.items()}, 'Timestamp': timestamp}
+        return result, sum(map(len, modified.values()))
+
+
+class SimulatorAdapter(BaseAdapter):
+    """
+    `Transport adapter <http://docs.python-requests.org/en/master/user/advanced/#transport-adapters>`_ passing
+    requests to simulator in the same process. Any request url is served as ``.../<endpoint>``.
+    """
+    def __init__(self, api: YdApiSimulator):
+        super().__init__()
+        self.api = api
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        endpoint = urlsplit(request.url).path.rstrip('/').rsplit('/', 1)[-1]
+        data, headers = self.api.handle(endpoint, request.body or b'',
+                                        authorized=bool(request.headers.get('Authorization')))
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict({'Content-Type': 'application/json; charset=utf-8', **headers})
+        response._content = json.dumps(data).encode()
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def make_server(api: YdApiSimulator, host: str = 'localhost', port: int = 8080) -> ThreadingHTTPServer:
+    """Create http server serving simulator at ``http://host:port/json/v5/<endpoint>``"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            endpoint = self.path.rstrip('/').rsplit('/', 1)[-1]
+            data, headers = api.handle(endpoint, body, authorized=bool(self.headers.get('Authorization')))
+            content = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            _logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
@@ -1,4 +1,7 @@
+import logging.handlers
 import os
+import queue
+import weakref
 
 from pythonjsonlogger import jsonlogger
 
@@ -20,4 +23,84 @@ class ElasticJsonFormatter(jsonlogger.JsonFormatter):
         log_record['response_code'] = log_record.pop('status_code', None)
         log_record.pop('server_time', None)
         log_record.pop('request', None)
-        log_record.pop('asctime', None)
\ No newline at end of file
+        log_record.pop('asctime', None)
+
+
+class Truncated:
+    """
+    Lazy log argument: shortens data to ``limit`` bytes only when the record is actually formatted::
+
+        _logger.debug('[BODY]: %s', Truncated(request.body, 1024))
+    """
+    __slots__ = ('data', 'limit')
+
+    def __init__(self, data, limit: int = None):
+        """
+        :param data:    bytes or string to log
+        :param limit:   max bytes (characters for strings) to log. Data is logged as is if None
+        :type data:     bytes or str
+        :type limit:    int
+        """
+        self.data = data
+        self.limit = limit
+
+    def __str__(self):
+        data = self.data
+        if self.limit is None or data is None or len(data) <= self.limit:
+            return str(data)
+        return f'{data[:self.limit]}... ({len(data)} bytes total)'
+
+
+class QueueStreamHandler(logging.handlers.QueueHandler):
+    """
+    Stream handler which writes records in a background thread, so logging never blocks on formatting or I/O.
+
+    Records are put to the queue as is: unlike :py:class:`logging.handlers.QueueHandler` the message is not
+    formatted in the logging thread, it is formatted by the background thread with handler formatter.
+    Log arguments should not be changed after they are logged.
+    """
+    _instances = weakref.WeakSet()
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream)
+        self._listener = None
+        self._start()
+        self._instances.add(self)
+
+    def _start(self):
+        self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self._listener.start()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        return record
+
+    def flush(self):
+        """Wait until all queued records are written"""
+        if self._listener and self._listener._thread:
+            self._listener.stop()
+            self._start()
+        self.target.flush()
+
+    def close(self):
+        if self._listener and self._listener._thread:
+            self._listener.stop()
+        self._listener = None
+        self.target.close()
+        super().close()
+
+    @classmethod
+    def _after_fork(cls):
+        # listener thread is not inherited by forked process, e.g. celery prefork worker
+        for handler in list(cls._instances):
+            if handler._listener is not None:
+                handler.queue = queue.SimpleQueue()
+                handler._start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=QueueStreamHandler._after_fork)
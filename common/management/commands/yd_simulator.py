@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from common.http import simulator
+
+
+class Command(BaseCommand):
+    help = 'Run local Yandex Direct API simulator for load and benchmark testing. ' \
+           'Point gateway to it with YD_API_URL=http://<host>:<port>'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--port', type=int, default=8080)
+        parser.add_argument('--campaigns', type=int, default=10, help='Number of campaigns in account')
+        parser.add_argument('--ad-groups', type=int, default=10, help='Number of ad groups in every campaign')
+        parser.add_argument('--keywords', type=int, default=100, help='Number of keywords in every ad group')
+        parser.add_argument('--login', default='simulator', help='Account login')
+        parser.add_argument('--seed', type=int, default=0, help='Auctions and errors random seed')
+        parser.add_argument('--auction-change-rate', type=float, default=0.0,
+                            help='Share of keywords which auction changes every --auction-period seconds')
+        parser.add_argument('--auction-period', type=int, default=300)
+        parser.add_argument('--page-limit', type=int, default=10_000, help='Max objects in one get response')
+        parser.add_argument('--error', action='append', default=[], metavar='CODE:RATE',
+                            help='Inject YD error code into a share of requests, e.g. --error 52:0.01')
+        parser.add_argument('--latency', default=None,
+                            help='Latency distribution: fixed:SEC, uniform:MIN,MAX or lognormal:MU,SIGMA')
+        parser.add_argument('--units-limit', type=int, default=1_000_000, help='Daily units limit')
+
+    def handle(self, *args, **options):
+        try:
+            errors = {int(code): float(rate) for code, rate in (e.split(':') for e in options['error'])}
+            account = simulator.SimulatedAccount(
+                campaigns=options['campaigns'], ad_groups=options['ad_groups'], keywords=options['keywords'],
+                login=options['login'], seed=options['seed'], auction_change_rate=options['auction_change_rate'],
+                auction_period=options['auction_period'])
+            api = simulator.YdApiSimulator(account, page_limit=options['page_limit'], errors=errors,
+                                           latency=options['latency'], units_limit=options['units_limit'],
+                                           seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(e)
+        server = simulator.make_server(api, host=options['host'], port=options['port'])
+        self.stdout.write(f'Simulating account "{account.login}" with {account.total_keywords} keywords '
+                          f'at http://{options["host"]}:{options["port"]}/json/v5/')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'Served {api.requests} requests, spent {api.units_spent} units')
@@ -0,0 +1,288 @@
+"""
+Prometheus-style application metrics.
+
+Metrics are recorded in-process without locks: every thread writes to its own shard and shards are merged
+when metrics are read. Every process periodically flushes its merged values to a file in ``METRICS_DIR``,
+so metrics of all celery prefork children and web workers are aggregated from files by the ``/metrics`` view
+without any external collector::
+
+    yd_units_spent.inc(10, login='some_login')
+    http_request_duration.observe(0.25, endpoint='keywordbids')
+
+    start_flusher()                 # flush every METRICS_FLUSH_INTERVAL seconds in background
+    flush()                         # or flush now
+    render(collect())               # metrics of all processes in Prometheus text format
+
+Counters and histograms of all processes are summed. Gauges are either summed over processes which flushed
+recently (``livesum``, changed with inc/dec) or taken from the most recent flush (``last``, changed with set).
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from glob import glob
+from logging import getLogger
+
+__all__ = ['Counter', 'Gauge', 'Histogram', 'flush', 'start_flusher', 'collect', 'render']
+_logger = getLogger(__name__)
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY = {}
+"""All metrics declared in process: {name: metric}"""
+
+_local = threading.local()
+_shards = []
+_last = {}
+_flusher = None
+
+
+def _reset():
+    """Forget values inherited from parent process"""
+    global _local, _shards, _last, _flusher
+    _local, _shards, _last, _flusher = threading.local(), [], {}, None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset)
+
+
+def _shard() -> dict:
+    try:
+        return _local.shard
+    except AttributeError:
+        _local.shard = shard = {}
+        _shards.append(shard)
+        return shard
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        """
+        :param name:            metric name
+        :param documentation:   metric help text
+        :param labelnames:      names of labels which values are passed as keyword arguments on metric change
+        :type name:             str
+        :type documentation:    str
+        :type labelnames:       tuple
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        return (self.name, *(str(labels.get(label, '')) for label in self.labelnames))
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, value: float = 1, **labels):
+        shard, key = _shard(), self._key(labels)
+        shard[key] = shard.get(key, 0) + value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), multiprocess_mode: str = 'livesum'):
+        """
+        :param multiprocess_mode:   ``livesum`` to change gauge with inc/dec and sum values of live processes, \
+        ``last`` to change gauge with set and take the most recent value
+        :type multiprocess_mode:    str
+        """
+        assert multiprocess_mode in ('livesum', 'last'), f'Unknown multiprocess mode {multiprocess_mode}'
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+
+    def inc(self, value: float = 1, **labels):
+        shard, key = _shard(), self._key(labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+    def set(self, value: float, **labels):
+        _last[self._key(labels)] = (value, time.time())
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        """
+        :param buckets:     upper bounds of histogram buckets. +Inf bucket is added automatically
+        :type buckets:      tuple
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        shard, key = _shard(), self._key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            # bucket counts, +Inf bucket count, sum, count
+            counts = shard[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+def _merge(target: dict, key: tuple, value):
+    if type(value) is list:
+        current = target.get(key)
+        target[key] = value if current is None else [a + b for a, b in zip(current, value)]
+    else:
+        target[key] = target.get(key, 0) + value
+
+
+def snapshot() -> dict:
+    """Merged metric values of this process"""
+    values = {}
+    for shard in list(_shards):
+        for key, value in list(shard.items()):
+            _merge(values, key, list(value) if type(value) is list else value)
+    return {
+        'pid': os.getpid(),
+        'time': time.time(),
+        'values': [[list(key), value] for key, value in values.items()],
+        'last': [[list(key), value, ts] for key, (value, ts) in list(_last.items())],
+    }
+
+
+def _path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f'{pid}.json')
+
+
+def flush(directory: str = None):
+    """Write metrics of this process to ``METRICS_DIR``"""
+    from django.conf import settings
+    directory = directory or settings.METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = _path(directory, os.getpid())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _flush_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except OSError as e:
+            _logger.warning(f'Unable to flush metrics: {e}')
+
+
+def start_flusher(interval: float = None):
+    """Start flushing metrics of this process in background. Safe to call multiple times"""
+    global _flusher
+    from django.conf import settings
+    if not settings.METRICS_ENABLED or (_flusher and _flusher.is_alive()):
+        return
+    _flusher = threading.Thread(target=_flush_loop, args=(interval or settings.METRICS_FLUSH_INTERVAL,),
+                                name='metrics-flusher', daemon=True)
+    _flusher.start()
+
+
+def collect(directory: str = None) -> dict:
+    """
+    Aggregate metrics flushed by all processes. Files of processes which were not flushing for
+    ``METRICS_FILE_TTL`` seconds are removed.
+
+    :param directory:   metrics directory. ``METRICS_DIR`` by default
+    :type directory:    str
+    :rtype:             dict
+    :return:            {key: value}, where key is a tuple of metric name and label values
+    """
+    from django.conf import settings
+    directory = directory or settings.METRICS_DIR
+    now = time.time()
+    values, live, last = {}, {}, {}
+    for path in glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        age = now - data['time']
+        if age > settings.METRICS_FILE_TTL:
+            os.remove(path)
+            continue
+        is_live = age < settings.METRICS_FLUSH_INTERVAL * 3
+        for key, value in data['values']:
+            key = tuple(key)
+            metric = REGISTRY.get(key[0])
+            if isinstance(metric, Gauge):
+                if is_live:
+                    _merge(live, key, value)
+            else:
+                _merge(values, key, value)
+        for key, value, ts in data['last']:
+            key = tuple(key)
+            if key not in last or last[key][1] < ts:
+                last[key] = (value, ts)
+    values.update(live)
+    values.update({key: value for key, (value, _) in last.items()})
+    return values
+
+
+def _labels(metric: Metric, label_values, **extra) -> str:
+    pairs = [*zip(metric.labelnames, label_values), *extra.items()]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render(values: dict) -> str:
+    """Render metric values in Prometheus text exposition format"""
+    by_metric = {}
+    for key, value in values.items():
+        if key[0] in REGISTRY:
+            by_metric.setdefault(key[0], []).append((key[1:], value))
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for label_values, value in sorted(by_metric.get(name, ())):
+            if metric.type == 'histogram':
+                cumulative = 0
+                for bound, count in zip((*metric.buckets, '+Inf'), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(metric, label_values, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(metric, label_values)} {value[-2]}')
+                lines.append(f'{name}_count{_labels(metric, label_values)} {value[-1]}')
+            else:
+                lines.append(f'{name}{_labels(metric, label_values)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+http_request_duration = Histogram('http_request_duration_seconds', 'HTTP request latency', ('endpoint',))
+http_requests_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being sent', ('endpoint',))
+http_cache_requests = Counter('http_cache_requests_total', 'Cacheable HTTP requests by cache result',
+                              ('endpoint', 'result'))
+http_coalesced_requests = Counter('http_coalesced_requests_total',
+                                  'Requests which shared response of identical request in flight', ('endpoint',))
+http_circuit_state = Gauge('http_circuit_state', 'Circuit breaker state: 0 - closed, 1 - open, 2 - half-open',
+                           ('account', 'endpoint'), multiprocess_mode='last')
+http_circuit_rejected = Counter('http_circuit_rejected_total', 'Requests rejected by open circuit', ('endpoint',))
+http_pool_requests = Counter('http_pool_requests_total',
+                             'Requests sent over pooled keep-alive connection (hits) or new connection (misses)',
+                             ('host', 'result'))
+http_pool_warmed = Counter('http_pool_warmed_connections_total', 'Connections opened ahead of requests', ('host',))
+http_pool_reaped = Counter('http_pool_reaped_connections_total', 'Idle keep-alive connections closed', ('host',))
+yd_retries = Counter('yd_retries_total', 'Requests retried on Yandex Direct API errors', ('error_code',))
+yd_units_spent = Counter('yd_units_spent_total', 'Yandex Direct API units spent', ('login',))
+yd_units_rest = Gauge('yd_units_rest', 'Yandex Direct API units left', ('login',), multiprocess_mode='last')
+yd_chunk_size = Histogram('yd_chunk_size', 'Number of objects in one Yandex Direct API request', ('operation',),
+                          buckets=(1, 10, 100, 1000, 2500, 5000, 10_000))
+run_stage_duration = Histogram('run_stage_duration_seconds', 'Own time of get-calculate-set cycle stages',
+                               ('stage',))
+task_queue_wait = Histogram('celery_task_queue_wait_seconds', 'Time from task publish to task start', ('task',))
+task_duration = Histogram('celery_task_duration_seconds', 'Task run time', ('task',))
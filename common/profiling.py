@@ -0,0 +1,79 @@
+"""
+Opt-in profiling of application runs.
+
+Profiler runs code under cProfile and tracemalloc. Collected stats are saved in pstats format, so they can be
+explored with any pstats-compatible tool (``python -m pstats``, snakeviz etc.)::
+
+    profiler = RunProfiler()
+    with profiler:
+        run(kw_bid_rule_id)
+    profiler.stats          # marshalled pstats data, the same as written by cProfile.Profile.dump_stats()
+    profiler.summary        # top functions by cumulative time
+    profiler.memory         # {'peak': ..., 'stages': {'map': ..., ...}, 'top': [...]}
+
+Only the thread that entered profiler is profiled by cProfile. HTTP requests are sent by the client's thread pool,
+so their time shows up as waiting in the gateway. Memory is traced in all threads.
+If stage timer is active during profiling, peak traced memory of every stage is collected.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import tracemalloc
+
+from . import timing
+
+__all__ = ['RunProfiler']
+
+
+class RunProfiler:
+    """
+    Context manager collecting cProfile stats and tracemalloc memory usage of a code block
+    """
+    def __init__(self, summary_limit: int = 50, top_allocations: int = 20, traceback_frames: int = 1):
+        """
+        :param summary_limit:       number of functions in text summary
+        :param top_allocations:     number of source lines allocating most memory to report
+        :param traceback_frames:    frames stored in allocation tracebacks
+        :type summary_limit:        int
+        :type top_allocations:      int
+        :type traceback_frames:     int
+        """
+        self.summary_limit = summary_limit
+        self.top_allocations = top_allocations
+        self.traceback_frames = traceback_frames
+        self.stats = b''
+        self.summary = ''
+        self.memory = {}
+        self._profile = None
+        self._stages = {}
+
+    def _collect_stage_memory(self, sender, timings: dict, **kwargs):
+        self._stages.update({name: stage['memory_peak'] for name, stage in timings['stages'].items()
+                             if 'memory_peak' in stage})
+
+    def __enter__(self):
+        self._stages = {}
+        timing.stage_timings.connect(self._collect_stage_memory, dispatch_uid=id(self))
+        tracemalloc.start(self.traceback_frames)
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._profile.disable()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        timing.stage_timings.disconnect(dispatch_uid=id(self))
+        top = snapshot.statistics('lineno')[:self.top_allocations]
+        self.memory = {
+            'peak': peak,
+            'stages': self._stages,
+            'top': [{'trace': str(stat.traceback), 'size': stat.size, 'count': stat.count} for stat in top],
+        }
+        self._profile.create_stats()
+        self.stats = marshal.dumps(self._profile.stats)
+        summary = io.StringIO()
+        pstats.Stats(self._profile, stream=summary).sort_stats('cumulative').print_stats(self.summary_limit)
+        self.summary = summary.getvalue()
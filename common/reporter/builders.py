@@ -64,6 +64,19 @@ class ExtendedTaskResultBuilder:
         _logger.debug(f'Recieved total keyword_bids sent {total}')
         self._model.total = total
 
+    def build_extra_data(self, **extra_data):
+        """
+        Updates :py:attr:`auctioneer.models.KeywordBidTaskResult.extra_data` attribute::
+
+            builder.build_extra_data(timings={'total': 1.5, ...})
+
+        :param extra_data:  data to store in task result
+        :type extra_data:   dict
+        :rtype:             None
+        """
+        _logger.debug(f'Recieved extra data {list(extra_data)}')
+        self._model.extra_data = {**(self._model.extra_data or {}), **extra_data}
+
     def build_task_result(self, task_id: int, kw_bid_rule_id: int):
         """
         Sets :py:class:`auctioneer.models.KeywordBidTaskResult` attributes.
@@ -86,7 +99,7 @@ class ExtendedTaskResultBuilder:
                   'success': success,
                   'kw_bid_rule': keyword_bid_rule,
                   'is_ok': is_ok,
-                  'extra_data': {}
+                  'extra_data': self._model.extra_data or {}
                   }
         _logger.debug(f'Recieved task results {result}')
         for k, v in result.items():
@@ -4,7 +4,8 @@ data from other parts of application as Signals then pass unprocessed data to al
 may process it as needed.
 """
 
-from common import signals, http
+from auctioneer.main import run
+from common import signals, http, timing
 from common.task_runner.tasks import calculate_keyword_bids
 
 
@@ -47,3 +48,45 @@ class SetKeywordBidsParamsTransceiver(signals.Transceiver):
 
 
 set_keyword_bids_params_transceiver = SetKeywordBidsParamsTransceiver()
+
+
+class StageTimingsTransceiver(signals.Transceiver):
+    """
+    Receives stage timings of a run from :py:data:`common.timing.stage_timings` signal and passes them to listeners
+    """
+    target_sender = timing.StageTimer.__name__
+
+    def process_signal(self, sender, *args, **kwargs):
+        self._data = kwargs.get('timings')
+        self.notify()
+
+
+stage_timings_transceiver = StageTimingsTransceiver()
+
+
+class RunAbortedTransceiver(signals.Transceiver):
+    """
+    Receives reason and number of results of an aborted run from :py:data:`auctioneer.main.run_aborted` signal
+    """
+    target_sender = run.__name__
+
+    def process_signal(self, sender, *args, **kwargs):
+        self._data = {'reason': kwargs.get('reason'), 'sent': kwargs.get('sent')}
+        self.notify()
+
+
+run_aborted_transceiver = RunAbortedTransceiver()
+
+
+class KeywordBidsFailedTransceiver(signals.Transceiver):
+    """
+    Receives failures report of a run from :py:data:`auctioneer.main.keyword_bids_failed` signal
+    """
+    target_sender = run.__name__
+
+    def process_signal(self, sender, *args, **kwargs):
+        self._data = kwargs.get('failures')
+        self.notify()
+
+
+keyword_bids_failed_transceiver = KeywordBidsFailedTransceiver()
@@ -64,3 +64,63 @@ class CalculateKeywordBidsTotalSent(signals.Listener):
 
 
 kwb_total_listener = CalculateKeywordBidsTotalSent(builders.ext_task_result_builder)
+
+
+class StageTimingsListener(signals.Listener):
+    """
+    A listener for collecting run stage timings and passing them to task result extra data.
+    """
+
+    def __init__(self, builder: builders.ExtendedTaskResultBuilder):
+        """
+        :param builder:         Extended task result builder instance
+        :type builder:          ExtendedTaskResultBuilder
+        """
+        self._builder = builder
+
+    def update(self, beacon):
+        self._builder.build_extra_data(timings=beacon.get_data())
+        self._builder.build_result()
+
+
+stage_timings_listener = StageTimingsListener(builders.ext_task_result_builder)
+
+
+class RunAbortedListener(signals.Listener):
+    """
+    A listener for marking task result of an aborted run as partial.
+    """
+
+    def __init__(self, builder: builders.ExtendedTaskResultBuilder):
+        """
+        :param builder:         Extended task result builder instance
+        :type builder:          ExtendedTaskResultBuilder
+        """
+        self._builder = builder
+
+    def update(self, beacon):
+        self._builder.build_extra_data(aborted=beacon.get_data())
+        self._builder.build_result()
+
+
+run_aborted_listener = RunAbortedListener(builders.ext_task_result_builder)
+
+
+class KeywordBidsFailedListener(signals.Listener):
+    """
+    A listener for passing keyword bids which were not set to task result extra data.
+    """
+
+    def __init__(self, builder: builders.ExtendedTaskResultBuilder):
+        """
+        :param builder:         Extended task result builder instance
+        :type builder:          ExtendedTaskResultBuilder
+        """
+        self._builder = builder
+
+    def update(self, beacon):
+        self._builder.build_extra_data(failures=beacon.get_data())
+        self._builder.build_result()
+
+
+keyword_bids_failed_listener = KeywordBidsFailedListener(builders.ext_task_result_builder)
@@ -1,5 +1,7 @@
 import os
 
+from celery.schedules import crontab
+
 VERSION = 2.0
 
 # ENV's
@@ -12,6 +14,10 @@ DB_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 DB_PORT = int(os.getenv('POSTGRES_PORT', '5432'))
 CALLBACK_HOST = os.getenv('CALLBACK_HOST', 'localhost:8000')
 DEBUG = os.getenv('DEBUG', True)
+# Directory to record Yandex Direct API traffic of every run to. Recording is disabled if not set
+YD_TRAFFIC_RECORD_DIR = os.getenv('YD_TRAFFIC_RECORD_DIR')
+# Yandex Direct API base url. Point it to local simulator (manage.py yd_simulator) for load testing
+YD_API_URL = os.getenv('YD_API_URL', 'https://api.direct.yandex.com')
 # Yandex direct API auth settings
 YD_CLIENT_ID = os.getenv('YD_CLIENT_ID')
 YD_CLIENT_SECRET = os.getenv('YD_CLIENT_SECRET')
@@ -22,17 +28,110 @@ DJANGO_CELERY_BEAT_TZ_AWARE = True
 CELERY_RESULT_BACKEND = 'django-db'
 TASK_ROUTES = {
     'calculate_keyword_bids': {'queue': 'keyword_bids'},
+    'purge_keyword_bid_history': {'queue': 'keyword_bids'},
+    'sync_reference_data': {'queue': 'keyword_bids'},
 }
 TASK_DEFAULT_RETRIES = 3
+# Seconds a keyword bids run should be done in. Rules with interval schedule get this share of their interval
+KEYWORD_BID_RUN_TIME_BUDGET = 10 * 60
+KEYWORD_BID_RUN_TIME_BUDGET_SHARE = 0.9
+CELERY_BEAT_SCHEDULE = {
+    'purge_keyword_bid_history': {
+        'task': 'purge_keyword_bid_history',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'sync_reference_data': {
+        'task': 'sync_reference_data',
+        'schedule': crontab(minute='*/15'),
+    },
+}
 
 # Base
 SECRET_KEY = 'wdz8^p(v%#41)uiluzg@4^s9n@&)t-3gy2r+t3^be2-)m9@kn2'
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv('PATH_DATA', os.path.join(BASE_DIR, 'data'))
 ALLOWED_HOSTS = ['*']
 TIME_ZONE = 'Europe/Moscow'
 USE_TZ = True
 DATETIME_FORMAT = 'j N Y H:i:s'
 
+# Keyword bids history
+KEYWORD_BID_HISTORY_ENABLED = True
+KEYWORD_BID_HISTORY_BATCH_SIZE = 10_000     # rows written with one COPY statement
+KEYWORD_BID_HISTORY_BUFFER_SIZE = 200_000   # rows waiting to be written before new ones are dropped
+KEYWORD_BID_HISTORY_RETENTION_DAYS = 30
+
+# Time get-calculate-set cycle stages of every run. Timings are saved to task results extra data
+STAGE_TIMING_ENABLED = True
+
+# Metrics. Every process flushes its metrics to METRICS_DIR, /metrics view aggregates them
+METRICS_ENABLED = True
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 10         # seconds
+METRICS_FILE_TTL = 24 * 60 * 60     # metrics of processes not flushing for this number of seconds are dropped
+# Addresses /metrics is served to without login, e.g. of Prometheus server. Staff users are served from any address
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Incremental recalculation. Only keyword bids which auction has changed since the last run are recalculated
+KEYWORD_BID_FINGERPRINTS_ENABLED = True
+KEYWORD_BID_FINGERPRINTS_DIR = os.path.join(DATA_DIR, 'fingerprints')
+
+# Balanced keyword bids requests. Keyword counts of ad groups are kept from previous runs to build request chunks
+# of about KEYWORD_BID_CHUNK_SIZE keywords
+KEYWORD_BID_CHUNK_PLANNER_ENABLED = True
+KEYWORD_BID_CHUNK_PLANNER_DIR = os.path.join(DATA_DIR, 'chunk_planner')
+KEYWORD_BID_CHUNK_SIZE = 10_000
+
+# Checkpoints of keyword bids runs. Received pages and set results are saved while a run goes, so a retried task
+# continues from where it stopped. Checkpoint is resumed within the run time budget, or within max age if the run
+# has no budget, as its auction data gets outdated. Older checkpoints are removed
+KEYWORD_BID_CHECKPOINT_ENABLED = True
+KEYWORD_BID_CHECKPOINT_DIR = os.path.join(DATA_DIR, 'checkpoints')
+KEYWORD_BID_CHECKPOINT_MAX_AGE = 10 * 60
+
+# Auction snapshots shared between rules and runs of an account. Keyword bids of targets fetched by any rule within
+# KEYWORD_BID_SNAPSHOT_MAX_AGE seconds are read from snapshot instead of API. Snapshots are kept for retention seconds
+KEYWORD_BID_SNAPSHOT_ENABLED = True
+KEYWORD_BID_SNAPSHOT_DIR = os.path.join(DATA_DIR, 'auction_snapshots')
+KEYWORD_BID_SNAPSHOT_MAX_AGE = 60
+KEYWORD_BID_SNAPSHOT_RETENTION = 24 * 3600
+
+# Keyword bids which were not set because of temporary errors are sent again within the run, in batches of
+# KEYWORD_BID_RESUBMIT_BATCH_SIZE. Backoff seconds are doubled on every attempt. 0 attempts disables resubmission
+KEYWORD_BID_RESUBMIT_ERROR_CODES = (52, 1000, 1001, 1002)
+KEYWORD_BID_RESUBMIT_ATTEMPTS = 3
+KEYWORD_BID_RESUBMIT_BATCH_SIZE = 500
+KEYWORD_BID_RESUBMIT_BACKOFF = 1
+# Max keyword ids of every error code in task result failures report
+KEYWORD_BID_FAILURES_MAX_IDS = 100
+
+# Cache of read-only Yandex Direct API responses: {endpoint: ttl seconds}. Endpoints not listed are not cached
+YD_RESPONSE_CACHE_ENABLED = True
+YD_RESPONSE_CACHE_TTL = {
+    'campaigns': 5 * 60,
+    'adgroups': 5 * 60,
+    'ads': 5 * 60,
+    'sitelinks': 60 * 60,
+    'clients': 60 * 60,
+}
+YD_RESPONSE_CACHE_MAX_BYTES = 64 * 2 ** 20     # per process
+# Directory responses are shared between worker processes in. Responses are kept in memory only if not set
+YD_RESPONSE_CACHE_DIR = os.path.join(DATA_DIR, 'response_cache')
+# Max total size of response files in YD_RESPONSE_CACHE_DIR. Expired files are removed first
+YD_RESPONSE_CACHE_DIR_MAX_BYTES = 512 * 2 ** 20
+
+# Circuit breaker of Yandex Direct API endpoints. Requests to an endpoint of an account fail at once after
+# YD_CIRCUIT_FAILURE_THRESHOLD consecutive failures, until YD_CIRCUIT_RESET_TIMEOUT seconds pass
+YD_CIRCUIT_BREAKER_ENABLED = True
+YD_CIRCUIT_FAILURE_THRESHOLD = 5
+YD_CIRCUIT_RESET_TIMEOUT = 30
+
+# Keep-alive connections to Yandex Direct API. Worker processes open YD_KEEP_ALIVE_CONNECTIONS connections at start
+# and before tasks, so runs don't wait for TLS handshakes. Connections idle for YD_KEEP_ALIVE_IDLE_TIMEOUT seconds
+# are closed, as API server drops them anyway. 0 connections disables warm-up
+YD_KEEP_ALIVE_CONNECTIONS = int(os.getenv('YD_KEEP_ALIVE_CONNECTIONS', 4))
+YD_KEEP_ALIVE_IDLE_TIMEOUT = 50
+
 # Web
 ROOT_URLCONF = 'common.urls'
 
@@ -101,15 +200,23 @@ MIDDLEWARE = [
 ]
 
 # Logging
+# Records are written by background threads. Every record is formatted once by the handler of LOG_FORMAT:
+# "json" for elastic search or "text" for console
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_HANDLERS = ['console_json'] if LOG_FORMAT == 'json' else ['console']
+# Max bytes of request and response body in Yandex Direct API DEBUG wire logs
+YD_WIRE_LOG_MAX_BYTES = int(os.getenv('YD_WIRE_LOG_MAX_BYTES', 2048))
+# Share of Yandex Direct API requests logged in DEBUG wire logs
+YD_WIRE_LOG_SAMPLE_RATE = float(os.getenv('YD_WIRE_LOG_SAMPLE_RATE', 1.0))
 LOGGING = {
     'version': 1,
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            'class': 'common.logger.QueueStreamHandler',
             'formatter': 'full_info',
         },
         'console_json': {
-            'class': 'logging.StreamHandler',
+            'class': 'common.logger.QueueStreamHandler',
             'formatter': 'json',
         },
     },
@@ -127,27 +234,33 @@ LOGGING = {
     },
     'loggers': {
         'django': {
-            'handlers': ['console', 'console_json'],
+            'handlers': LOG_HANDLERS,
             'level': 'DEBUG',
             'propagate': False,
         },
         'django.template': {
-            'handlers': ['console', 'console_json'],
+            'handlers': LOG_HANDLERS,
             'level': 'ERROR',
             'propagate': False,
         },
         'django.db.backends': {
-            'handlers': ['console', 'console_json'],
+            'handlers': LOG_HANDLERS,
             'level': 'WARNING',
             'propagate': False,
         },
         'common': {
-            'handlers': ['console', 'console_json'],
+            'handlers': LOG_HANDLERS,
             'level': 'DEBUG',
             'propagate': False,
         },
+        # tracing spans of keyword bids runs. Set level to WARNING to disable tracing
+        'common.tracing': {
+            'handlers': ['console_json'],
+            'level': os.getenv('TRACING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
         'auctioneer': {
-            'handlers': ['console', 'console_json'],
+            'handlers': LOG_HANDLERS,
             'level': 'DEBUG',
             'propagate': False,
         },
@@ -1,14 +1,17 @@
 from django.contrib import admin
 from django.forms.models import BaseInlineFormSet
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
 from django.utils.html import mark_safe
 
-from .models import KeywordBidTaskResult, KeywordBidTask
+from .models import KeywordBidTaskResult, KeywordBidTask, KeywordBidTaskProfile
 
 
 class KeywordbidTaskInline(admin.TabularInline):
     """"""
     model = KeywordBidTask
-    fields = ['target', 'interval', 'crontab', 'expires', 'one_off', 'enabled']
+    fields = ['target', 'interval', 'crontab', 'expires', 'one_off', 'enabled', 'profile']
     extra = 0
     max_num = 1
 
@@ -45,7 +48,8 @@ class ExtendedResultDataKw(ExtendedResultData):
     fk_name = 'kw_bid_rule'
     list_display = ('status', )
     exclude = ['celery_task', 'extra_data',]
-    readonly_fields = ('task_link', 'date_done', 'success', 'errors', 'warnings', 'total', 'is_ok')
+    readonly_fields = ('task_link', 'date_done', 'success', 'errors', 'warnings', 'total', 'is_ok', 'timings',
+                       'profile_link')
     formset = LimitedResultsFs
     model = KeywordBidTaskResult
 
@@ -56,3 +60,52 @@ class ExtendedResultDataKw(ExtendedResultData):
     def date_done(self, obj):
         date = obj.celery_task.date_done
         return date
+
+    def timings(self, obj):
+        timings = (obj.extra_data or {}).get('timings')
+        if not timings:
+            return '-'
+        stages = ''.join(f'{name}: {stage["seconds"]:.2f}s / {stage["items"]}<br>'
+                         for name, stage in timings['stages'].items())
+        transferred = ', '.join(f'{direction}: {size / 2 ** 20:.1f} MB' for direction, size in timings['bytes'].items())
+        return mark_safe(f'total: {timings["total"]:.2f}s<br>{stages}{transferred}')
+
+    def profile_link(self, obj):
+        profile = KeywordBidTaskProfile.objects.filter(task_id=obj.celery_task.task_id).only('id').first()
+        if not profile:
+            return '-'
+        url = reverse('admin:task_runner_keywordbidtaskprofile_change', args=[profile.id])
+        return mark_safe(f"<a href={url}>profile</a>")
+
+
+class KeywordBidTaskProfileAdmin(admin.ModelAdmin):
+    """"""
+    actions = None
+    list_display = ('task_id', 'kw_bid_rule', 'peak_memory', 'created_at', 'download_link')
+    exclude = ('stats',)
+    readonly_fields = ('task_id', 'kw_bid_rule', 'created_at', 'peak_memory', 'download_link', 'memory', 'summary')
+
+    def get_urls(self):
+        urls = [path('<int:profile_id>/download/', self.admin_site.admin_view(self.download),
+                     name='task_runner_keywordbidtaskprofile_download')]
+        return urls + super().get_urls()
+
+    def download(self, request, profile_id: int):
+        """Download cProfile stats as a .prof file"""
+        profile = get_object_or_404(KeywordBidTaskProfile, id=profile_id)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{profile.task_id}.prof"'
+        return response
+
+    def download_link(self, obj):
+        url = reverse('admin:task_runner_keywordbidtaskprofile_download', args=[obj.id])
+        return mark_safe(f"<a href={url}>{obj.task_id}.prof</a>")
+
+    def peak_memory(self, obj):
+        return f"{(obj.memory or {}).get('peak', 0) / 2 ** 20:.1f} MB"
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(KeywordBidTaskProfile, KeywordBidTaskProfileAdmin)
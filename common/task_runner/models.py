@@ -1,5 +1,6 @@
 import json
 
+from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.db import models
 from django.utils.crypto import get_random_string
@@ -25,6 +26,8 @@ class KeywordBidTask(PeriodicTask):
     """
     target = models.ForeignKey(KeywordBidRule, on_delete=models.CASCADE, null=True)
     """To which KeywaordBid rule this task realates"""
+    profile = models.BooleanField(default=False, verbose_name='Profile runs')
+    """Run task under profiler. Profiles are saved as :py:class:`KeywordBidTaskProfile`"""
     task_handler_name = tasks.calculate_keyword_bids.__name__
     """
     A name of Celery task that will be executed.
@@ -48,8 +51,26 @@ class KeywordBidTask(PeriodicTask):
         self.name = f'{self.target.title}_task_{get_random_string()}'
         self.task = self.task_handler_name
         self.args = json.dumps([self.target.id])
+        task_kwargs = {'profile': True} if self.profile else {}
+        time_budget = self.time_budget()
+        if time_budget:
+            task_kwargs['time_budget'] = time_budget
+        self.kwargs = json.dumps(task_kwargs)
         super(PeriodicTask, self).save(*args, **kwargs)
 
+    def time_budget(self) -> float or None:
+        """
+        Seconds a run should be done in, so it is over before the next one starts.
+        Only interval schedules have fixed time between runs.
+
+        :rtype:     float or None
+        :return:    share of schedule interval or None for other schedules
+        """
+        if not self.interval:
+            return None
+        seconds = self.interval.schedule.run_every.total_seconds()
+        return round(seconds * settings.KEYWORD_BID_RUN_TIME_BUDGET_SHARE, 1)
+
     def __str__(self):
         return self.name
 
@@ -81,6 +102,31 @@ class KeywordBidTaskResult(models.Model):
         db_table = 'auctioneer_extendedtaskresult'
 
 
+class KeywordBidTaskProfile(models.Model):
+    """
+    Profile of a keyword bids task run. Celery task result is created only when task has finished,
+    so profile is related to it by celery task id.
+    """
+    task_id = models.CharField(max_length=255, unique=True, verbose_name='Task ID')
+    """Celery task id"""
+    kw_bid_rule = models.ForeignKey(KeywordBidRule, on_delete=models.SET_NULL, null=True)
+    stats = models.BinaryField()
+    """cProfile stats in pstats format"""
+    summary = models.TextField(blank=True)
+    """Top functions by cumulative time"""
+    memory = JSONField(blank=True, default=dict)
+    """Tracemalloc peak memory of the run and of every stage and top allocations"""
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Keyword bids task profile'
+        verbose_name_plural = 'Keyword bids task profiles'
+        db_table = 'auctioneer_keywordbidtaskprofile'
+
+    def __str__(self):
+        return self.task_id
+
+
 # On every KeywordBidTask change PeriodicTask will also be changed
 models.signals.pre_delete.connect(PeriodicTasks.changed, sender=KeywordBidTask)
 models.signals.pre_save.connect(PeriodicTasks.changed, sender=KeywordBidTask)
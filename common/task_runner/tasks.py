@@ -7,26 +7,100 @@ from celery import Task
 from django.conf import settings
 from requests.exceptions import ConnectionError, ReadTimeout, ConnectTimeout
 
+from auctioneer.controllers import bid_history, reference_data
 from auctioneer.main import run
-from common import settings, celery
+from common import settings, celery, profiling, tracing
+from common.http import CircuitOpen
+from common.account import controllers as account, costants as account_constants, models as account_models
 
 _logger = logging.getLogger(__file__)
 
 
-@celery.app.task(name='calculate_keyword_bids', bind=True)
-def calculate_keyword_bids(self, kw_bid_rule_id: int):
+def profiled_run(task_id: str, kw_bid_rule_id: int, time_budget: float = None):
+    """
+    Run keyword bids calculation under profiler and save profile even if run has failed
+
+    :param task_id:                 celery task id
+    :param kw_bid_rule_id:          DB id of :py:class:`auctioneer.models.KeywordBidRule`
+    :param time_budget:             seconds run should be done in
+    :type task_id:                  str
+    :type kw_bid_rule_id:           int
+    :type time_budget:              float
+    """
+    # models import tasks module to get task name
+    from .models import KeywordBidTaskProfile
+    profiler = profiling.RunProfiler()
+    try:
+        with profiler:
+            return run(kw_bid_rule_id, run_id=task_id, time_budget=time_budget)
+    finally:
+        KeywordBidTaskProfile.objects.update_or_create(task_id=task_id, defaults={
+            'kw_bid_rule_id': kw_bid_rule_id,
+            'stats': profiler.stats,
+            'summary': profiler.summary,
+            'memory': profiler.memory,
+        })
+
+
+# task is acknowledged after run, so the run of a lost worker is redelivered and resumed from its checkpoint
+@celery.app.task(name='calculate_keyword_bids', bind=True, acks_late=True, reject_on_worker_lost=True)
+def calculate_keyword_bids(self, kw_bid_rule_id: int, profile: bool = False, time_budget: float = None):
     """
     Celery task for calculating and setting yandex direct keywords bids
 
     :param self:                    task instance
     :param kw_bid_rule_id:          DB id of :py:class:`auctioneer.models.KeywordBidRule`
+    :param profile:                 run under profiler
+    :param time_budget:             seconds run should be done in. ``KEYWORD_BID_RUN_TIME_BUDGET`` by default. \
+    Run is aborted with partial results when budget is spent
     :type kw_bid_rule_id:           int
     :type self:                     Task
+    :type profile:                  bool
+    :type time_budget:              float
     """
+    time_budget = time_budget or settings.KEYWORD_BID_RUN_TIME_BUDGET
     try:
-        result = run(kw_bid_rule_id)
+        with tracing.span('task', trace_id=self.request.id, kw_bid_rule_id=kw_bid_rule_id):
+            if profile:
+                result = profiled_run(self.request.id, kw_bid_rule_id, time_budget=time_budget)
+            else:
+                result = run(kw_bid_rule_id, run_id=self.request.id, time_budget=time_budget)
+    except CircuitOpen as e:
+        # API is unavailable: free the worker and try again when circuit lets trial request through
+        _logger.warning(f'Task error: {e}. Retrying in {e.retry_after:.0f}s...')
+        self.retry(exc=e, countdown=e.retry_after, max_retries=settings.TASK_DEFAULT_RETRIES)
     except (ConnectionError, ReadTimeout, ConnectTimeout) as e:
         _logger.error(f'Task error: {e}. Retrying...', exc_info=True)
         self.retry(exc=e, max_retries=settings.TASK_DEFAULT_RETRIES)
     else:
         return result
+
+
+@celery.app.task(name='purge_keyword_bid_history')
+def purge_keyword_bid_history():
+    """
+    Celery task for removing keyword bids history older than retention period
+    """
+    return bid_history.purge_keyword_bid_history()
+
+
+@celery.app.task(name='sync_reference_data')
+def sync_reference_data(account_id: int = None):
+    """
+    Celery task for syncing local copy of Yandex Direct campaigns, ad groups, ads and sitelinks
+
+    :param account_id:      DB id of account to sync. All enabled Yandex Direct accounts are synced by default
+    :type account_id:       int
+    """
+    accounts = account_models.Account.objects.filter(acc_type=account_constants.YD_ACCOUNT_TYPE, enabled=True)
+    if account_id is not None:
+        accounts = accounts.filter(id=account_id)
+    result = {}
+    for account_id in accounts.values_list('id', flat=True):
+        try:
+            result[account_id] = reference_data.sync_reference_data(account.make_yd_gateway(account_id), account_id)
+        except Exception as e:
+            # one failed account should not stop syncing of others
+            _logger.error(f'Reference data sync of account {account_id} failed: {e}', exc_info=True)
+            result[account_id] = {'error': str(e)}
+    return result
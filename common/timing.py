@@ -0,0 +1,180 @@
+"""
+Hot-path timers of get-calculate-set cycle stages.
+
+Keyword bids are processed lazily: every stage is a generator pulling items from the previous one, so stage
+durations can't be measured by wall-clock around a function call. Stage timer keeps a stack of active stages
+and charges elapsed time only to the innermost one. That is, every stage gets its *own* time, not including
+time spent in stages it pulls items from::
+
+    @timing.timed('map')                    # time every next() call of generator returned by function
+    def map_items(items):
+        for item in items:
+            yield transform(item)
+
+    with timing.stage('decode'):            # time a block of code
+        data = json.loads(content)
+
+    timer = timing.StageTimer()
+    timer.start()                           # timer is active for the whole process until stopped
+    list(map_items(get_items()))
+    timer.stop()
+    timer.report()      # {'total': 1.5, 'stages': {'map': {'seconds': 0.5, 'items': 100}, ...}, 'bytes': {...}}
+
+When no timer is active, timers cost one global lookup per function call or block and nothing per item.
+
+Only one timer may be active in a process and stages should be entered from one thread. Counters
+(:py:func:`add_bytes`) are safe to update from any thread.
+
+If tracemalloc is tracing when timer starts, traced memory is sampled on every stage switch and the highest
+value is reported as ``memory_peak`` of a stage.
+"""
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+
+from django.dispatch import Signal
+
+__all__ = ['StageTimer', 'timed', 'timed_iter', 'stage', 'add_bytes', 'stage_timings']
+
+stage_timings = Signal(providing_args=['timings'])
+"""Sent by :py:meth:`StageTimer.stop` with timer report"""
+
+_timer = None
+
+
+class StageTimer:
+    """
+    Collects own time and number of items of every stage and number of bytes transferred.
+    """
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.items = Counter()
+        self.bytes = Counter()
+        self.total = 0.0
+        self.memory = Counter()
+        self._track_memory = False
+        self._stack = []
+        self._since = self._started = 0.0
+        self._lock = Lock()
+
+    def start(self):
+        """Make timer active for the process"""
+        global _timer
+        _timer = self
+        self._track_memory = tracemalloc.is_tracing()
+        self._started = self._since = perf_counter()
+
+    def stop(self):
+        """Deactivate timer and send :py:data:`stage_timings` signal"""
+        global _timer
+        if _timer is self:
+            _timer = None
+        self.total = perf_counter() - self._started
+        stage_timings.send(sender=self.__class__.__name__, timings=self.report())
+
+    def enter(self, name: str):
+        now = perf_counter()
+        if self._stack:
+            self.durations[self._stack[-1]] += now - self._since
+            if self._track_memory:
+                self._sample_memory()
+        self._stack.append(name)
+        self._since = now
+
+    def leave(self):
+        now = perf_counter()
+        if self._track_memory:
+            self._sample_memory()
+        self.durations[self._stack.pop()] += now - self._since
+        self._since = now
+
+    def _sample_memory(self):
+        current, _ = tracemalloc.get_traced_memory()
+        name = self._stack[-1]
+        if current > self.memory[name]:
+            self.memory[name] = current
+
+    def add_bytes(self, direction: str, size: int):
+        with self._lock:
+            self.bytes[direction] += size
+
+    def report(self) -> dict:
+        """
+        :rtype:     dict
+        :return:    total run time, own time in seconds and items of every stage, bytes sent and received
+        """
+        stages = {name: {'seconds': round(seconds, 4), 'items': self.items[name]}
+                  for name, seconds in self.durations.items()}
+        if self._track_memory:
+            for name, stage in stages.items():
+                stage['memory_peak'] = self.memory[name]
+        return {'total': round(self.total, 4), 'stages': stages, 'bytes': dict(self.bytes)}
+
+
+def _timed_iter(timer: StageTimer, name: str, iterable):
+    iterator = iter(iterable)
+    enter, leave = timer.enter, timer.leave
+    while True:
+        enter(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            leave()
+        timer.items[name] += 1
+        yield item
+
+
+def timed_iter(name: str, iterable):
+    """
+    Time every item pulled from iterable as stage ``name``. Returns iterable as is if no timer is active
+
+    :param name:        stage name
+    :param iterable:    iterable to time
+    :type name:         str
+    :type iterable:     Iterable
+    :rtype:             Iterable
+    """
+    timer = _timer
+    return iterable if timer is None else _timed_iter(timer, name, iterable)
+
+
+def timed(name: str):
+    """
+    Decorate function returning an iterator (e.g. generator function) to time every item pulled from the iterator
+
+    :param name:        stage name
+    :type name:         str
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return timed_iter(name, func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def stage(name: str):
+    """Time block of code as stage ``name``"""
+    timer = _timer
+    if timer is None:
+        yield
+        return
+    timer.enter(name)
+    try:
+        yield
+    finally:
+        timer.leave()
+        timer.items[name] += 1
+
+
+def add_bytes(direction: str, size: int):
+    """Count bytes transferred in a direction (sent, received). Safe to call from any thread"""
+    timer = _timer
+    if timer is not None:
+        timer.add_bytes(direction, size)
@@ -0,0 +1,207 @@
+"""
+Lightweight tracing spans.
+
+A span is a named and timed piece of work with a parent span. Spans of one celery task share the same trace id,
+so the whole tree of a run - task, fetch, chunk requests and their pages, calculation and set chunks - can be
+found in logs by trace id::
+
+    with tracing.span('task', trace_id=task_id):          # root span
+        with tracing.span('fetch', chunks=10) as span:      # child of current span
+            span.set(pages=3)
+
+    @tracing.traced('calculate')                            # span from first to last item of returned iterator
+    def calculate(items):
+        ...
+
+Current span is kept per thread. To continue a trace in another thread pass the span explicitly::
+
+    executor.submit(tracing.wrap(func, tracing.current()), *args)
+
+Finished spans are logged by ``common.tracing`` logger with INFO level and compact ``span`` extra field::
+
+    {"trace": "...", "span": "...", "parent": "...", "name": "page", "ts": 1546300800.0, "ms": 120.5,
+     "attrs": {"offset": 10000}, "error": null}
+
+Tracing is disabled when ``common.tracing`` logger is disabled for INFO level. Then no spans are created and
+helpers return their arguments as is.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from uuid import uuid4
+
+__all__ = ['Span', 'current', 'span', 'start_span', 'use', 'traced', 'iter_in', 'wrap']
+_logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent', 'name', 'attrs', 'start', 'duration', 'error')
+
+    def __init__(self, name: str, parent: 'Span' = None, trace_id: str = None, **attrs):
+        """
+        :param name:        span name
+        :param parent:      parent span. Span is a root of a new trace if None
+        :param trace_id:    id of a new trace. Random id is used if None. Ignored if parent is set
+        :param attrs:       span attributes
+        :type name:         str
+        :type parent:       Span
+        :type trace_id:     str
+        """
+        self.trace_id = parent.trace_id if parent else str(trace_id or uuid4().hex)
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        """Set span attributes"""
+        self.attrs.update(attrs)
+
+    def finish(self, error: BaseException = None):
+        """Stop span timer and log the span. Span is logged only once"""
+        if self.duration is not None:
+            return
+        self.duration = time.time() - self.start
+        if error is not None:
+            self.error = f'{error.__class__.__name__}: {error}'
+        _logger.info(f'{self.name} {self.duration * 1000:.1f}ms', extra={'span': self.record()})
+
+    def record(self) -> dict:
+        return {
+            'trace': self.trace_id,
+            'span': self.span_id,
+            'parent': self.parent.span_id if self.parent else None,
+            'name': self.name,
+            'ts': round(self.start, 6),
+            'ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'attrs': self.attrs,
+            'error': self.error,
+        }
+
+
+def _enabled() -> bool:
+    return _logger.isEnabledFor(logging.INFO)
+
+
+def current() -> Span or None:
+    """Current span of the thread"""
+    return getattr(_local, 'span', None)
+
+
+def start_span(name: str, parent: Span = None, trace_id: str = None, **attrs) -> Span or None:
+    """
+    Start span which is not made current. Span should be finished explicitly with :py:meth:`Span.finish`
+
+    :param name:        span name
+    :param parent:      parent span. Current span is used if None
+    :param trace_id:    id of a new trace if there is no parent span
+    :type name:         str
+    :type parent:       Span
+    :type trace_id:     str
+    :rtype:             Span or None
+    :return:            new span or None if tracing is disabled
+    """
+    if not _enabled():
+        return None
+    return Span(name, parent=parent or current(), trace_id=trace_id, **attrs)
+
+
+@contextmanager
+def use(target: Span or None):
+    """Make span current in a block of code. Does nothing if span is None"""
+    if target is None:
+        yield target
+        return
+    previous = current()
+    _local.span = target
+    try:
+        yield target
+    finally:
+        _local.span = previous
+
+
+@contextmanager
+def span(name: str, trace_id: str = None, **attrs):
+    """Run block of code in a new child span of the current span"""
+    new_span = start_span(name, trace_id=trace_id, **attrs)
+    if new_span is None:
+        yield None
+        return
+    with use(new_span):
+        try:
+            yield new_span
+        except BaseException as e:
+            new_span.finish(error=e)
+            raise
+        else:
+            new_span.finish()
+
+
+def _iter_in(target: Span, iterable, finish: bool):
+    iterator = iter(iterable)
+    try:
+        while True:
+            with use(target):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    except BaseException as e:
+        if finish:
+            target.finish(error=e)
+        raise
+    finally:
+        if finish:
+            target.finish()
+
+
+def iter_in(target: Span or None, iterable, finish: bool = False):
+    """
+    Make span current while items are pulled from iterable
+
+    :param target:      span to make current. Iterable is returned as is if None
+    :param iterable:    iterable to pull items from
+    :param finish:      finish span when iterable is exhausted or closed
+    :type target:       Span
+    :type iterable:     Iterable
+    :type finish:       bool
+    """
+    return iterable if target is None else _iter_in(target, iterable, finish)
+
+
+def traced(name: str):
+    """
+    Decorate function returning an iterator (e.g. generator function) to trace iteration in a new span.
+    Span is started on function call and finished when iterator is exhausted or closed.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            new_span = start_span(name)
+            with use(new_span):
+                result = func(*args, **kwargs)
+            return iter_in(new_span, result, finish=True)
+        return wrapper
+    return decorator
+
+
+def wrap(func, target: Span or None):
+    """
+    Wrap function to run it with span as current, e.g. in executor thread. Function is returned as is if span is None
+    """
+    if target is None:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with use(target):
+            return func(*args, **kwargs)
+    return wrapper
@@ -1,11 +1,13 @@
 from django.urls import path, include
 from django.contrib import admin
 from common.reporter import listeners, collectors
-from common import signals
+from auctioneer.main import run_aborted, keyword_bids_failed
+from common import signals, timing, views
 from celery.signals import task_failure, task_postrun
 
 
 urlpatterns = [
+    path('metrics', views.metrics_view, name='metrics'),
     path('', admin.site.urls),
     path('account/', include('common.account.urls'))
 ]
@@ -15,3 +17,9 @@ collectors.set_keyword_bids_params_transceiver.add_signals(signals.params_interc
 collectors.calculate_keyword_bids_task_result_transceiver.add_signals(task_postrun)
 collectors.set_keyword_bids_params_transceiver.add_observers(listeners.kwb_total_listener)
 collectors.calculate_keyword_bids_task_result_transceiver.add_observers(listeners.kwb_calc_result_listener)
+collectors.stage_timings_transceiver.add_signals(timing.stage_timings)
+collectors.stage_timings_transceiver.add_observers(listeners.stage_timings_listener)
+collectors.run_aborted_transceiver.add_signals(run_aborted)
+collectors.run_aborted_transceiver.add_observers(listeners.run_aborted_listener)
+collectors.keyword_bids_failed_transceiver.add_signals(keyword_bids_failed)
+collectors.keyword_bids_failed_transceiver.add_observers(listeners.keyword_bids_failed_listener)
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpRequest, HttpResponse, Http404
+from django.views.decorators.cache import never_cache
+
+from common import metrics
+
+
+@never_cache
+def metrics_view(request: HttpRequest):
+    """
+    Metrics of all application processes in Prometheus text format. Metrics are served to addresses of
+    ``METRICS_ALLOWED_IPS`` and to staff users only, as they are labeled with account logins
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404('Metrics are disabled')
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        raise PermissionDenied
+    # metrics of this process are flushed in background like in other processes
+    metrics.start_flusher()
+    return HttpResponse(metrics.render(metrics.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
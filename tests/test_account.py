@@ -33,3 +33,6 @@ def test_make_yd_gateway_for_account(db):
     gw = account.make_yd_gateway(acc.id)
     assert isinstance(gw, account.YandexDirectGateway)
     assert acc.token == gw.client.auth_data._token
+    assert gw.client._config['response_cache'] is account.get_response_cache()
+    assert gw.client._config['circuit_breaker'] is account.get_circuit_breaker()
+    gw.client.configure(response_cache=None, circuit_breaker=None)
@@ -1,8 +1,17 @@
+import copy
+import os
+import time
+from unittest import mock
+
 import pytest
 import responses
+from django.db import connection
+from django.test import override_settings
 
-from auctioneer import constants, controllers, entities
-from common.http import UnExpectedResult
+from auctioneer import benchmarks, constants, controllers, entities, main, models
+from common import http, timing
+from common.account.models import Account
+from common.http import UnExpectedResult, simulator
 
 
 def test_keywordbid_rule_init(kwb_rule, account):
@@ -57,6 +66,159 @@ def test_get_keyword_bids(yd_gateway, keyword_bids):
         assert type(next(kwb).as_dict()) is dict
 
 
+def test_keyword_bids_filters(yd_gateway, keyword_bids):
+    account = simulator.SimulatedAccount(campaigns=12, ad_groups=1, keywords=10)
+    api = simulator.YdApiSimulator(account)
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        kwb = list(controllers.keyword_bids.get_keyword_bids(yd_gateway, selection_criteria={
+            'CampaignIds': list(account.campaign_ids()), 'ServingStatuses': ['ELIGIBLE']}))
+    finally:
+        yd_gateway.client.configure(transport=None)
+    # campaigns are requested in two chunks, RARELY_SERVED keywords are filtered by API
+    assert api.requests == 2
+    assert len({kw.keyword_id for kw in kwb}) == 108
+    assert {kw.serving_status for kw in kwb} == {'ELIGIBLE'}
+    data = copy.deepcopy(keyword_bids['result']['KeywordBids'])
+    del data[1]['Search']['AuctionBids']
+    filtered = list(controllers.keyword_bids.filter_keyword_bids(data))
+    assert [item['KeywordId'] for item in filtered] == [data[0]['KeywordId']]
+
+
+def test_request_fields(yd_gateway, kwb_rule):
+    fields = controllers.bid_calculator.request_fields()
+    assert fields == {'field_names': ['KeywordId'], 'search_field_names': ['Bid', 'AuctionBids'],
+                      'network_field_names': []}
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=1, keywords=10)
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(simulator.YdApiSimulator(account)))
+    try:
+        kwb = list(controllers.keyword_bids.get_keyword_bids(yd_gateway, selection_criteria={
+            'CampaignIds': list(account.campaign_ids())}, **fields))
+        kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+        calculated = list(controllers.bid_calculator.apply_bid_rule(kwb_ent, iter(kwb), memo=None))
+        assert len(list(controllers.keyword_bids.set_keyword_bids(yd_gateway, calculated))) == 10
+    finally:
+        yd_gateway.client.configure(transport=None)
+    assert all(kw.network is None and kw.campaign_id is None for kw in kwb)
+    assert all(set(kw.search) == {'Bid', 'AuctionBids'} for kw in kwb)
+
+
+def test_chunk_planner(tmpdir, yd_gateway):
+    path = str(tmpdir.join('rule_1.json'))
+    account = simulator.SimulatedAccount(campaigns=3, ad_groups=4, keywords=10)
+    api = simulator.YdApiSimulator(account)
+    criteria = {'CampaignIds': list(account.campaign_ids())}
+    fields = {'field_names': ['KeywordId', 'CampaignId', 'AdGroupId'], 'search_field_names': ['Bid', 'AuctionBids']}
+    planner = controllers.chunk_planner.KeywordChunkPlanner(path, chunk_size=50)
+    assert planner.plan(criteria) is None
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        planner.refresh(yd_gateway, criteria)
+        assert len(planner.ad_groups) == 12
+        assert planner.plan(criteria) == [criteria]
+        kwb = list(controllers.keyword_bids.get_keyword_bids(yd_gateway, chunk_planner=planner,
+                                                             selection_criteria=criteria, **fields))
+        assert len(kwb) == 120
+        planner.save()
+        planner = controllers.chunk_planner.KeywordChunkPlanner(path, chunk_size=50)
+        assert set(count for _, count in planner.ad_groups.values()) == {10}
+        assert planner.plan(criteria) == [{'CampaignIds': [campaign_id]} for campaign_id in criteria['CampaignIds']]
+        # campaigns larger than chunk are split to ad groups once their ad groups are read
+        planner.chunk_size = 30
+        assert planner.plan(criteria) == [{'CampaignIds': [campaign_id]} for campaign_id in criteria['CampaignIds']]
+        planner.refresh(yd_gateway, criteria)
+        chunks = planner.plan(criteria)
+        assert [len(chunk['AdGroupIds']) for chunk in chunks] == [3, 3, 3, 3]
+        requests = api.requests
+        kwb = list(controllers.keyword_bids.get_keyword_bids(yd_gateway, chunk_planner=planner,
+                                                             selection_criteria=criteria, **fields))
+        assert len({kw.keyword_id for kw in kwb}) == 120
+        assert api.requests - requests == 4
+        planner.save()
+        # ad groups added to split campaigns are requested on the next run
+        account.ad_groups = 5
+        planner = controllers.chunk_planner.KeywordChunkPlanner(path, chunk_size=30)
+        planner.refresh(yd_gateway, criteria)
+        assert set(planner.ad_groups) == {ad_group_id for campaign_id in criteria['CampaignIds']
+                                          for ad_group_id in account.ad_group_ids(campaign_id)}
+        kwb = list(controllers.keyword_bids.get_keyword_bids(yd_gateway, chunk_planner=planner,
+                                                             selection_criteria=criteria, **fields))
+        assert len({kw.keyword_id for kw in kwb}) == 150
+        # campaigns are requested as a whole if their ad groups can't be read
+        planner = controllers.chunk_planner.KeywordChunkPlanner(path, chunk_size=30)
+        with mock.patch.object(yd_gateway, 'get_ad_groups', side_effect=http.UnExpectedResult('error')):
+            planner.refresh(yd_gateway, criteria)
+        assert planner.plan(criteria) == [{'CampaignIds': [campaign_id]} for campaign_id in criteria['CampaignIds']]
+    finally:
+        yd_gateway.client.configure(transport=None)
+
+
+def test_sync_reference_data(tmpdir, yd_gateway, account):
+    sim_account = simulator.SimulatedAccount(campaigns=3, ad_groups=4, keywords=10)
+    api = simulator.YdApiSimulator(sim_account)
+    campaign_ids = list(sim_account.campaign_ids())
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        stats = controllers.reference_data.sync_reference_data(yd_gateway, account.id)
+        assert stats == {'full': True, 'campaigns': 3, 'ad_groups': 12, 'ads': 12, 'sitelinks_sets': 3}
+        assert models.YdAd.objects.filter(sitelink_set_id__isnull=False).count() == 12
+        ad_groups = controllers.reference_data.campaign_ad_groups(account.id, campaign_ids)
+        assert ad_groups[campaign_ids[0]] == list(sim_account.ad_group_ids(campaign_ids[0]))
+        # nothing changed
+        stats = controllers.reference_data.sync_reference_data(yd_gateway, account.id)
+        assert stats == {'full': False, 'campaigns': 0, 'ad_groups': 0, 'ads': 0, 'sitelinks_sets': 0}
+        ad_group_id = sim_account.ad_group_ids(campaign_ids[1])[0]
+        sim_account.rename_campaign(campaign_ids[0], 'Renamed')
+        sim_account.change_ad_group(ad_group_id, 'Changed')
+        requests = api.requests
+        stats = controllers.reference_data.sync_reference_data(yd_gateway, account.id)
+        assert stats == {'full': False, 'campaigns': 1, 'ad_groups': 1, 'ads': 1, 'sitelinks_sets': 0}
+        assert api.requests - requests == 5
+        assert models.YdCampaign.objects.get(id=campaign_ids[0]).name == 'Renamed'
+        assert models.YdAdGroup.objects.get(id=ad_group_id).name == 'Changed'
+        # API is requested before sync transaction is opened
+        savepoints, handle, open_requests = len(connection.savepoint_ids), api.handle, []
+
+        def check_transaction(*args, **kwargs):
+            open_requests.append(len(connection.savepoint_ids) > savepoints)
+            return handle(*args, **kwargs)
+        models.YdSyncState.objects.all().delete()
+        with mock.patch.object(api, 'handle', side_effect=check_transaction):
+            controllers.reference_data.sync_reference_data(yd_gateway, account.id)
+            sim_account.rename_campaign(campaign_ids[2], 'Renamed')
+            sim_account.change_ad_group(sim_account.ad_group_ids(campaign_ids[2])[0], 'Changed')
+            assert controllers.reference_data.sync_reference_data(yd_gateway, account.id)['ad_groups'] == 1
+        assert open_requests and not any(open_requests)
+        # planner reads ad groups from local copy instead of requesting ads
+        planner = controllers.chunk_planner.KeywordChunkPlanner(str(tmpdir.join('rule_1.json')))
+        requests = api.requests
+        planner.refresh(yd_gateway, {'CampaignIds': campaign_ids}, account.id)
+        assert len(planner.ad_groups) == 12
+        assert api.requests == requests
+        # split campaigns read ad groups from local copy synced after the previous run
+        path = str(tmpdir.join('rule_2.json'))
+        planner = controllers.chunk_planner.KeywordChunkPlanner(path, chunk_size=30)
+        planner.ad_groups = {ad_group_id: (campaign_id, 10) for campaign_id in campaign_ids
+                             for ad_group_id in sim_account.ad_group_ids(campaign_id)}
+        planner.save()
+        os.utime(path, (time.time() - 60, time.time() - 60))
+        planner = controllers.chunk_planner.KeywordChunkPlanner(path, chunk_size=30)
+        planner.refresh(yd_gateway, {'CampaignIds': campaign_ids}, account.id)
+        assert [len(chunk['AdGroupIds']) for chunk in planner.plan({'CampaignIds': campaign_ids})] == [3, 3, 3, 3]
+        assert api.requests == requests
+        # ad groups added after the last sync are read from YD API
+        os.utime(path)
+        sim_account.ad_groups = 5
+        planner = controllers.chunk_planner.KeywordChunkPlanner(path, chunk_size=30)
+        planner.refresh(yd_gateway, {'CampaignIds': campaign_ids}, account.id)
+        assert api.requests > requests
+        assert set(planner.ad_groups) == {ad_group_id for campaign_id in campaign_ids
+                                          for ad_group_id in sim_account.ad_group_ids(campaign_id)}
+        assert sum(len(chunk['AdGroupIds']) for chunk in planner.plan({'CampaignIds': campaign_ids})) == 15
+    finally:
+        yd_gateway.client.configure(transport=None)
+
+
 def test_set_keyword_bids(yd_gateway, keyword_bids, keyword_bids_w_warnings):
     url = f'{yd_gateway.get_api_url()}/{yd_gateway.endpoints.KEYWORD_BIDS}'
     kwb = controllers.keyword_bids.map_keyword_bids(keyword_bids['result']['KeywordBids'])
@@ -80,3 +242,321 @@ def test_calculate_keyword_bids(yd_gateway, kwb_rule, keyword_bids, keyword_bids
             controllers.keyword_bids.calculate_keyword_bids(yd_gateway, kwb_ent,
                                                             selection_criteria={"CampaignIds": []})
 
+
+
+def test_run_checkpoint(tmpdir, yd_gateway, kwb_rule):
+    path = str(tmpdir.join('run'))
+    account = simulator.SimulatedAccount(campaigns=2, ad_groups=2, keywords=15)
+    api = simulator.YdApiSimulator(account, page_limit=10)
+    criteria = {'CampaignIds': list(account.campaign_ids())}
+    kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        # the first attempt fails while the third page is processed
+        checkpoint = controllers.checkpoint.RunCheckpoint(path)
+        kwb = controllers.keyword_bids.get_keyword_bids(yd_gateway, checkpoint=checkpoint, selection_criteria=criteria)
+        received = [kw.keyword_id for _, kw in zip(range(25), kwb)]
+        kwb.close()
+        checkpoint.close()
+        checkpoint = controllers.checkpoint.RunCheckpoint(path)
+        assert checkpoint.resumed and checkpoint.resume_offset(criteria) == 20
+        requests = api.requests
+        kwb = list(controllers.keyword_bids.get_keyword_bids(yd_gateway, checkpoint=checkpoint,
+                                                             selection_criteria=criteria))
+        assert [kw.keyword_id for kw in kwb[:20]] == received[:20]
+        assert len({kw.keyword_id for kw in kwb}) == len(kwb) == 60
+        assert api.requests - requests == 4
+        # half of keyword bids was set before the second attempt failed, one keyword bid failed
+        list(checkpoint.record({'KeywordId': kw.keyword_id} for kw in kwb[:30]))
+        list(checkpoint.record([{'KeywordId': kwb[30].keyword_id, 'Errors': [{'Code': 1000}]}]))
+        checkpoint.close()
+        checkpoint = controllers.checkpoint.RunCheckpoint(path)
+        requests = api.requests
+        with mock.patch.object(yd_gateway, 'set_keyword_bids', wraps=yd_gateway.set_keyword_bids) as set_bids:
+            response = controllers.keyword_bids.calculate_keyword_bids(yd_gateway, kwb_ent, checkpoint=checkpoint,
+                                                                       selection_criteria=criteria)
+        assert api.requests - requests == 1
+        assert len(set_bids.call_args[0][0]) == 30 and checkpoint.skipped == 30
+        assert kwb[30].keyword_id in {item['KeywordId'] for item in set_bids.call_args[0][0]}
+        assert {result['KeywordId'] for result in response} == {kw.keyword_id for kw in kwb}
+        assert len(response) == 60 and not any(result.get('Errors') for result in response)
+        checkpoint.clear()
+        assert not controllers.checkpoint.RunCheckpoint(path).resumed
+        # checkpoint is not resumed after max age, e.g. run time budget
+        with override_settings(KEYWORD_BID_CHECKPOINT_DIR=str(tmpdir)):
+            checkpoint = controllers.checkpoint.RunCheckpoint.for_run(1, 'late')
+            checkpoint.plan(None)
+            list(checkpoint.record([{'KeywordId': 1}]))
+            checkpoint.close()
+            assert controllers.checkpoint.RunCheckpoint.for_run(1, 'late', max_age=60).resumed
+            plan_path = os.path.join(checkpoint.path, controllers.checkpoint.PLAN)
+            os.utime(plan_path, (time.time() - 61, time.time() - 61))
+            assert not controllers.checkpoint.RunCheckpoint.for_run(1, 'late', max_age=60).resumed
+    finally:
+        yd_gateway.client.configure(transport=None)
+
+
+def test_resubmit_failed_keyword_bids(yd_gateway, kwb_rule):
+    account = simulator.SimulatedAccount(campaigns=2, ad_groups=2, keywords=15)
+    api = simulator.YdApiSimulator(account, item_errors={1000: 0.3, 6000: 0.05}, seed=1)
+    criteria = {'CampaignIds': list(account.campaign_ids())}
+    kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+    failed = controllers.resubmit.FailedKeywordBids(error_codes=(1000,), attempts=10, batch_size=7, backoff=0,
+                                                    max_ids=2)
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        response = controllers.keyword_bids.calculate_keyword_bids(yd_gateway, kwb_ent, failed=failed,
+                                                                   selection_criteria=criteria)
+    finally:
+        yd_gateway.client.configure(transport=None)
+    assert len({result['KeywordId'] for result in response}) == len(response) == 60
+    codes = {error['Code'] for result in response for error in result.get('Errors', ())}
+    assert codes == {6000}
+    report = failed.report()
+    assert report['resubmitted'] > report['recovered'] > 0
+    assert list(report['errors']) == ['6000'] and len(report['errors']['6000']['keyword_ids']) <= 2
+    assert report['errors']['6000']['count'] == sum(1 for result in response if result.get('Errors'))
+    # only failures are collected without attempts
+    failed = controllers.resubmit.FailedKeywordBids(attempts=0)
+    results = [{'KeywordId': 1}, {'KeywordId': 2, 'Errors': [{'Code': 1000}]}]
+    assert list(failed.watch(yd_gateway, [], iter(results))) == results
+    assert failed.report() == {'resubmitted': 0, 'recovered': 0,
+                               'errors': {'1000': {'count': 1, 'keyword_ids': [2]}}}
+
+
+def test_auction_snapshot(tmpdir, yd_gateway, kwb_rule):
+    path = str(tmpdir.join('account.sqlite3'))
+    account = simulator.SimulatedAccount(campaigns=2, ad_groups=2, keywords=15)
+    api = simulator.YdApiSimulator(account, page_limit=10)
+    campaign_ids = list(account.campaign_ids())
+    kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+    store = controllers.auction_snapshot.AuctionSnapshotStore(path, max_age=60)
+    params = controllers.bid_calculator.request_fields((*controllers.bid_calculator.BID_CALCULATION_FORMULAS, store))
+    params['selection_criteria'] = {'CampaignIds': campaign_ids}
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        with mock.patch.object(yd_gateway, 'set_keyword_bids', wraps=yd_gateway.set_keyword_bids) as set_bids:
+            controllers.keyword_bids.calculate_keyword_bids(yd_gateway, kwb_ent, snapshot=store, **params)
+        sent = {item['KeywordId']: item['SearchBid'] for item in set_bids.call_args[0][0]}
+        store.close()
+        assert store.misses == 2 and sent
+        # another rule of the account reads keyword bids fetched by the first one
+        requests = api.requests
+        store = controllers.auction_snapshot.AuctionSnapshotStore(path, max_age=60)
+        kwb = list(controllers.keyword_bids.get_keyword_bids(yd_gateway, filters=None, snapshot=store, **params))
+        assert api.requests == requests and store.hits == 2 and store.misses == 0
+        assert len({kw.keyword_id for kw in kwb}) == len(kwb) == 60
+        # bids which were set are updated in snapshot
+        assert all(kw.search['Bid'] == sent[kw.keyword_id] for kw in kwb if kw.keyword_id in sent)
+        # stored keyword bids are exported to a columnar batch
+        assert store.export(params['selection_criteria'], params, str(tmpdir.join('batch.kwb'))) == 60
+        store.close()
+        # stale targets are requested again
+        store = controllers.auction_snapshot.AuctionSnapshotStore(path, max_age=0)
+        kwb = list(controllers.keyword_bids.get_keyword_bids(yd_gateway, filters=None, snapshot=store,
+                                                             **{**params, 'selection_criteria': {
+                                                                 'CampaignIds': campaign_ids[:1]}}))
+        assert api.requests > requests and store.misses == 1 and len(kwb) == 30
+        store.close()
+    finally:
+        yd_gateway.client.configure(transport=None)
+
+
+def test_columnar_batch(tmpdir):
+    path = str(tmpdir.join('batch.kwb'))
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=2, keywords=10)
+    ad_group_id = account.ad_group_ids(next(iter(account.campaign_ids())))[0]
+    data = [account.keyword_bid(keyword_id) for keyword_id in account.keyword_ids(ad_group_id)]
+    for item in data:
+        del item['Network']
+    data[0]['Search'] = {'Bid': 1000}
+    del data[1]['Search'], data[1]['ServingStatus']
+    assert controllers.columnar.write_batch(path, data) == len(data) == 10
+    with controllers.columnar.KeywordBidBatch(path) as batch:
+        assert list(batch.items()) == data
+        assert list(batch.columns['keyword_id']) == [item['KeywordId'] for item in data]
+        assert len(batch.columns['auction_bid']) == batch.ladder_width * len(batch)
+        assert list(controllers.keyword_bids.map_keyword_bids(batch)) == \
+            list(controllers.keyword_bids.map_keyword_bids(copy.deepcopy(data)))
+    with pytest.raises(ValueError):
+        controllers.columnar.KeywordBidBatch(__file__)
+
+
+def test_what_if_simulation(tmpdir, yd_gateway, kwb_rule, admin_client):
+    account = simulator.SimulatedAccount(campaigns=2, ad_groups=2, keywords=15)
+    api = simulator.YdApiSimulator(account)
+    kwb_rule.target_values = list(account.campaign_ids())
+    kwb_rule.save()
+    kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        with override_settings(KEYWORD_BID_SNAPSHOT_DIR=str(tmpdir)):
+            assert controllers.what_if.simulate_rule(kwb_rule, [kwb_rule]) is None
+            store = controllers.auction_snapshot.AuctionSnapshotStore.for_account(kwb_ent.account)
+            params = controllers.bid_calculator.request_fields(
+                (*controllers.bid_calculator.BID_CALCULATION_FORMULAS, store))
+            params['selection_criteria'] = {kwb_ent.target_type: kwb_ent.target_values}
+            list(controllers.keyword_bids.get_keyword_bids(yd_gateway, snapshot=store, **params))
+            store.close()
+            variants = controllers.what_if.rule_variants(kwb_rule, target_bid_diffs=[5, 10], max_bids=[10, 1000])
+            results = controllers.what_if.simulate_rule(kwb_rule, variants)
+            # simulated bids match bids calculated by formulas
+            with controllers.columnar.KeywordBidBatch(str(tmpdir.join(f'rule_{kwb_rule.id}.kwb'))) as batch:
+                for variant, result in zip(variants, results):
+                    current = {kw.keyword_id: kw.search['Bid'] for kw in batch.keyword_bids()}
+                    calculated = sorted(controllers.bid_calculator.apply_bid_rule(
+                        controllers.keyword_bid_rule.map_keyword_bid_rule(variant), batch.keyword_bids(), memo=None),
+                        key=lambda kw: kw.search['Bid'])
+                    assert result['keywords'] == len(calculated) == 60
+                    assert result['changed'] == sum(kw.search['Bid'] != current[kw.keyword_id] for kw in calculated)
+                    assert result['bids']['min'] == calculated[0].search['Bid']
+                    assert result['bids']['max'] == calculated[-1].search['Bid']
+            assert [(r['target_bid_diff'], r['max_bid']) for r in results] == [(5, 10), (5, 1000), (10, 10), (10, 1000)]
+            assert results[0]['spend_delta'] < results[1]['spend_delta']
+            url = f'/auctioneer/keywordbidrule/{kwb_rule.id}/what-if/'
+            response = admin_client.get(url, {'target_bid_diff': '5,10', 'max_bid': '10'})
+            assert response.status_code == 200 and response.content.count(b'<tr>') == 3
+            assert admin_client.get(url, {'max_bid': 'x'}).status_code == 400
+            # keyword bids of rule serving statuses are simulated
+            kwb_rule.serving_statuses = ['ELIGIBLE']
+            kwb_rule.save()
+            with controllers.columnar.KeywordBidBatch(controllers.what_if.snapshot_batch(kwb_rule, max_age=0)) as batch:
+                statuses = [item['ServingStatus'] for item in batch.items()]
+            assert 0 < len(statuses) < 60 and set(statuses) == {'ELIGIBLE'}
+            assert controllers.what_if.simulate_rule(kwb_rule, [kwb_rule])[0]['keywords'] == len(statuses)
+    finally:
+        yd_gateway.client.configure(transport=None)
+    with pytest.raises(ValueError):
+        controllers.what_if.rule_variants(kwb_rule, max_bids=list(range(controllers.what_if.MAX_VARIANTS + 1)))
+
+
+def test_keyword_bid_history(transactional_db, kwb_rule, keyword_bids):
+    kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+    kwb = controllers.keyword_bids.map_keyword_bids(keyword_bids['result']['KeywordBids'])
+    with controllers.bid_history.KeywordBidHistoryWriter('test_run', batch_size=1) as history:
+        calculated = history.record(controllers.bid_calculator.apply_bid_rule(kwb_ent, history.watch(kwb)))
+        calculated = list(calculated)
+    changes = models.KeywordBidChange.objects.filter(run_id='test_run')
+    assert changes.exists()
+    assert history.written == changes.count()
+    for change in changes:
+        kw_bid = next(kw for kw in calculated if kw.keyword_id == change.keyword_id)
+        assert change.new_bid == kw_bid.search['Bid']
+        assert change.old_bid != change.new_bid
+    assert controllers.bid_history.purge_keyword_bid_history(retention_days=1) == 0
+
+
+def test_keyword_bid_fingerprints(tmpdir, kwb_rule, keyword_bids):
+    kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+    path = str(tmpdir.join('rule.fp'))
+    data = keyword_bids['result']['KeywordBids']
+    store = controllers.fingerprints.KeywordBidFingerprints(path, kwb_ent)
+    kwb = store.changed(controllers.keyword_bids.map_keyword_bids(copy.deepcopy(data)))
+    calculated = list(store.record(controllers.bid_calculator.apply_bid_rule(kwb_ent, kwb)))
+    assert len(calculated) == store.changed_count == 2
+    store.save()
+    # YD API returns bids that were set on the previous run
+    for item, kw_bid in zip(data, calculated):
+        item['Search']['Bid'] = kw_bid.search['Bid']
+    store = controllers.fingerprints.KeywordBidFingerprints(path, kwb_ent)
+    assert len(store) == 2
+    assert not list(store.changed(controllers.keyword_bids.map_keyword_bids(copy.deepcopy(data))))
+    assert store.skipped == 2
+    # auction changed
+    data[0]['Search']['AuctionBids']['AuctionBidItems'][0]['Bid'] += 1
+    store = controllers.fingerprints.KeywordBidFingerprints(path, kwb_ent)
+    changed = list(store.changed(controllers.keyword_bids.map_keyword_bids(copy.deepcopy(data))))
+    assert [kw_bid.keyword_id for kw_bid in changed] == [data[0]['KeywordId']]
+    # rule changed
+    store = controllers.fingerprints.KeywordBidFingerprints(path, kwb_ent._replace(max_bid=1))
+    assert len(store) == 0
+
+
+def test_apply_bid_rule_memo(kwb_rule, keyword_bids):
+    kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+    data = keyword_bids['result']['KeywordBids']
+    expected = list(controllers.bid_calculator.apply_bid_rule(
+        kwb_ent, controllers.keyword_bids.map_keyword_bids(copy.deepcopy(data)), memo=None))
+    memo = controllers.bid_calculator.BidMemo(maxsize=2)
+    for _ in range(2):
+        calculated = list(controllers.bid_calculator.apply_bid_rule(
+            kwb_ent, controllers.keyword_bids.map_keyword_bids(copy.deepcopy(data) + copy.deepcopy(data)), memo=memo))
+        assert [kw.search['Bid'] for kw in calculated] == [kw.search['Bid'] for kw in expected * 2]
+    assert memo.info() == {'hits': 6, 'misses': 2, 'size': 2, 'maxsize': 2}
+
+
+def test_benchmarks():
+    # full cycle runs read keyword bids from replayed API, not from auction snapshot
+    with mock.patch.object(controllers.auction_snapshot.AuctionSnapshotStore, 'for_account') as for_account:
+        results = benchmarks.run_benchmarks(sizes=[100], repeat=1)
+    assert not for_account.called
+    assert [r['case'] for r in results['results']] == list(benchmarks.BENCHMARKS)
+    assert all(r['size'] == 100 and len(r['times']) == 1 for r in results['results'])
+    baseline = copy.deepcopy(results)
+    for r in baseline['results']:
+        r['min'] = r['min'] / 10 if r['case'] == 'main_run' else r['min'] * 10
+    comparison = benchmarks.compare(results, baseline)
+    assert len(comparison) == len(benchmarks.BENCHMARKS)
+    assert [c['case'] for c in comparison if c['regression']] == ['main_run']
+
+
+def test_stage_timings(yd_gateway, kwb_rule, keyword_bids, keyword_bids_w_warnings):
+    url = f'{yd_gateway.get_api_url()}/{yd_gateway.endpoints.KEYWORD_BIDS}'
+    kwb_ent = controllers.keyword_bid_rule.map_keyword_bid_rule(kwb_rule)
+    received = []
+    timing.stage_timings.connect(lambda sender, timings, **kwargs: received.append(timings), weak=False,
+                                 dispatch_uid='test_stage_timings')
+    timer = timing.StageTimer()
+    try:
+        with responses.RequestsMock() as mock:
+            mock.add(method='POST', url=url, status=200, json=keyword_bids)
+            mock.add(method='POST', url=url, status=200, json=keyword_bids_w_warnings)
+            timer.start()
+            try:
+                controllers.keyword_bids.calculate_keyword_bids(yd_gateway, kwb_ent,
+                                                                selection_criteria={"CampaignIds": []})
+            finally:
+                timer.stop()
+    finally:
+        timing.stage_timings.disconnect(dispatch_uid='test_stage_timings')
+    report = timer.report()
+    assert received == [report]
+    kw_count = len(keyword_bids['result']['KeywordBids'])
+    assert {name: stage['items'] for name, stage in report['stages'].items()} == {
+        'fetch': kw_count, 'decode': 2, 'filter': kw_count, 'map': kw_count, 'calculate': kw_count, 'serialize': kw_count, 'set': 1514}
+    assert sum(stage['seconds'] for stage in report['stages'].values()) <= report['total']
+    assert report['bytes']['sent'] > 0 and report['bytes']['received'] > 0
+    # inactive timer is not charged
+    list(controllers.keyword_bids.map_keyword_bids(keyword_bids['result']['KeywordBids']))
+    assert timer.report() == report
+
+
+def test_run_deadline(yd_gateway):
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=1, keywords=20)
+    api = simulator.YdApiSimulator(account, page_limit=5, latency='fixed:0.2')
+    rule = models.KeywordBidRule(id=0, title='deadline', account=Account(id=0), target_type=1,
+                                 target_values=list(account.campaign_ids()), target_bid_diff=10,
+                                 bid_increase_percentage=10, max_bid=100)
+    aborted = []
+    main.run_aborted.connect(lambda sender, **kwargs: aborted.append(kwargs), weak=False,
+                             dispatch_uid='test_run_deadline')
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        with override_settings(KEYWORD_BID_HISTORY_ENABLED=False, KEYWORD_BID_FINGERPRINTS_ENABLED=False,
+                               KEYWORD_BID_CHUNK_PLANNER_ENABLED=False, KEYWORD_BID_CHECKPOINT_ENABLED=False,
+                               KEYWORD_BID_SNAPSHOT_ENABLED=False, YD_TRAFFIC_RECORD_DIR=None), \
+                mock.patch.object(main.controllers.keyword_bid_rule, 'get_keywordbid_rule', return_value=rule), \
+                mock.patch.object(main.account, 'make_yd_gateway', return_value=yd_gateway):
+            assert main.run(rule.id, time_budget=0.3) == []
+            assert api.requests == 2
+            assert aborted[0]['sent'] == 0 and aborted[0]['reason']
+            assert len(main.run(rule.id, time_budget=5)) == 20
+    finally:
+        yd_gateway.client.configure(transport=None)
+        main.run_aborted.disconnect(dispatch_uid='test_run_deadline')
+    # deadline caps request timeouts
+    with http.deadline.use(http.Deadline(2)):
+        assert http.deadline.current().timeout(5, 15)[1] <= 2
+        with http.deadline.use(http.Deadline(10)):
+            assert http.deadline.current().remaining() <= 2
+    assert http.deadline.current() is None
@@ -1,11 +1,21 @@
+import io
 import json
+import logging
+import os
+import threading
 import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
 import pytest
 import requests
 import responses
 
-from common.http import exceptions
+from common import logger as log, tracing
+from common.http import client, deadline, exceptions, replay, simulator
+from common.http import cache as cache_module
+from common.http.breaker import CircuitBreaker
+from common.http.cache import ResponseCache
 
 from common.http.oauth import YandexDirectAuth
 
@@ -287,3 +297,325 @@ def test_get_oauth_token(oauth_gateway):
         assert token == "AQAAAAAvQzzuAARfvaWKigBvLE1ljgH0XBHIuIA"
         with pytest.raises(exceptions.UnExpectedResult):
             oauth_gateway.get_oauth_token(url='http://auth.url')
+
+
+def test_record_replay(tmpdir, yd_gateway, keyword_bids):
+    url = f'{yd_gateway.get_api_url()}/{yd_gateway.endpoints.KEYWORD_BIDS}'
+    path = str(tmpdir.join('traffic.jsonl.gz'))
+    recorder = replay.HttpRecorder(path)
+    yd_gateway.client.configure(recorder=recorder)
+    try:
+        with responses.RequestsMock() as mock:
+            mock.add(method=mock.POST, url=url, status=200, json=keyword_bids)
+            recorded = list(yd_gateway.keyword_bids_gen(selection_criteria={"CampaignIds": [1]}))
+    finally:
+        yd_gateway.client.configure(recorder=None)
+        recorder.close()
+    assert recorder.recorded == 1
+    yd_gateway.client.configure(transport=replay.ReplayAdapter(path, latency=0))
+    try:
+        assert list(yd_gateway.keyword_bids_gen(selection_criteria={"CampaignIds": [1]})) == recorded
+        assert list(yd_gateway.keyword_bids_gen(selection_criteria={"CampaignIds": [1]})) == recorded
+        with pytest.raises(requests.ConnectionError):
+            list(yd_gateway.keyword_bids_gen(selection_criteria={"CampaignIds": [2]}))
+    finally:
+        yd_gateway.client.configure(transport=None)
+
+
+def test_yd_simulator(yd_gateway):
+    account = simulator.SimulatedAccount(campaigns=2, ad_groups=2, keywords=4, login='sim')
+    api = simulator.YdApiSimulator(account, page_limit=3, units_limit=100)
+    server = simulator.make_server(api, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yd_gateway.default_api_url = f'http://localhost:{server.server_address[1]}'
+    try:
+        campaign_id = next(iter(account.campaign_ids()))
+        kw_bids = list(yd_gateway.keyword_bids_gen(selection_criteria={'CampaignIds': [campaign_id]}))
+        assert len(kw_bids) == 8
+        assert api.requests == 3
+        assert all(kw['CampaignId'] == campaign_id for kw in kw_bids)
+        results = list(yd_gateway.set_keyword_bids([{'KeywordId': kw_bids[0]['KeywordId'], 'SearchBid': 1},
+                                                    {'KeywordId': 1, 'SearchBid': 1}]))
+        assert results[0] == {'KeywordId': kw_bids[0]['KeywordId']}
+        assert results[1]['Errors'][0]['Code'] == 8800
+        assert account.keyword_bid(kw_bids[0]['KeywordId'])['Search']['Bid'] == 1
+        assert yd_gateway.get_client_login() == 'sim'
+        data, headers = api.handle('keywordbids', b'{"method": "get", "params": {}}')
+        assert data['error']['error_code'] == 8000
+        api.units_spent = api.units_limit
+        data, _ = api.handle('clients', b'{"method": "get", "params": {}}')
+        assert data['error']['error_code'] == 152
+    finally:
+        del yd_gateway.default_api_url
+        server.shutdown()
+        server.server_close()
+
+
+def test_tracing_spans(yd_gateway):
+    records = []
+    handler = logging.Handler()
+    handler.emit = lambda record: records.append(record.span)
+    logger = logging.getLogger('common.tracing')
+    logger.addHandler(handler)
+    account = simulator.SimulatedAccount(campaigns=10, ad_groups=1, keywords=4)
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(simulator.YdApiSimulator(account, page_limit=30)))
+    try:
+        with tracing.span('task', trace_id='task_id'):
+            kw_bids = list(yd_gateway.keyword_bids_gen(selection_criteria={'CampaignIds': list(account.campaign_ids())}))
+            list(yd_gateway.set_keyword_bids([{'KeywordId': kw['KeywordId'], 'SearchBid': 1} for kw in kw_bids]))
+    finally:
+        yd_gateway.client.configure(transport=None)
+        logger.removeHandler(handler)
+    assert len(kw_bids) == 40
+    assert {span['trace'] for span in records} == {'task_id'}
+    spans = {span['span']: span for span in records}
+    by_name = {}
+    for span in records:
+        by_name.setdefault(span['name'], []).append(span)
+
+    def parent(span):
+        return spans[span['parent']]['name']
+    assert [parent(span) for span in by_name['fetch']] == ['task']
+    assert [(span['attrs']['size'], parent(span)) for span in by_name['chunk']] == [(10, 'fetch')]
+    # 40 keywords of the chunk are paginated by 30
+    assert sorted(span['attrs']['offset'] for span in by_name['page']) == [0, 30]
+    assert all(parent(span) == 'chunk' for span in by_name['page'])
+    assert len(by_name['request']) == 3
+    assert all(parent(span) in ('page', 'set_chunk') for span in by_name['request'])
+    assert [parent(span) for span in by_name['set_chunk']] == ['set']
+    assert by_name['set_chunk'][0]['attrs']['size'] == 40
+    assert all(span['ms'] is not None and span['error'] is None for span in records)
+
+
+def test_wire_log(yd_gateway):
+    stream = io.StringIO()
+    handler = log.QueueStreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger = logging.getLogger('common.http.client')
+    logger.addHandler(handler)
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=1, keywords=100)
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(simulator.YdApiSimulator(account)),
+                                wire_log_max_bytes=100)
+    try:
+        assert len(list(yd_gateway.keyword_bids_gen(selection_criteria={'CampaignIds': [10_000_000]}))) == 100
+        handler.flush()
+        wire_log = stream.getvalue()
+        assert '[REQUEST]' in wire_log and '[RESPONSE]' in wire_log
+        assert 'bytes total)' in wire_log
+        assert len(wire_log) < 2000
+        yd_gateway.client.configure(wire_log_sample_rate=0)
+        list(yd_gateway.keyword_bids_gen(selection_criteria={'CampaignIds': [10_000_000]}))
+        handler.flush()
+        assert stream.getvalue() == wire_log
+    finally:
+        yd_gateway.client.configure(transport=None, wire_log_max_bytes=2048, wire_log_sample_rate=1.0)
+        logger.removeHandler(handler)
+        handler.close()
+    assert str(log.Truncated(b'abcdef', 3)) == "b'abc'... (6 bytes total)"
+    assert str(log.Truncated(None, 3)) == 'None'
+
+
+def test_response_cache(tmpdir, yd_gateway):
+    account = simulator.SimulatedAccount(campaigns=3, ad_groups=2, keywords=2)
+    api = simulator.YdApiSimulator(account)
+    path = str(tmpdir.join('cache'))
+    ttl = {'campaigns': 60, 'clients': 60}
+    cache = ResponseCache(ttl=ttl, path=path)
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api), response_cache=cache)
+    try:
+        campaigns = list(yd_gateway.get_campaigns(selection_criteria={}))
+        assert len(campaigns) == 3
+        assert list(yd_gateway.get_campaigns(selection_criteria={})) == campaigns
+        assert api.requests == 1
+        assert cache.info()['hits'] == 1
+        # keyword bids are not cached
+        list(yd_gateway.keyword_bids_gen(selection_criteria={'CampaignIds': [campaigns[0]['Id']]}))
+        list(yd_gateway.keyword_bids_gen(selection_criteria={'CampaignIds': [campaigns[0]['Id']]}))
+        assert api.requests == 3
+        # errors are not cached
+        api.units_spent = api.units_limit
+        with pytest.raises(exceptions.UnExpectedResult):
+            yd_gateway.get_client_login()
+        api.units_spent = 0
+        assert yd_gateway.get_client_login() == account.login
+        requests_sent = api.requests
+        # responses on disk are shared with caches of other processes
+        yd_gateway.client.configure(response_cache=ResponseCache(ttl=ttl, path=path))
+        assert list(yd_gateway.get_campaigns(selection_criteria={})) == campaigns
+        assert yd_gateway.get_client_login() == account.login
+        assert api.requests == requests_sent
+        # other account
+        yd_gateway.client.set_auth_data(token='other_token')
+        list(yd_gateway.get_campaigns(selection_criteria={}))
+        assert api.requests == requests_sent + 1
+        with cache_module.bypass():
+            list(yd_gateway.get_campaigns(selection_criteria={}))
+        assert api.requests == requests_sent + 2
+    finally:
+        yd_gateway.client.configure(transport=None, response_cache=None)
+
+
+def test_response_cache_eviction():
+    cache = ResponseCache(ttl={'campaigns': 60, 'ads': -1}, max_bytes=10)
+    cache.set('a', 'campaigns', b'12345')
+    cache.set('b', 'campaigns', b'12345')
+    assert cache.get('a') == b'12345'
+    cache.set('c', 'campaigns', b'12345')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'12345'
+    cache.set('d', 'ads', b'1')
+    assert cache.get('d') is None
+    assert cache.info()['size'] <= 10
+
+
+def test_response_cache_prune(tmpdir):
+    path = str(tmpdir.join('cache'))
+    cache = ResponseCache(ttl={'campaigns': 60, 'ads': 120, 'clients': -1}, path=path, max_disk_bytes=25)
+    cache.set('a', 'clients', b'12345')
+    assert os.listdir(path) == []   # expired file is removed by prune on the first write
+    cache.set('b', 'clients', b'12345')
+    cache.set('c', 'campaigns', b'12345')
+    cache.set('d', 'ads', b'12345')
+    tmpdir.join('cache', 'e.1.1.tmp').write('')
+    assert sorted(os.listdir(path)) == ['b', 'c', 'd', 'e.1.1.tmp']
+    os.utime(os.path.join(path, 'e.1.1.tmp'), (time.time() - 120, time.time() - 120))
+    # expired and temporary files are removed, then ones closest to expiry until files fit max size
+    assert cache.prune() == 3
+    assert os.listdir(path) == ['d']
+    assert ResponseCache(ttl={}, path=path).get('d') == b'12345'
+
+
+def test_single_flight(yd_gateway):
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=1, keywords=2)
+    api = simulator.YdApiSimulator(account, latency='fixed:0.2')
+    client = yd_gateway.client
+    client.configure(transport=simulator.SimulatorAdapter(api))
+    url = f'{yd_gateway.get_api_url()}/{yd_gateway.endpoints.KEYWORD_BIDS}'
+    get = {'method': 'get', 'params': {'SelectionCriteria': {'CampaignIds': list(account.campaign_ids())},
+                                       'FieldNames': ['KeywordId']}}
+    same_get = {'params': {'FieldNames': ['KeywordId'], 'SelectionCriteria': get['params']['SelectionCriteria']},
+                'method': 'get'}
+    keyword_id = account.keyword_ids(account.ad_group_ids(account.campaign_ids()[0])[0])[0]
+    set_ = {'method': 'set', 'params': {'KeywordBids': [{'KeywordId': keyword_id, 'SearchBid': 1}]}}
+    try:
+        pools = [client.get_pool_id(), client.get_pool_id()]
+        client.pool_send(pools[0], method='POST', url=url, json=get)
+        client.pool_send(pools[1], method='POST', url=url, json=same_get)
+        client.pool_send(pools[0], method='POST', url=url, json=set_)
+        client.pool_send(pools[1], method='POST', url=url, json=set_)
+        results = [[response.result().data for response, _ in client.pool_receive(pool)] for pool in pools]
+        assert api.requests == 3
+        first, second = (next(data for data in pool if 'KeywordBids' in data['result']) for pool in results)
+        assert first == second and first is not second
+        first['result']['KeywordBids'].clear()
+        assert len(second['result']['KeywordBids']) == 2
+        # completed requests are sent again
+        pool = client.get_pool_id()
+        client.pool_send(pool, method='POST', url=url, json=get)
+        list(client.pool_receive(pool))
+        assert api.requests == 4
+    finally:
+        client.configure(transport=None)
+
+
+def test_circuit_breaker(yd_gateway):
+    now = [0]
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=1, keywords=1, login='sim')
+    api = simulator.YdApiSimulator(account, errors={52: 1})
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api), circuit_breaker=breaker)
+    try:
+        for _ in range(2):
+            with pytest.raises(exceptions.UnExpectedResult):
+                yd_gateway.get_client_login()
+        assert set(breaker.states().values()) == {'open'}
+        with pytest.raises(exceptions.CircuitOpen) as e:
+            yd_gateway.get_client_login()
+        assert e.value.retry_after == 30
+        assert api.requests == 2
+        # trial request after reset timeout fails and opens circuit again
+        now[0] = 31
+        with pytest.raises(exceptions.UnExpectedResult):
+            yd_gateway.get_client_login()
+        with pytest.raises(exceptions.CircuitOpen):
+            yd_gateway.get_client_login()
+        assert api.requests == 3
+        api.errors = {}
+        now[0] = 62
+        assert yd_gateway.get_client_login() == 'sim'
+        assert set(breaker.states().values()) == {'closed'}
+    finally:
+        yd_gateway.client.configure(transport=None, circuit_breaker=None)
+
+
+def test_circuit_trial_cut_by_deadline(yd_gateway):
+    now = [0]
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=1, keywords=1, login='sim')
+    api = simulator.YdApiSimulator(account, errors={52: 1})
+    adapter = simulator.SimulatorAdapter(api)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+    yd_gateway.client.configure(transport=adapter, circuit_breaker=breaker)
+
+    def cut(*args, **kwargs):
+        time.sleep(0.06)
+        raise requests.ConnectionError('Connection is cut')
+
+    try:
+        with pytest.raises(exceptions.UnExpectedResult):
+            yd_gateway.get_client_login()
+        now[0] = 31
+        # trial request is cut by run deadline: circuit stays half-open, but the trial is released
+        with mock.patch.object(adapter, 'send', side_effect=cut), deadline.use(deadline.Deadline(0.05)):
+            with pytest.raises(exceptions.DeadlineExceeded):
+                yd_gateway.get_client_login()
+        assert set(breaker.states().values()) == {'half-open'}
+        api.errors = {}
+        assert yd_gateway.get_client_login() == 'sim'
+        assert set(breaker.states().values()) == {'closed'}
+    finally:
+        yd_gateway.client.configure(transport=None, circuit_breaker=None)
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+def test_keep_alive():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+    http_client = client.AsyncGatewayHttpClient(max_workers=3)
+    try:
+        assert http_client.warm_up(url) == 3
+        assert http_client.warm_up(url) == 0
+        for _ in range(5):
+            assert http_client.send(method='GET', url=url).result().data == 'ok'
+        assert http_client.pool_stats()['127.0.0.1'] == {'requests': 5, 'hits': 5, 'misses': 0, 'warmed': 3,
+                                                         'idle': 3}
+        # connections are closed after idle period only
+        http_client.configure(keep_alive_idle_timeout=0.1)
+        assert http_client.reap_idle() == 0
+        time.sleep(0.15)
+        assert http_client.reap_idle() == 3
+        assert http_client.pool_stats()['127.0.0.1']['idle'] == 0
+        http_client.send(method='GET', url=url)
+        assert http_client.pool_stats()['127.0.0.1']['misses'] == 1
+        assert http_client.keep_alive(url) == 2
+        assert http_client.pool_stats()['127.0.0.1']['idle'] == 3
+        # custom transport has no connections to warm up
+        http_client.configure(transport=requests.adapters.BaseAdapter())
+        assert http_client.warm_up(url) == 0
+        assert http_client.pool_stats() == {}
+    finally:
+        server.shutdown()
+        server.server_close()
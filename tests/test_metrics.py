@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+import time
+from unittest import mock
+
+from django.test import override_settings
+
+from common import metrics
+from common.http import simulator
+
+
+def test_metrics_collect(tmpdir):
+    counter = metrics.Counter('test_counter_total', 'Test counter', ('name',))
+    gauge = metrics.Gauge('test_gauge', 'Test gauge')
+    histogram = metrics.Histogram('test_histogram', 'Test histogram', buckets=(1, 10))
+    threads = [threading.Thread(target=counter.inc, kwargs={'name': 'a'}) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    gauge.inc(2)
+    histogram.observe(0.5)
+    histogram.observe(10)
+    histogram.observe(100)
+    directory = str(tmpdir)
+    with override_settings(METRICS_DIR=directory, METRICS_FLUSH_INTERVAL=10, METRICS_FILE_TTL=3600):
+        metrics.flush()
+        # metrics of another process which has stopped flushing recently
+        data = json.loads(tmpdir.join(f'{os.getpid()}.json').read())
+        data['time'] = time.time() - 60
+        tmpdir.join('1.json').write(json.dumps(data))
+        # and of a process which has gone long ago
+        data['time'] = time.time() - 7200
+        tmpdir.join('2.json').write(json.dumps(data))
+        values = metrics.collect()
+    assert not tmpdir.join('2.json').exists()
+    assert values[('test_counter_total', 'a')] == 20
+    assert values[('test_gauge',)] == 2
+    assert values[('test_histogram',)] == [2, 2, 2, 221.0, 6]
+    text = metrics.render(values)
+    assert 'test_counter_total{name="a"} 20' in text
+    assert 'test_histogram_bucket{le="10"} 4' in text
+    assert 'test_histogram_bucket{le="+Inf"} 6' in text
+    assert 'test_histogram_count 6' in text
+
+
+def test_http_metrics(yd_gateway):
+    account = simulator.SimulatedAccount(campaigns=1, ad_groups=1, keywords=10, login='metrics_login')
+    api = simulator.YdApiSimulator(account, units_limit=1000)
+    before = {tuple(key): value for key, value in metrics.snapshot()['values']}
+    yd_gateway.client.configure(transport=simulator.SimulatorAdapter(api))
+    try:
+        assert len(list(yd_gateway.keyword_bids_gen(selection_criteria={'CampaignIds': [10_000_000]}))) == 10
+    finally:
+        yd_gateway.client.configure(transport=None)
+    after = {tuple(key): value for key, value in metrics.snapshot()['values']}
+    key = ('yd_units_spent_total', 'metrics_login')
+    assert after[key] - before.get(key, 0) == api.units_spent
+    assert after[('http_requests_in_flight', 'keywordbids')] == 0
+    key = ('http_request_duration_seconds', 'keywordbids')
+    assert after[key][-1] - before.get(key, [0])[-1] == 1
+    key = ('yd_chunk_size', 'get')
+    assert after[key][-1] - before.get(key, [0])[-1] == 1
+
+
+def test_metrics_view(client, admin_client, tmpdir):
+    with override_settings(METRICS_DIR=str(tmpdir)), mock.patch.object(metrics, 'flush') as flush:
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert '# TYPE http_request_duration_seconds histogram' in response.content.decode()
+        # metrics are labeled with logins, they are served to allowed addresses and staff only
+        assert client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code == 403
+        assert admin_client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code == 200
+    assert not flush.called
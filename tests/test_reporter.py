@@ -22,3 +22,12 @@ def test_build_result(task_result, kwb_rule):
     assert result.celery_task.id is task_result.id
     assert result.kw_bid_rule == kwb_rule
     assert result.total == 10
+
+
+def test_build_extra_data(task_result, kwb_rule):
+    builder = ExtendedTaskResultBuilder()
+    builder.build_extra_data(timings={'total': 1.0, 'stages': {}, 'bytes': {}})
+    builder.build_task_result(task_result.task_id, kwb_rule.id)
+    builder.build_total(10)
+    builder.build_result()
+    assert builder.result.extra_data == {'timings': {'total': 1.0, 'stages': {}, 'bytes': {}}}
@@ -1,4 +1,55 @@
+import json
+import marshal
+import pstats
+from unittest import mock
+
 import pytest
+from django_celery_beat.models import IntervalSchedule
+from common import timing
+from common.http import CircuitOpen
+from common.task_runner import tasks
+from common.task_runner.models import KeywordBidTask, KeywordBidTaskProfile
 from common.task_runner.tasks import calculate_keyword_bids
 
 
+def test_keyword_bid_task_profile_kwargs(kwb_rule):
+    task = KeywordBidTask(target=kwb_rule, profile=True)
+    task.save()
+    assert json.loads(task.kwargs) == {'profile': True}
+
+
+def test_profiled_run(tmpdir, kwb_rule):
+    def run(kw_bid_rule_id, run_id, time_budget=None):
+        timer = timing.StageTimer()
+        timer.start()
+        data = list(timing.timed_iter('map', (bytearray(10_000) for _ in range(100))))
+        timer.stop()
+        return [len(data)]
+
+    with mock.patch.object(tasks, 'run', run):
+        assert tasks.profiled_run('profiled_task', kwb_rule.id) == [100]
+    profile = KeywordBidTaskProfile.objects.get(task_id='profiled_task')
+    assert profile.kw_bid_rule == kwb_rule
+    assert profile.memory['peak'] >= 100 * 10_000
+    assert profile.memory['stages']['map'] >= 100 * 10_000
+    assert profile.memory['top']
+    path = tmpdir.join('run.prof')
+    path.write_binary(bytes(profile.stats))
+    assert pstats.Stats(str(path)).total_calls > 0
+    assert marshal.loads(bytes(profile.stats))
+
+
+def test_circuit_open_retry(kwb_rule):
+    def run(kw_bid_rule_id, run_id, time_budget=None):
+        raise CircuitOpen('open', retry_after=12)
+
+    with mock.patch.object(tasks, 'run', run), mock.patch.object(calculate_keyword_bids, 'retry') as retry:
+        calculate_keyword_bids.apply(args=(kwb_rule.id,))
+    assert retry.call_args[1]['countdown'] == 12
+
+
+def test_keyword_bid_task_time_budget(kwb_rule):
+    interval = IntervalSchedule.objects.create(every=10, period=IntervalSchedule.MINUTES)
+    task = KeywordBidTask(target=kwb_rule, interval=interval)
+    task.save()
+    assert json.loads(task.kwargs) == {'time_budget': 540}